@@ -233,7 +233,7 @@ qint64 ddBotImageQueue::getImage(const QString& cameraName, vtkImageData* image)
     return 0;
   }
 
-  image->DeepCopy(toVtkImage(cameraData));
+  this->copyToVtkImage(cameraData, image);
   return cameraData->mImageMessage.utime;
 }
 
@@ -431,7 +431,7 @@ void ddBotImageQueue::onImageMessage(const QByteArray& data, const QString& chan
 }
 
 //-----------------------------------------------------------------------------
-vtkSmartPointer<vtkImageData> ddBotImageQueue::toVtkImage(CameraData* cameraData)
+void ddBotImageQueue::copyToVtkImage(CameraData* cameraData, vtkImageData* image)
 {
   QMutexLocker locker(&cameraData->mMutex);
 
@@ -441,7 +441,8 @@ vtkSmartPointer<vtkImageData> ddBotImageQueue::toVtkImage(CameraData* cameraData
 
   if (buf_size == 0)
   {
-    return vtkSmartPointer<vtkImageData>::New();
+    image->Initialize();
+    return;
   }
 
   int nComponents = 3;
@@ -468,7 +469,8 @@ vtkSmartPointer<vtkImageData> ddBotImageQueue::toVtkImage(CameraData* cameraData
     else if (cameraData->mImageMessage.pixelformat != bot_core::image_t::PIXEL_FORMAT_MJPEG)
     {
       printf("Error: expected PIXEL_FORMAT_MJPEG for camera %s\n", cameraData->mName.c_str());
-      return vtkSmartPointer<vtkImageData>::New();
+      image->Initialize();
+      return;
     }
     else
     {
@@ -479,21 +481,37 @@ vtkSmartPointer<vtkImageData> ddBotImageQueue::toVtkImage(CameraData* cameraData
   }
   //else printf("already decompressed: %s\n", cameraData->mName.c_str());
 
-  vtkSmartPointer<vtkImageData> image = vtkSmartPointer<vtkImageData>::New();
-
-  image->SetWholeExtent(0, w-1, 0, h-1, 0, 0);
-  image->SetSpacing(1.0, 1.0, 1.0);
-  image->SetOrigin(0.0, 0.0, 0.0);
-  image->SetExtent(image->GetWholeExtent());
-  image->SetNumberOfScalarComponents(nComponents);
-  image->SetScalarType(componentType);
-  image->AllocateScalars();
+  // reuse the pixel buffer of the image when the image size and format
+  // are unchanged, so that streaming frames are copied without reallocation
+  int* extent = image->GetExtent();
+  vtkDataArray* scalars = image->GetPointData()->GetScalars();
+  bool reuseScalars = scalars
+    && extent[0] == 0 && extent[1] == static_cast<int>(w-1)
+    && extent[2] == 0 && extent[3] == static_cast<int>(h-1)
+    && extent[4] == 0 && extent[5] == 0
+    && scalars->GetDataType() == componentType
+    && scalars->GetNumberOfComponents() == nComponents
+    && scalars->GetNumberOfTuples() == static_cast<vtkIdType>(w*h);
+
+  if (!reuseScalars)
+  {
+    image->Initialize();
+    image->SetWholeExtent(0, w-1, 0, h-1, 0, 0);
+    image->SetSpacing(1.0, 1.0, 1.0);
+    image->SetOrigin(0.0, 0.0, 0.0);
+    image->SetExtent(image->GetWholeExtent());
+    image->SetNumberOfScalarComponents(nComponents);
+    image->SetScalarType(componentType);
+    image->AllocateScalars();
+    scalars = image->GetPointData()->GetScalars();
+  }
 
   unsigned char* outPtr = static_cast<unsigned char*>(image->GetScalarPointer(0, 0, 0));
 
   std::copy(cameraData->mImageBuffer.begin(), cameraData->mImageBuffer.end(), outPtr);
 
-  return image;
+  scalars->Modified();
+  image->Modified();
 }
 
 namespace {
@@ -133,7 +133,7 @@ protected:
   CameraData* getCameraData(const QString& cameraName);
   bool initCameraData(const QString& cameraName, CameraData* cameraData);
 
-  vtkSmartPointer<vtkImageData> toVtkImage(CameraData* cameraData);
+  void copyToVtkImage(CameraData* cameraData, vtkImageData* image);
 
   void colorizePoints(vtkPolyData* polyData, CameraData* cameraData);
 
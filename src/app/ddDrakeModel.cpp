@@ -18,6 +18,7 @@
 #include <vtkCubeSource.h>
 #include <vtkTransformPolyDataFilter.h>
 #include <vtkTransform.h>
+#include <vtkMatrix4x4.h>
 #include <vtkStringArray.h>
 #include <vtkFieldData.h>
 #include <vtkMath.h>
@@ -1218,6 +1219,63 @@ void ddDrakeModel::getModelMesh(vtkPolyData* polyData)
   polyData->DeepCopy(appendFilter->GetOutput());
 }
 
+//-----------------------------------------------------------------------------
+void ddDrakeModel::getLinkModelMesh(const QString& linkName, vtkPolyData* polyData)
+{
+  if (!polyData)
+  {
+    return;
+  }
+
+  std::vector<ddMeshVisual::Ptr> visuals = this->Internal->Model->meshVisuals();
+  vtkSmartPointer<vtkAppendPolyData> appendFilter = vtkSmartPointer<vtkAppendPolyData>::New();
+  std::string name = linkName.toAscii().data();
+  bool haveInput = false;
+
+  for (size_t i = 0; i < visuals.size(); ++i)
+  {
+    if (visuals[i]->Name == name)
+    {
+      AddInputData(appendFilter, transformPolyData(visuals[i]->PolyData, visuals[i]->VisualToLink));
+      haveInput = true;
+    }
+  }
+
+  if (haveInput)
+  {
+    appendFilter->Update();
+  }
+
+  polyData->DeepCopy(appendFilter->GetOutput());
+}
+
+//-----------------------------------------------------------------------------
+QVector<double> ddDrakeModel::getLinksToWorld(const QList<QString>& linkNames)
+{
+  // returns the 4x4 link to world matrices, in row major order,
+  // concatenated in the order of the given link names.  The matrix
+  // for a link that is not found is all zeros.
+  QVector<double> matrices(16*linkNames.size(), 0.0);
+  if (!this->Internal->Model)
+  {
+    return matrices;
+  }
+
+  for (int i = 0; i < linkNames.size(); ++i)
+  {
+    vtkSmartPointer<vtkTransform> linkToWorld = this->Internal->Model->getLinkToWorld(linkNames[i]);
+    if (linkToWorld)
+    {
+      vtkMatrix4x4* matrix = linkToWorld->GetMatrix();
+      for (int j = 0; j < 16; ++j)
+      {
+        matrices[16*i + j] = matrix->GetElement(j / 4, j % 4);
+      }
+    }
+  }
+  return matrices;
+}
+
 //-----------------------------------------------------------------------------
 void ddDrakeModel::addToRenderer(vtkRenderer* renderer)
 {
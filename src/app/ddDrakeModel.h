@@ -46,6 +46,8 @@ public:
   int findLinkID(const QString& linkName) const;
 
   void getModelMesh(vtkPolyData* polyData);
+  void getLinkModelMesh(const QString& linkName, vtkPolyData* polyData);
+  QVector<double> getLinksToWorld(const QList<QString>& linkNames);
 
   QString getLinkNameForMesh(vtkPolyData* polyData);
 
@@ -11,6 +11,10 @@
 #include <QMutexLocker>
 #include <QWaitCondition>
 #include <QTime>
+#include <QElapsedTimer>
+#include <QVariant>
+#include <QVector>
+#include <QMap>
 
 #include <lcm/lcm-cpp.hpp>
 
@@ -35,6 +39,8 @@ public:
     this->mEmitMessages = true;
     this->mNotifyAllMessages = false;
     this->mRequiredElapsedMilliseconds = 0;
+    this->mClock.start();
+    this->resetStatistics();
     this->connect(this, SIGNAL(messageReceivedInQueue(const QString&)), SLOT(onMessageInQueue(const QString&)));
   }
 
@@ -105,6 +111,65 @@ public:
     return this->mFPSCounter.averageFPS();
   }
 
+  // Upper edges, in milliseconds, of the bins of the queue delay histogram.
+  // The queue delay is the time from when a message is received on the LCM
+  // thread until the messageReceived() signal is emitted on the main thread.
+  // The last bin counts all delays greater than the last edge.
+  static QList<double> queueDelayHistogramBinEdges()
+  {
+    QList<double> edges;
+    edges << 0.1 << 0.5 << 1.0 << 5.0 << 10.0 << 50.0 << 100.0 << 500.0;
+    return edges;
+  }
+
+  // Returns a map with the statistics accumulated since the last call
+  // to resetStatistics().  Times are reported in milliseconds.  Messages
+  // are counted as dropped when they are replaced by a newer message
+  // before the main thread processes them (see notifyAllMessagesIsEnabled())
+  // or when they are skipped by the speed limit.
+  QMap<QString, QVariant> statistics() const
+  {
+    QMutexLocker locker(&this->mMutex);
+
+    QVariantList histogram;
+    foreach (int count, this->mQueueDelayHistogram)
+    {
+      histogram << count;
+    }
+
+    double elapsedSeconds = (this->mClock.nsecsElapsed()/1000 - this->mStatisticsStartTime) * 1e-6;
+
+    QMap<QString, QVariant> stats;
+    stats["messagesReceived"] = this->mMessagesReceived;
+    stats["messagesDelivered"] = this->mMessagesDelivered;
+    stats["messagesDropped"] = this->mMessagesDropped;
+    stats["bytesReceived"] = this->mBytesReceived;
+    stats["bytesPerSecond"] = elapsedSeconds > 0 ? this->mBytesReceived / elapsedSeconds : 0.0;
+    stats["averageQueueDelay"] = this->mMessagesDelivered ? this->mTotalQueueDelay * 1e-3 / this->mMessagesDelivered : 0.0;
+    stats["maxQueueDelay"] = this->mMaxQueueDelay * 1e-3;
+    stats["averageCallbackTime"] = this->mMessagesDelivered ? this->mTotalCallbackTime * 1e-3 / this->mMessagesDelivered : 0.0;
+    stats["maxCallbackTime"] = this->mMaxCallbackTime * 1e-3;
+    stats["totalCallbackTime"] = this->mTotalCallbackTime * 1e-3;
+    stats["queueDelayHistogram"] = histogram;
+    stats["elapsedTime"] = elapsedSeconds;
+    return stats;
+  }
+
+  void resetStatistics()
+  {
+    QMutexLocker locker(&this->mMutex);
+    this->mMessagesReceived = 0;
+    this->mMessagesDelivered = 0;
+    this->mMessagesDropped = 0;
+    this->mBytesReceived = 0;
+    this->mTotalQueueDelay = 0;
+    this->mMaxQueueDelay = 0;
+    this->mTotalCallbackTime = 0;
+    this->mMaxCallbackTime = 0;
+    this->mQueueDelayHistogram = QVector<int>(queueDelayHistogramBinEdges().size() + 1, 0);
+    this->mStatisticsStartTime = this->mClock.nsecsElapsed()/1000;
+  }
+
   QByteArray getNextMessage(int timeout)
   {
 
@@ -141,8 +206,29 @@ protected slots:
 
   void onMessageInQueue(const QString& channel)
   {
-    QByteArray msg = this->getNextMessage(0);
-    emit this->messageReceived(msg, channel);
+    QList<QByteArray> messages;
+    QList<qint64> receiveTimes;
+
+    this->mMutex.lock();
+    messages.swap(this->mMessageQueue);
+    receiveTimes.swap(this->mReceiveTimes);
+    if (this->mLastMessage.size())
+    {
+      messages.append(this->mLastMessage);
+      receiveTimes.append(this->mLastMessageTime);
+      this->mLastMessage.clear();
+    }
+    this->mMutex.unlock();
+
+    for (int i = 0; i < messages.size(); ++i)
+    {
+      // the python callback is called synchronously by the emit, so the
+      // elapsed time of the emit is the callback wall time
+      qint64 startTime = this->currentTime();
+      emit this->messageReceived(messages[i], channel);
+      qint64 endTime = this->currentTime();
+      this->recordDelivery(startTime - receiveTimes[i], endTime - startTime);
+    }
   }
 
 
@@ -154,33 +240,54 @@ protected:
     ddNotUsed(channel);
 
     QByteArray messageBytes = QByteArray((char*)rbuf->data, rbuf->data_size);
+    qint64 receiveTime = this->currentTime();
 
     mFPSCounter.update();
 
+    this->mMutex.lock();
+    ++this->mMessagesReceived;
+    this->mBytesReceived += rbuf->data_size;
+    this->mMutex.unlock();
+
     if (this->mEmitMessages)
     {
       if (this->mRequiredElapsedMilliseconds == 0 || mTimer.elapsed() > this->mRequiredElapsedMilliseconds)
       {
         this->mTimer.restart();
 
+        // Messages are queued and delivered by onMessageInQueue() on the
+        // main thread.  A signal is only emitted when the queue was empty,
+        // the pending signal will deliver the messages queued after it.
+        this->mMutex.lock();
+        bool doEmit = !this->mLastMessage.size() && this->mMessageQueue.isEmpty();
         if (this->mNotifyAllMessages)
         {
-          emit this->messageReceived(messageBytes, QString(channel.c_str()));
+          this->mMessageQueue.append(messageBytes);
+          this->mReceiveTimes.append(receiveTime);
         }
         else
         {
-          this->mMutex.lock();
-          bool doEmit = !this->mLastMessage.size();
-          this->mLastMessage = messageBytes;
-          this->mMutex.unlock();
-
-          if (doEmit)
+          if (this->mLastMessage.size())
           {
-            emit this->messageReceivedInQueue(QString(channel.c_str()));
+            ++this->mMessagesDropped;
           }
+          this->mLastMessage = messageBytes;
+          this->mLastMessageTime = receiveTime;
+        }
+        this->mMutex.unlock();
+
+        if (doEmit)
+        {
+          emit this->messageReceivedInQueue(QString(channel.c_str()));
         }
 
       }
+      else
+      {
+        this->mMutex.lock();
+        ++this->mMessagesDropped;
+        this->mMutex.unlock();
+      }
     }
     else
     {
@@ -192,13 +299,53 @@ protected:
 
   }
 
+  // Returns the elapsed time in microseconds on a monotonic clock.
+  qint64 currentTime() const
+  {
+    return this->mClock.nsecsElapsed() / 1000;
+  }
+
+  void recordDelivery(qint64 queueDelay, qint64 callbackTime)
+  {
+    QMutexLocker locker(&this->mMutex);
+
+    ++this->mMessagesDelivered;
+    this->mTotalQueueDelay += queueDelay;
+    this->mMaxQueueDelay = qMax(this->mMaxQueueDelay, queueDelay);
+    this->mTotalCallbackTime += callbackTime;
+    this->mMaxCallbackTime = qMax(this->mMaxCallbackTime, callbackTime);
+
+    QList<double> edges = queueDelayHistogramBinEdges();
+    int bin = 0;
+    while (bin < edges.size() && queueDelay * 1e-3 > edges[bin])
+    {
+      ++bin;
+    }
+    ++this->mQueueDelayHistogram[bin];
+  }
+
   bool mEmitMessages;
   bool mNotifyAllMessages;
   int mRequiredElapsedMilliseconds;
   mutable QMutex mMutex;
   QWaitCondition mWaitCondition;
   QByteArray mLastMessage;
+  qint64 mLastMessageTime;
+  QList<QByteArray> mMessageQueue;
+  QList<qint64> mReceiveTimes;
   ddFPSCounter mFPSCounter;
+  QElapsedTimer mClock;
+
+  qint64 mMessagesReceived;
+  qint64 mMessagesDelivered;
+  qint64 mMessagesDropped;
+  qint64 mBytesReceived;
+  qint64 mTotalQueueDelay;
+  qint64 mMaxQueueDelay;
+  qint64 mTotalCallbackTime;
+  qint64 mMaxCallbackTime;
+  qint64 mStatisticsStartTime;
+  QVector<int> mQueueDelayHistogram;
   QTime mTimer;
   QString mChannel;
   lcm::Subscription* mSubscription;
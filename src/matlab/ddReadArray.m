@@ -0,0 +1,19 @@
+function x = ddReadArray(filename)
+% Reads a matrix written by the binary array channel in ddapp/matlab.py.
+% See ddWriteArray for the file format.
+
+  fid = fopen(filename, 'r', 'ieee-le');
+  if fid < 0
+    error('ddReadArray:openFailed', 'failed to open %s', filename);
+  end
+  magic = fread(fid, 4, 'char=>char')';
+  if ~strcmp(magic, 'DDAR')
+    fclose(fid);
+    error('ddReadArray:badHeader', 'not an array file: %s', filename);
+  end
+  header = fread(fid, 3, 'uint32');
+  x = fread(fid, header(2)*header(3), 'double');
+  x = reshape(x, header(2), header(3));
+  fclose(fid);
+
+end
@@ -0,0 +1,17 @@
+function ddWriteArray(filename, x)
+% Writes a real matrix to filename as raw little-endian doubles in column
+% major order, after a header of the magic 'DDAR' and the uint32 values
+% ndims, rows and columns.  This is the MATLAB side of the binary array
+% channel in ddapp/matlab.py.
+
+  x = double(x);
+  fid = fopen(filename, 'w', 'ieee-le');
+  if fid < 0
+    error('ddWriteArray:openFailed', 'failed to open %s', filename);
+  end
+  fwrite(fid, 'DDAR', 'char');
+  fwrite(fid, [2, size(x, 1), size(x, 2)], 'uint32');
+  fwrite(fid, x(:), 'double');
+  fclose(fid);
+
+end
@@ -248,8 +248,15 @@ class MeshAffordanceItem(AffordanceItem):
     def getMeshManager(cls):
         if cls._meshManager is None:
             cls._meshManager = meshmanager.MeshManager()
+            cls._meshManager.connectMeshReceived(cls._onMeshReceived)
         return cls._meshManager
 
+    @classmethod
+    def _onMeshReceived(cls, meshManager, meshId):
+        for obj in om.getObjects():
+            if isinstance(obj, cls) and obj.getProperty('Filename') == meshId:
+                obj.updateGeometryFromProperties()
+
     @classmethod
     def promotePolyDataItem(cls, obj):
         parent = obj.parent()
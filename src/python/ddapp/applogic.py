@@ -241,6 +241,13 @@ def setupActions():
     botApyAction.connect(botApyAction, 'triggered()', botspy.startBotSpy)
     scopeAction = getToolsMenuActions()['ActionSignalScope']
     scopeAction.connect(scopeAction, 'triggered()', openscope.startSignalScope)
+    lcmStatsAction = getToolsMenuActions()['ActionLCMStatistics']
+    lcmStatsAction.connect(lcmStatsAction, 'triggered()', showLCMStatsPanel)
+
+
+def showLCMStatsPanel():
+    from ddapp import lcmstatspanel
+    lcmstatspanel.showPanel()
 
 
 def showErrorMessage(message, title='Error'):
@@ -18,6 +18,7 @@ import numpy as np
 from ddapp.simpletimer import SimpleTimer
 from ddapp import ioUtils
 import sys
+import weakref
 import drc as lcmdrc
 import multisense as lcmmultisense
 
@@ -140,15 +141,27 @@ class ImageManager(object):
         writer.Write()
 
     def updateImage(self, imageName):
+        '''
+        Copies the latest frame of the camera into its vtkImageData, if a new
+        frame has arrived since the last update.  The image keeps its pixel
+        buffer between frames, so the copy does not reallocate.  Returns the
+        utime of the latest frame.
+        '''
         imageUtime = self.queue.getCurrentImageTime(imageName)
         if imageUtime != self.imageUtimes[imageName]:
             image = self.images[imageName]
             self.imageUtimes[imageName] = self.queue.getImage(imageName, image)
         return imageUtime
 
-    def updateImages(self):
-        for imageName in self.images.keys():
-            self.updateImage(imageName)
+    def updateImages(self, imageNames=None):
+        '''
+        Updates the given images, or all images, and returns a dict that maps
+        each updated image name to the utime of its latest frame.  Views
+        should pass the images they display and only update while they are
+        visible, since each update of a new frame copies the full image.
+        '''
+        imageNames = imageNames if imageNames is not None else self.images.keys()
+        return dict((imageName, self.updateImage(imageName)) for imageName in imageNames)
 
     def hasImage(self, imageName):
         return imageName in self.images
@@ -163,22 +176,61 @@ class ImageManager(object):
         return self.textures[imageName]
 
 
+# the inputs of the last texture coordinate computation for each textured
+# object, see applyCameraTexture
+_cameraTextureKeys = weakref.WeakKeyDictionary()
+
+
 def disableCameraTexture(obj):
+    '''
+    Removes the camera texture from obj.  Returns True if the object had a
+    texture and needs to be rendered.
+    '''
+    _cameraTextureKeys.pop(obj, None)
+    if obj.actor.GetTexture() is None:
+        return False
+
     obj.actor.SetTexture(None)
     obj.actor.GetProperty().LightingOn()
     obj.actor.GetProperty().SetColor(obj.getProperty('Color'))
+    return True
 
-def applyCameraTexture(obj, imageManager, imageName='CAMERA_LEFT'):
 
+def _getCameraTextureKey(obj, imageName, imageUtime):
+    userTransform = obj.actor.GetUserTransform()
+    userMatrix = userTransform.GetMatrix() if userTransform else None
+    return (imageName, imageUtime, obj.polyData, obj.polyData.GetMTime(),
+            tuple(userMatrix.GetElement(r, c) for r in xrange(4) for c in xrange(4)) if userMatrix else None)
+
+
+def applyCameraTexture(obj, imageManager, imageName='CAMERA_LEFT'):
+    '''
+    Textures obj with the latest image of the camera.  Texture coordinates
+    are only recomputed when the camera image, the object geometry or the
+    object pose have changed since the last call.  Returns True if the
+    texture was updated and the object needs to be rendered.
+    '''
     imageUtime = imageManager.getUtime(imageName)
     if not imageUtime:
-        return
+        return False
+
+    key = _getCameraTextureKey(obj, imageName, imageUtime)
+    if _cameraTextureKeys.get(obj) == key:
+        return False
 
     cameraToLocal = vtk.vtkTransform()
     imageManager.queue.getTransform(imageName, 'local', imageUtime, cameraToLocal)
 
-    pd = filterUtils.transformPolyData(obj.polyData, obj.actor.GetUserTransform())
-    pd = filterUtils.transformPolyData(pd, cameraToLocal.GetLinearInverse())
+    # transform the points to the camera frame in a single pass
+    objectToCamera = vtk.vtkTransform()
+    objectToCamera.PostMultiply()
+    if obj.actor.GetUserTransform():
+        objectToCamera.Concatenate(obj.actor.GetUserTransform())
+    objectToCamera.Concatenate(cameraToLocal.GetLinearInverse())
+
+    pd = vtk.vtkPolyData()
+    pd.SetPoints(obj.polyData.GetPoints())
+    pd = filterUtils.transformPolyData(pd, objectToCamera)
 
     imageManager.queue.computeTextureCoords(imageName, pd)
 
@@ -194,6 +246,10 @@ def applyCameraTexture(obj, imageManager, imageName='CAMERA_LEFT'):
     obj.actor.GetProperty().LightingOff()
     obj.actor.GetProperty().SetColor([1,1,1])
 
+    # setting the tcoords modifies the polydata, so the key is computed after
+    _cameraTextureKeys[obj] = _getCameraTextureKey(obj, imageName, imageUtime)
+    return True
+
 
 class CameraView(object):
 
@@ -343,9 +399,9 @@ class CameraView(object):
     def updateImages(self):
 
         updated = False
-        for imageName, lastUtime in self.updateUtimes.iteritems():
-            currentUtime = self.imageManager.updateImage(imageName)
-            if currentUtime != lastUtime:
+        currentUtimes = self.imageManager.updateImages(self.updateUtimes.keys())
+        for imageName, currentUtime in currentUtimes.iteritems():
+            if currentUtime != self.updateUtimes[imageName]:
                 self.updateUtimes[imageName] = currentUtime
                 updated = True
 
@@ -6,14 +6,53 @@ from ddapp.shallowCopy import shallowCopy
 import numpy as np
 
 
+def getThresholdMask(polyData, arrayName, thresholdRange):
+    '''
+    Returns a boolean mask of the points whose value in the named point data
+    array is within thresholdRange, inclusive.  For arrays with more than one
+    component the first component is used.  Masks can be combined with & and |
+    before extracting the points once with extractPoints.
+    '''
+    values = vnp.getNumpyFromVtk(polyData, arrayName)
+    if values.ndim > 1:
+        values = values[:,0]
+    return getRangeMask(values, thresholdRange)
+
+
+def getRangeMask(values, thresholdRange):
+    return np.logical_and(values >= thresholdRange[0], values <= thresholdRange[1])
+
+
 def thresholdPoints(polyData, arrayName, thresholdRange):
     assert(polyData.GetPointData().GetArray(arrayName))
-    f = vtk.vtkThresholdPoints()
-    f.SetInput(polyData)
-    f.ThresholdBetween(thresholdRange[0], thresholdRange[1])
-    f.SetInputArrayToProcess(0,0,0, vtk.vtkDataObject.FIELD_ASSOCIATION_POINTS, arrayName)
-    f.Update()
-    return shallowCopy(f.GetOutput())
+    return extractPoints(polyData, getThresholdMask(polyData, arrayName, thresholdRange))
+
+
+def extractPoints(polyData, pointIds):
+    '''
+    Returns a new polyData containing the points at the given indices, with
+    vertex cells and all point data arrays copied across.  pointIds may be
+    an integer index array or a boolean mask with one entry per point.
+    '''
+    points = vnp.getNumpyFromVtk(polyData, 'Points')[pointIds]
+
+    newPolyData = vtk.vtkPolyData()
+    newPolyData.SetPoints(vnp.getVtkPointsFromNumpy(points))
+    vtk.vtkPCLConversions.AddVertexCells(newPolyData)
+
+    pointData = polyData.GetPointData()
+    for i in xrange(pointData.GetNumberOfArrays()):
+        array = pointData.GetArray(i)
+        if array is None or not array.GetName():
+            continue
+        values = vnp.numpy_support.vtk_to_numpy(array)[pointIds]
+        vnp.addNumpyToVtk(newPolyData, values, array.GetName())
+
+    normals = pointData.GetNormals()
+    if normals is not None and normals.GetName():
+        newPolyData.GetPointData().SetNormals(newPolyData.GetPointData().GetArray(normals.GetName()))
+
+    return newPolyData
 
 
 def transformPolyData(polyData, transform):
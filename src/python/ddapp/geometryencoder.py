@@ -2,6 +2,8 @@ from ddapp import vtkAll as vtk
 from ddapp import vtkNumpy as vnp
 from ddapp.shallowCopy import shallowCopy
 import numpy as np
+import struct
+import zlib
 
 def encodePolyData(polyData):
     '''Given a vtkPolyData, returns a numpy int8 array that contains
@@ -38,3 +40,83 @@ def decodePolyData(data):
     polyData = vtk.vtkPolyData()
     vtk.vtkCommunicator.UnMarshalDataObject(charArray, polyData)
     return polyData
+
+
+# binary mesh layout: header, float32 points, then int32 connectivity for
+# verts, lines and polys in the legacy vtkCellArray format [n, id0, ... idn-1]
+MESH_MAGIC = 'DDMB'
+MESH_VERSION = 1
+MESH_FLAG_COMPRESSED = 1
+
+_meshHeader = struct.Struct('<4sBBxxIIIIIII')
+
+
+def _getCellArrayNumpy(cellArray):
+    return vnp.numpy_support.vtk_to_numpy(cellArray.GetData()).astype(np.int32)
+
+
+def _setCellArrayNumpy(cellArray, numberOfCells, data):
+    if not numberOfCells:
+        return
+    ids = vnp.numpy_support.numpy_to_vtkIdTypeArray(data.astype(vnp.numpy_support.ID_TYPE_CODE), deep=1)
+    cellArray.SetCells(numberOfCells, ids)
+
+
+def encodePolyDataBinary(polyData, compress=True):
+    '''Given a vtkPolyData, returns a byte string containing the points as
+    float32 and the vert, line and poly cells as int32 connectivity arrays.
+    Point data arrays are not encoded.  If compress is True the buffers
+    following the header are zlib compressed.  The result can be passed to
+    decodePolyDataBinary.'''
+
+    if polyData.GetNumberOfPoints():
+        points = vnp.getNumpyFromVtk(polyData, 'Points').astype(np.float32)
+    else:
+        points = np.zeros((0, 3), dtype=np.float32)
+
+    cells = [polyData.GetVerts(), polyData.GetLines(), polyData.GetPolys()]
+    cellData = [_getCellArrayNumpy(c) for c in cells]
+
+    body = ''.join([points.tostring()] + [c.tostring() for c in cellData])
+    flags = 0
+    if compress:
+        body = zlib.compress(body)
+        flags |= MESH_FLAG_COMPRESSED
+
+    header = _meshHeader.pack(MESH_MAGIC, MESH_VERSION, flags, len(points),
+                              cells[0].GetNumberOfCells(), len(cellData[0]),
+                              cells[1].GetNumberOfCells(), len(cellData[1]),
+                              cells[2].GetNumberOfCells(), len(cellData[2]))
+    return header + body
+
+
+def decodePolyDataBinary(data):
+    '''Given a byte string returned by encodePolyDataBinary, constructs a
+    new vtkPolyData object and returns the result.'''
+
+    fields = _meshHeader.unpack_from(data)
+    magic, version, flags, numberOfPoints = fields[:4]
+    if magic != MESH_MAGIC or version != MESH_VERSION:
+        raise ValueError('data is not a binary encoded mesh')
+
+    body = buffer(data, _meshHeader.size)
+    if flags & MESH_FLAG_COMPRESSED:
+        body = zlib.decompress(body)
+
+    offset = numberOfPoints*3*4
+    points = np.frombuffer(body, dtype=np.float32, count=numberOfPoints*3).reshape((numberOfPoints, 3))
+
+    polyData = vtk.vtkPolyData()
+    polyData.SetPoints(vnp.getVtkPointsFromNumpy(points.copy()))
+
+    cellArrays = [vtk.vtkCellArray(), vtk.vtkCellArray(), vtk.vtkCellArray()]
+    for cellArray, numberOfCells, numberOfValues in zip(cellArrays, fields[4::2], fields[5::2]):
+        cellData = np.frombuffer(body, dtype=np.int32, count=numberOfValues, offset=offset)
+        _setCellArrayNumpy(cellArray, numberOfCells, cellData)
+        offset += numberOfValues*4
+
+    verts, lines, polys = cellArrays
+    polyData.SetVerts(verts)
+    polyData.SetLines(lines)
+    polyData.SetPolys(polys)
+    return polyData
@@ -70,6 +70,7 @@ class AsyncIKCommunicator():
         taskQueue.addTask(self._checkServerRestarted)
         taskQueue.addTask(self._sendStartupCommands)
         taskQueue.addTask(self._checkServerStartup)
+        taskQueue.addTask(self._enableArrayChannel)
         taskQueue.addTask(self._notifyStartupCompleted)
         taskQueue.addTask(functools.partial(setattr, self.comm, 'echoToStdOut', True))
 
@@ -86,6 +87,17 @@ class AsyncIKCommunicator():
         started = self.comm.getFloatArray("exist('ikServerStarted')")
         self.ready = len(started) and started[0] == 1
 
+    def _enableArrayChannel(self):
+        '''
+        Poses are transferred through the binary array channel when matlab
+        runs on the local host, where it can read the transfer files.
+        '''
+        if not self.ready:
+            return
+        client = self.comm.client
+        if isinstance(client, matlab.MatlabPipeClient) or client.host in ('127.0.0.1', 'localhost'):
+            self.comm.enableArrayChannel()
+
     def _checkServerRestarted(self):
         self._checkServerStartup()
         self.restarted = self.ready
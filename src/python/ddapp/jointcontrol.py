@@ -67,10 +67,12 @@ class JointController(object):
         matData = scipy.io.loadmat(filename)
         return np.array(matData['xstar'][:self.numberOfJoints].flatten(), dtype=float)
 
-    def addLCMUpdater(self, channelName):
+    def addLCMUpdater(self, channelName, decodeInThread=False):
         '''
         adds an lcm subscriber to update the joint positions from
-        lcm robot_state_t messages
+        lcm robot_state_t messages.  If decodeInThread is True the
+        messages are decoded off the main thread, see lcmUtils.addSubscriber,
+        and the joint_position of lastRobotStateMessage is a numpy array.
         '''
 
         def onRobotStateMessage(msg):
@@ -88,7 +90,8 @@ class JointController(object):
             for model in self.models:
                 model.model.setJointPositions(jointPositions, jointNames)
 
-        self.subscriber = lcmUtils.addSubscriber(channelName, lcmdrc.robot_state_t, onRobotStateMessage)
+        self.subscriber = lcmUtils.addSubscriber(channelName, lcmdrc.robot_state_t, onRobotStateMessage,
+                                                 decodeInThread=decodeInThread, arrayFields=['joint_position'])
         self.subscriber.setSpeedLimit(60)
 
     def removeLCMUpdater(self):
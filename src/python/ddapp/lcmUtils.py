@@ -10,11 +10,17 @@ import tempfile
 import imp
 import sys
 import re
+import select
+import threading
+import time
+import numpy as np
+from ddapp.timercallback import TimerCallback
 
 class GlobalLCM(object):
 
   _handle = None
   _lcmThread = None
+  _decodeThread = None
 
   @classmethod
   def get(cls):
@@ -30,12 +36,26 @@ class GlobalLCM(object):
           cls._lcmThread.start()
       return cls._lcmThread
 
+  @classmethod
+  def getDecodeThread(cls):
+      if cls._decodeThread == None:
+          cls._decodeThread = DecodeThread()
+          atexit.register(cls.finalizeDecodeThread)
+          cls._decodeThread.start()
+      return cls._decodeThread
+
   @classmethod
   def finalize(cls):
       if cls._lcmThread:
           cls._lcmThread.delete()
           cls._lcmThread = None
 
+  @classmethod
+  def finalizeDecodeThread(cls):
+      if cls._decodeThread:
+          cls._decodeThread.stop()
+          cls._decodeThread = None
+
 
 def getGlobalLCM():
     return GlobalLCM.get()
@@ -45,6 +65,265 @@ def getGlobalLCMThread():
     return GlobalLCM.getThread()
 
 
+def getGlobalDecodeThread():
+    return GlobalLCM.getDecodeThread()
+
+
+class DecodeThread(object):
+    '''
+    Receives and decodes LCM messages on a Python worker thread.  The thread
+    uses its own LCM handle, so message bytes are received as Python strings
+    without the QByteArray copy of the ddLCMThread path.  Decoded messages
+    are handed to the main thread by a timer that runs at deliveryFps and
+    calls the subscriber callbacks.
+
+    The decode still holds the GIL, so it competes with the main thread for
+    the interpreter.  The thread therefore only decodes messages that will
+    be delivered: unless notify all messages is enabled, a subscriber's
+    received data is coalesced and the newest message is decoded only after
+    the previous decoded message was delivered, which bounds the decode work
+    to the delivery rate instead of the message rate.
+    '''
+
+    def __init__(self, deliveryFps=200):
+        self.lcmHandle = lcm.LCM()
+        self.subscribers = []
+        self.selectTimeout = 0.3
+        self.deferredDecodeTimeout = 1.0/deliveryFps
+        # subscription changes from the main thread are serialized with
+        # handle() on the worker thread
+        self._handleLock = threading.Lock()
+        self._stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.timer = TimerCallback(targetFps=deliveryFps)
+        self.timer.callback = self._deliverMessages
+
+    def start(self):
+        self._stopEvent.clear()
+        self.thread.start()
+        self.timer.start()
+
+    def stop(self):
+        self._stopEvent.set()
+        self.thread.join()
+        self.timer.stop()
+
+    def addSubscriber(self, subscriber):
+        with self._handleLock:
+            subscriber.subscription = self.lcmHandle.subscribe(subscriber.channel(), subscriber._onMessage)
+            self.subscribers.append(subscriber)
+
+    def removeSubscriber(self, subscriber):
+        with self._handleLock:
+            if subscriber in self.subscribers:
+                self.lcmHandle.unsubscribe(subscriber.subscription)
+                subscriber.subscription = None
+                self.subscribers.remove(subscriber)
+
+    def _run(self):
+        fileno = self.lcmHandle.fileno()
+        decodeDeferred = False
+        while not self._stopEvent.is_set():
+            timeout = self.deferredDecodeTimeout if decodeDeferred else self.selectTimeout
+            readyList = select.select([fileno], [], [], timeout)[0]
+            if readyList and not self._stopEvent.is_set():
+                with self._handleLock:
+                    self.lcmHandle.handle()
+
+            decodeDeferred = False
+            for subscriber in list(self.subscribers):
+                if subscriber._decodePendingData():
+                    decodeDeferred = True
+
+    def _deliverMessages(self):
+        for subscriber in list(self.subscribers):
+            subscriber._deliverMessages()
+
+
+def _getQueueDelayHistogramBinEdges():
+    return list(PythonQt.dd.ddLCMSubscriber.queueDelayHistogramBinEdges())
+
+
+class SubscriberStatistics(object):
+    '''
+    Accumulates the statistics of a ThreadedSubscriber.  statistics() returns
+    the same keys, in the same units, as ddLCMSubscriber.statistics(), so
+    threaded subscribers are shown in the lcmstatspanel with the others.
+    '''
+
+    def __init__(self):
+        self.binEdges = _getQueueDelayHistogramBinEdges()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.messagesReceived = 0
+            self.messagesDelivered = 0
+            self.messagesDropped = 0
+            self.bytesReceived = 0
+            self.totalQueueDelay = 0.0
+            self.maxQueueDelay = 0.0
+            self.totalCallbackTime = 0.0
+            self.maxCallbackTime = 0.0
+            self.queueDelayHistogram = [0]*(len(self.binEdges) + 1)
+            self.startTime = time.time()
+
+    def recordReceived(self, numberOfBytes):
+        with self._lock:
+            self.messagesReceived += 1
+            self.bytesReceived += numberOfBytes
+
+    def recordDropped(self, numberOfMessages=1):
+        with self._lock:
+            self.messagesDropped += numberOfMessages
+
+    def recordDelivery(self, queueDelay, callbackTime):
+        '''
+        Records a delivered message.  Times are given in seconds.
+        '''
+        queueDelay *= 1e3
+        callbackTime *= 1e3
+        with self._lock:
+            self.messagesDelivered += 1
+            self.totalQueueDelay += queueDelay
+            self.maxQueueDelay = max(self.maxQueueDelay, queueDelay)
+            self.totalCallbackTime += callbackTime
+            self.maxCallbackTime = max(self.maxCallbackTime, callbackTime)
+            self.queueDelayHistogram[np.searchsorted(self.binEdges, queueDelay)] += 1
+
+    def getStatistics(self):
+        with self._lock:
+            elapsed = time.time() - self.startTime
+            delivered = self.messagesDelivered
+            return dict(messagesReceived=self.messagesReceived,
+                        messagesDelivered=delivered,
+                        messagesDropped=self.messagesDropped,
+                        bytesReceived=self.bytesReceived,
+                        bytesPerSecond=self.bytesReceived/elapsed if elapsed > 0 else 0.0,
+                        averageQueueDelay=self.totalQueueDelay/delivered if delivered else 0.0,
+                        maxQueueDelay=self.maxQueueDelay,
+                        averageCallbackTime=self.totalCallbackTime/delivered if delivered else 0.0,
+                        maxCallbackTime=self.maxCallbackTime,
+                        totalCallbackTime=self.totalCallbackTime,
+                        queueDelayHistogram=list(self.queueDelayHistogram),
+                        elapsedTime=elapsed)
+
+
+class ThreadedSubscriber(object):
+    '''
+    A subscriber whose messages are decoded on the DecodeThread.  As with
+    ddLCMSubscriber, if notify all messages is disabled then only the most
+    recent message is delivered to the callback, and superseded messages
+    are dropped before they are decoded.  The names listed in arrayFields
+    are converted from lists to numpy arrays on the worker thread, so high
+    rate consumers do not pay for the conversion on the main thread.  The
+    generated lcm decode still builds the lists first: the offsets of array
+    fields in lcm messages depend on the lengths of the variable length
+    fields before them, so the arrays are not read from the message bytes
+    directly.  Construct instances with addSubscriber(decodeInThread=True).
+    '''
+
+    def __init__(self, channel, messageClass, callback, arrayFields=None):
+        self._channel = channel
+        self.messageClass = messageClass
+        self.callback = callback
+        self.arrayFields = list(arrayFields or [])
+        self.subscription = None
+        self._notifyAllMessages = False
+        self._requiredElapsedTime = 0.0
+        self._lastMessageTime = 0.0
+        self._pendingData = []
+        self._pendingMessages = []
+        self._lock = threading.Lock()
+        self._statistics = SubscriberStatistics()
+
+    def channel(self):
+        return self._channel
+
+    def setNotifyAllMessagesEnabled(self, enabled):
+        self._notifyAllMessages = enabled
+
+    def notifyAllMessagesIsEnabled(self):
+        return self._notifyAllMessages
+
+    def setSpeedLimit(self, hertz):
+        self._requiredElapsedTime = 1.0/hertz if hertz > 0.0 else 0.0
+
+    def statistics(self):
+        return self._statistics.getStatistics()
+
+    def resetStatistics(self):
+        self._statistics.reset()
+
+    def _onMessage(self, channel, messageData):
+        '''
+        Called by handle() on the worker thread.  Only stores the data, the
+        decode happens in _decodePendingData.
+        '''
+        self._statistics.recordReceived(len(messageData))
+
+        now = time.time()
+        if self._requiredElapsedTime:
+            if now - self._lastMessageTime < self._requiredElapsedTime:
+                self._statistics.recordDropped()
+                return
+            self._lastMessageTime = now
+
+        with self._lock:
+            if not self._notifyAllMessages and self._pendingData:
+                self._statistics.recordDropped(len(self._pendingData))
+                del self._pendingData[:]
+            self._pendingData.append((now, messageData))
+
+    def _decode(self, messageData):
+        try:
+            msg = self.messageClass.decode(messageData)
+        except ValueError:
+            print 'error decoding message on channel:', self._channel
+            return None
+
+        for field in self.arrayFields:
+            setattr(msg, field, np.array(getattr(msg, field)))
+        return msg
+
+    def _decodePendingData(self):
+        '''
+        Decodes the received data on the worker thread.  Unless notify all
+        messages is enabled, the decode waits until the main thread has
+        taken the previous message, since a newer message may still replace
+        the data.  Returns True if there is data waiting to be decoded.
+        '''
+        with self._lock:
+            if not self._pendingData:
+                return False
+            if not self._notifyAllMessages and self._pendingMessages:
+                return True
+            pendingData = self._pendingData
+            self._pendingData = []
+
+        messages = []
+        for receiveTime, messageData in pendingData:
+            msg = self._decode(messageData)
+            if msg is not None:
+                messages.append((receiveTime, msg))
+
+        with self._lock:
+            self._pendingMessages.extend(messages)
+        return False
+
+    def _deliverMessages(self):
+        with self._lock:
+            messages = self._pendingMessages
+            self._pendingMessages = []
+
+        for receiveTime, msg in messages:
+            startTime = time.time()
+            self.callback(msg)
+            self._statistics.recordDelivery(startTime - receiveTime, time.time() - startTime)
+
+
 def captureMessage(channel, messageClass, lcmHandle=None):
 
     lcmHandle = lcmHandle or getGlobalLCM()
@@ -95,7 +374,32 @@ def captureMessageCallback(channel, messageClass, callback):
     return subscriber
 
 
-def addSubscriber(channel, messageClass=None, callback=None, historicalLoader=None):
+_subscribers = []
+
+
+def getSubscribers():
+    '''
+    Returns the subscribers that were created by addSubscriber and have not
+    been removed with removeSubscriber.
+    '''
+    return list(_subscribers)
+
+
+def addSubscriber(channel, messageClass=None, callback=None, historicalLoader=None, decodeInThread=False, arrayFields=None):
+    '''
+    Subscribes to the given channel.  If messageClass is given then the
+    callback receives decoded messages, otherwise it receives the message
+    bytes and channel name.  If decodeInThread is True then messages are
+    decoded on the DecodeThread instead of the main thread, and the fields
+    named in arrayFields are delivered as numpy arrays; see ThreadedSubscriber.
+    '''
+
+    if decodeInThread:
+        assert messageClass is not None and callback is not None
+        subscriber = ThreadedSubscriber(channel, messageClass, callback, arrayFields)
+        getGlobalDecodeThread().addSubscriber(subscriber)
+        _subscribers.append(subscriber)
+        return subscriber
 
     lcmThread = getGlobalLCMThread()
     subscriber = PythonQt.dd.ddLCMSubscriber(channel, lcmThread)
@@ -126,10 +430,18 @@ def addSubscriber(channel, messageClass=None, callback=None, historicalLoader=No
         subscriber.setCallbackEnabled(False)
 
     lcmThread.addSubscriber(subscriber)
+    _subscribers.append(subscriber)
     return subscriber
 
 
 def removeSubscriber(subscriber):
+    if subscriber in _subscribers:
+        _subscribers.remove(subscriber)
+
+    if isinstance(subscriber, ThreadedSubscriber):
+        getGlobalDecodeThread().removeSubscriber(subscriber)
+        return
+
     lcmThread = getGlobalLCMThread()
     lcmThread.removeSubscriber(subscriber)
     if subscriber.parent() == lcmThread:
@@ -0,0 +1,211 @@
+'''
+Extracts message fields from LCM logs into numpy columns.
+
+The fields to extract are named by field paths of the form
+CHANNEL.field.subfield, for example EST_ROBOT_STATE.joint_velocity.  Only
+the events on the named channels are read, using the log index from
+lcmlogindex, and the columns are preallocated from the per channel event
+counts of the index.  The extraction can be split into byte ranges of the
+log that are decoded in parallel worker processes.
+
+Extracted columns are cached as npy files next to the log index, so a second
+analysis of the same log and fields memory maps the columns without reading
+the log.
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import itertools
+import multiprocessing
+import numpy as np
+
+from ddapp import lcmspy as spy
+from ddapp import lcmlogindex
+
+
+def parseFieldPath(fieldPath):
+    '''
+    Splits CHANNEL.field.subfield into the channel and the field names.
+    '''
+    channel, _, fieldName = fieldPath.partition('.')
+    if not fieldName:
+        raise ValueError('field path must have the form CHANNEL.field: %s' % fieldPath)
+    if fieldName == 'timestamp':
+        raise ValueError('timestamp is reserved for the log timestamps: %s' % fieldPath)
+    return channel, fieldName
+
+
+def getFieldValue(msg, fieldName):
+    for name in fieldName.split('.'):
+        msg = getattr(msg, name)
+    return msg
+
+
+def _decodeEvents(filename, channel, fieldNames, offsets):
+    '''
+    Decodes the events at the given offsets and returns a dict of columns
+    for the given field names.
+    '''
+    index = lcmlogindex.LCMLogIndex(filename)
+    columns = {}
+    messageClass = None
+
+    for i, offset in enumerate(offsets):
+
+        data = index.readEvent(offset).data
+
+        # the message class is looked up once per channel, unless the
+        # message type on the channel changes
+        try:
+            msg = messageClass.decode(data)
+        except (AttributeError, ValueError):
+            messageClass = spy.getMessageClass(data)
+            if messageClass is None:
+                raise ValueError('failed to decode message on channel: %s' % channel)
+            msg = messageClass.decode(data)
+
+        for fieldName in fieldNames:
+            value = np.asarray(getFieldValue(msg, fieldName))
+            column = columns.get(fieldName)
+            if column is None:
+                if value.dtype == object:
+                    raise ValueError('field is not numeric: %s.%s' % (channel, fieldName))
+                column = np.empty((len(offsets),) + value.shape, dtype=value.dtype)
+                columns[fieldName] = column
+            elif value.shape != column.shape[1:]:
+                raise ValueError('field %s.%s changes shape from %s to %s' % (channel, fieldName, column.shape[1:], value.shape))
+            column[i] = value
+
+    index.close()
+    return columns
+
+
+def _decodeEventsWorker(args):
+    return _decodeEvents(*args)
+
+
+def _getCacheDirectory(index, fieldPaths):
+    key = hashlib.sha1(json.dumps(sorted(fieldPaths))).hexdigest()
+    return os.path.join(index.indexDir, 'columns_%s' % key)
+
+
+def _loadCache(cacheDir, index):
+    try:
+        meta = json.load(open(os.path.join(cacheDir, 'columns.json'), 'r'))
+    except (IOError, ValueError):
+        return None
+
+    # a log replaced by another one can be indexed up to the same
+    # position, so the log header is compared as well
+    if meta.get('header') != index.getLogHeader() or meta['nextEventPos'] != index.getNextEventPosition():
+        return None
+
+    tables = {}
+    for channel, columnFiles in meta['channels'].iteritems():
+        tables[str(channel)] = dict((str(name), np.load(os.path.join(cacheDir, columnFile), mmap_mode='r'))
+                                    for name, columnFile in columnFiles.iteritems())
+    return tables
+
+
+def _writeCache(cacheDir, index, tables):
+
+    # columns are written to a temporary directory which then replaces the
+    # previous cache, so readers never see a partially written cache
+    tempDir = '%s.%d.tmp' % (cacheDir, os.getpid())
+    os.makedirs(tempDir)
+
+    channels = {}
+    columnIds = itertools.count()
+    for channel, table in tables.iteritems():
+        columnFiles = {}
+        for name, column in table.iteritems():
+            columnFile = 'column_%d.npy' % columnIds.next()
+            np.save(os.path.join(tempDir, columnFile), column)
+            columnFiles[name] = columnFile
+        channels[channel] = columnFiles
+
+    meta = dict(header=index.getLogHeader(), nextEventPos=index.getNextEventPosition(), channels=channels)
+    json.dump(meta, open(os.path.join(tempDir, 'columns.json'), 'w'))
+
+    if os.path.isdir(cacheDir):
+        shutil.rmtree(cacheDir)
+    os.rename(tempDir, cacheDir)
+
+
+def extractColumns(filename, fieldPaths, numberOfWorkers=1, useCache=True):
+    '''
+    Returns a dict that maps each channel named in fieldPaths to a table of
+    columns.  A table is a dict that maps each requested field name of the
+    channel to a numpy array with one row per event, and 'timestamp' to the
+    log timestamps of the events.  For example:
+
+        tables = extractColumns(logFile, ['EST_ROBOT_STATE.joint_velocity'])
+        velocities = tables['EST_ROBOT_STATE']['joint_velocity']
+
+    If numberOfWorkers is greater than one, the log is split into that many
+    byte ranges which are decoded in parallel processes.  Columns loaded
+    from the cache are read-only memory mapped arrays.
+    '''
+    index = lcmlogindex.getLogIndex(filename)
+
+    cacheDir = _getCacheDirectory(index, fieldPaths)
+    if useCache:
+        tables = _loadCache(cacheDir, index)
+        if tables is not None:
+            return tables
+
+    fieldNames = {}
+    for fieldPath in fieldPaths:
+        channel, fieldName = parseFieldPath(fieldPath)
+        fieldNames.setdefault(channel, [])
+        if fieldName not in fieldNames[channel]:
+            fieldNames[channel].append(fieldName)
+
+    # split the events of each channel into byte ranges of the log file
+    numberOfWorkers = max(1, numberOfWorkers)
+    boundaries = np.linspace(0, index.getNextEventPosition(), numberOfWorkers + 1)
+
+    jobs = []
+    for channel in sorted(fieldNames.keys()):
+        offsets = index.getOffsets(channel)
+        rangeIds = np.clip(np.searchsorted(boundaries, offsets, side='right') - 1, 0, numberOfWorkers - 1)
+        for rangeId in xrange(numberOfWorkers):
+            rowIds = np.flatnonzero(rangeIds == rangeId)
+            if len(rowIds):
+                jobs.append((channel, rowIds, (filename, channel, fieldNames[channel], offsets[rowIds].tolist())))
+
+    if numberOfWorkers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(numberOfWorkers)
+        try:
+            results = pool.map(_decodeEventsWorker, [job[2] for job in jobs])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_decodeEventsWorker(job[2]) for job in jobs]
+
+    tables = {}
+    for channel in fieldNames:
+        numberOfEvents = index.getMessageCount(channel)
+        table = dict(timestamp=np.array(index.getUtimes(channel)))
+        for fieldName in fieldNames[channel]:
+            table[fieldName] = np.zeros(0) if not numberOfEvents else None
+        tables[channel] = table
+
+    for (channel, rowIds, _), columns in zip(jobs, results):
+        table = tables[channel]
+        for fieldName, column in columns.iteritems():
+            if table[fieldName] is None:
+                table[fieldName] = np.empty((index.getMessageCount(channel),) + column.shape[1:], dtype=column.dtype)
+            elif column.shape[1:] != table[fieldName].shape[1:]:
+                raise ValueError('field %s.%s changes shape from %s to %s' % (channel, fieldName, table[fieldName].shape[1:], column.shape[1:]))
+            table[fieldName][rowIds] = column
+
+    index.close()
+
+    if useCache:
+        _writeCache(cacheDir, index, tables)
+
+    return tables
@@ -0,0 +1,366 @@
+'''
+A persistent, seekable index for LCM log files.
+
+The index is stored in a sidecar directory next to the log file, or in a
+per-user cache directory if the log directory is not writable.  For each
+channel it holds an array of (utime, offset) records, one per event, where
+offset is the byte position of the event in the log file.  The record files
+are memory mapped when they are read, so opening the index of a multi-GB log
+is instant, and time seeks are binary searches on the utime arrays.
+
+The index is built incrementally: update() only scans the events that were
+appended to the log since the last update, which makes it suitable for logs
+that are still being written.  The scan reads the event headers and seeks
+past the event data, so indexing does not read the message payloads.
+
+Record files are only ever appended to, so arrays mapped by readers stay
+valid while the index is updated.  When the index is rebuilt for a replaced
+log it is written to new record files, and the old files are unlinked, which
+keeps existing mappings of them valid.
+'''
+
+import os
+import glob
+import json
+import shutil
+import struct
+import hashlib
+import numpy as np
+
+
+INDEX_VERSION = 1
+
+# lcm event log format: sync word, event number, timestamp, channel length,
+# data length, all big-endian, followed by the channel name and the data
+_eventHeader = struct.Struct('>Iqqii')
+_syncWord = 0xEDA1DA01
+_syncBytes = struct.pack('>I', _syncWord)
+
+_recordType = np.dtype([('utime', '<i8'), ('offset', '<i8')])
+
+
+class LCMLogEvent(object):
+    '''
+    An event read from a log.  The attributes match lcm.Event.
+    '''
+
+    def __init__(self, eventnum, timestamp, channel, data):
+        self.eventnum = eventnum
+        self.timestamp = timestamp
+        self.channel = channel
+        self.data = data
+
+
+def getIndexDirectory(filename):
+    '''
+    Returns the sidecar directory of the index of the given log file.
+    '''
+    filename = os.path.abspath(filename)
+    logDir, logName = os.path.split(filename)
+    if os.access(logDir, os.W_OK):
+        return os.path.join(logDir, '.%s.index' % logName)
+    else:
+        return os.path.join(os.path.expanduser('~/.cache/director/lcmlogindex'), hashlib.sha1(filename).hexdigest())
+
+
+def removeIndex(filename):
+    '''
+    Removes the index of the given log file, if it exists.
+    '''
+    indexDir = getIndexDirectory(filename)
+    if os.path.isdir(indexDir):
+        shutil.rmtree(indexDir)
+
+
+class LCMLogIndex(object):
+    '''
+    Maps each channel of an LCM log to its sorted event utimes and the file
+    offsets of those events.  Use getLogIndex() to get an up to date index.
+    '''
+
+    # the number of records that update() holds in memory before appending
+    # them to the record files
+    flushSize = 100000
+
+    def __init__(self, filename, indexDir=None):
+        self.filename = filename
+        self.indexDir = indexDir or getIndexDirectory(filename)
+        self.logFile = None
+        self._records = {}
+        self._loadMetaData()
+
+    def _newMetaData(self, generation=0):
+        return dict(version=INDEX_VERSION, generation=generation, fileSize=0, nextEventPos=0, header='', channels={})
+
+    def _getMetaDataFilename(self):
+        return os.path.join(self.indexDir, 'index.json')
+
+    def _getRecordFilename(self, channel):
+        return os.path.join(self.indexDir, self.meta['channels'][channel]['file'])
+
+    def _loadMetaData(self):
+        try:
+            self.meta = json.load(open(self._getMetaDataFilename(), 'r'))
+        except (IOError, ValueError):
+            self.meta = self._newMetaData()
+
+        if self.meta.get('version') != INDEX_VERSION:
+            self.meta = self._newMetaData()
+
+    def _writeMetaData(self):
+        filename = self._getMetaDataFilename()
+        tempFilename = '%s.%d.tmp' % (filename, os.getpid())
+        json.dump(self.meta, open(tempFilename, 'w'))
+        os.rename(tempFilename, filename)
+
+    def _getLogHeader(self, f):
+        f.seek(0)
+        return f.read(_eventHeader.size).encode('hex')
+
+    def _findSyncWord(self, f, pos):
+        '''
+        Returns the position of the next sync word at or after pos, or None.
+        '''
+        chunkSize = 64*1024
+        while True:
+            f.seek(pos)
+            chunk = f.read(chunkSize + len(_syncBytes) - 1)
+            if len(chunk) < len(_syncBytes):
+                return None
+            i = chunk.find(_syncBytes)
+            if i >= 0:
+                return pos + i
+            pos += chunkSize
+
+    def update(self):
+        '''
+        Indexes the events appended to the log since the last update.  The
+        index is rebuilt if the log file was truncated or replaced.  Returns
+        the number of new events.
+        '''
+        # the header is compared before the size, so a log replaced by one
+        # of the same size is still detected
+        f = open(self.filename, 'rb')
+        fileSize = os.fstat(f.fileno()).st_size
+        header = self._getLogHeader(f)
+        rebuild = fileSize < self.meta['fileSize'] or header != self.meta['header']
+        if rebuild:
+            self.meta = self._newMetaData(self.meta.get('generation', 0) + 1)
+            self.meta['header'] = header
+            self._records = {}
+        elif fileSize == self.meta['fileSize']:
+            f.close()
+            return 0
+
+        if not os.path.isdir(self.indexDir):
+            os.makedirs(self.indexDir)
+
+        newRecords = {}
+        numberOfRecords = 0
+        numberOfEvents = 0
+        pos = self.meta['nextEventPos']
+
+        while True:
+            f.seek(pos)
+            headerBytes = f.read(_eventHeader.size)
+            if len(headerBytes) < _eventHeader.size:
+                break
+
+            sync, eventNumber, utime, channelLength, dataLength = _eventHeader.unpack(headerBytes)
+            if sync != _syncWord or channelLength < 0 or dataLength < 0:
+                syncPos = self._findSyncWord(f, pos + 1)
+                if syncPos is None:
+                    break
+                pos = syncPos
+                continue
+
+            nextPos = pos + _eventHeader.size + channelLength + dataLength
+            if nextPos > fileSize:
+                # the last event is still being written
+                break
+
+            channel = f.read(channelLength)
+            newRecords.setdefault(channel, []).append((utime, pos))
+            numberOfRecords += 1
+            pos = nextPos
+
+            if numberOfRecords == self.flushSize:
+                numberOfEvents += self._flushRecords(newRecords)
+                numberOfRecords = 0
+
+        f.close()
+
+        numberOfEvents += self._flushRecords(newRecords)
+        self.meta['fileSize'] = fileSize
+        self.meta['nextEventPos'] = pos
+        self._writeMetaData()
+
+        if rebuild:
+            self._removeUnusedRecordFiles()
+        return numberOfEvents
+
+    def _flushRecords(self, newRecords):
+        '''
+        Appends the given records to the record files and clears them.
+        Returns the number of records written.
+        '''
+        numberOfRecords = 0
+        for channel, records in newRecords.iteritems():
+            numberOfRecords += len(records)
+            self._appendRecords(channel, np.array(records, dtype=_recordType))
+        newRecords.clear()
+        return numberOfRecords
+
+    def _removeUnusedRecordFiles(self):
+        usedFiles = set(channelInfo['file'] for channelInfo in self.meta['channels'].itervalues())
+        for filename in glob.glob(os.path.join(self.indexDir, 'channel_*.bin')):
+            if os.path.basename(filename) not in usedFiles:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+    def _appendRecords(self, channel, records):
+
+        channels = self.meta['channels']
+        channelInfo = channels.get(channel)
+        if channelInfo is None:
+            channelInfo = dict(file='channel_%d_%04d.bin' % (self.meta.get('generation', 0), len(channels)), count=0, sorted=True)
+            channels[channel] = channelInfo
+
+        count = channelInfo['count']
+        if channelInfo['sorted']:
+            lastUtime = self.getUtimes(channel)[-1] if count else None
+            utimes = records['utime']
+            if (lastUtime is not None and utimes[0] < lastUtime) or np.any(np.diff(utimes) < 0):
+                channelInfo['sorted'] = False
+
+        # records past the count were written by an interrupted update
+        filename = self._getRecordFilename(channel)
+        f = open(filename, 'r+b' if os.path.isfile(filename) else 'wb')
+        f.seek(count*_recordType.itemsize)
+        f.write(records.tostring())
+        f.truncate()
+        f.close()
+
+        channelInfo['count'] = count + len(records)
+        self._records.pop(channel, None)
+
+    def getNextEventPosition(self):
+        '''
+        Returns the file offset up to which the log has been indexed.
+        '''
+        return self.meta['nextEventPos']
+
+    def getLogHeader(self):
+        '''
+        Returns the hex encoded header of the first event of the indexed log,
+        which identifies the log file.
+        '''
+        return self.meta['header']
+
+    def getChannels(self):
+        return sorted(self.meta['channels'].keys())
+
+    def getMessageCount(self, channel):
+        channelInfo = self.meta['channels'].get(channel)
+        return channelInfo['count'] if channelInfo else 0
+
+    def getEvents(self, channel):
+        '''
+        Returns the (utime, offset) records of the channel sorted by utime.
+        The records are memory mapped from the index.
+        '''
+        records = self._records.get(channel)
+        if records is not None:
+            return records
+
+        count = self.getMessageCount(channel)
+        if not count:
+            return np.zeros(0, dtype=_recordType)
+
+        records = np.memmap(self._getRecordFilename(channel), dtype=_recordType, mode='r', shape=(count,))
+        if not self.meta['channels'][channel]['sorted']:
+            records = records[np.argsort(records['utime'], kind='mergesort')]
+
+        self._records[channel] = records
+        return records
+
+    def getUtimes(self, channel):
+        return self.getEvents(channel)['utime']
+
+    def getOffsets(self, channel):
+        return self.getEvents(channel)['offset']
+
+    def getTimeRange(self):
+        '''
+        Returns the (first, last) utime of the log, or None for an empty log.
+        '''
+        utimes = [self.getUtimes(channel) for channel in self.getChannels()]
+        utimes = [u for u in utimes if len(u)]
+        if not utimes:
+            return None
+        return min(u[0] for u in utimes), max(u[-1] for u in utimes)
+
+    def findEvent(self, channel, utime):
+        '''
+        Returns the index of the first event on the channel at or after utime,
+        clamped to the last event, or None if the channel has no events.
+        '''
+        utimes = self.getUtimes(channel)
+        if not len(utimes):
+            return None
+        return min(utimes.searchsorted(utime), len(utimes) - 1)
+
+    def getEventsInRange(self, channel, startUtime=None, endUtime=None):
+        '''
+        Returns the records of the channel with startUtime <= utime < endUtime.
+        '''
+        events = self.getEvents(channel)
+        utimes = events['utime']
+        start = utimes.searchsorted(startUtime) if startUtime is not None else 0
+        end = utimes.searchsorted(endUtime) if endUtime is not None else len(utimes)
+        return events[start:end]
+
+    def readEvent(self, offset):
+        '''
+        Reads the event at the given file offset.
+        '''
+        if self.logFile is None:
+            self.logFile = open(self.filename, 'rb')
+
+        f = self.logFile
+        f.seek(int(offset))
+        sync, eventNumber, utime, channelLength, dataLength = _eventHeader.unpack(f.read(_eventHeader.size))
+        if sync != _syncWord:
+            raise ValueError('no lcm event at offset %d of %s' % (offset, self.filename))
+
+        channel = f.read(channelLength)
+        data = f.read(dataLength)
+        return LCMLogEvent(eventNumber, utime, channel, data)
+
+    def iterEvents(self, channels=None, startUtime=None, endUtime=None):
+        '''
+        Yields the events on the given channels in log order.  Events on
+        other channels are never read.
+        '''
+        channels = self.getChannels() if channels is None else channels
+        offsets = [self.getEventsInRange(channel, startUtime, endUtime)['offset'] for channel in channels]
+        offsets = np.sort(np.concatenate(offsets)) if offsets else []
+        for offset in offsets:
+            yield self.readEvent(offset)
+
+    def close(self):
+        if self.logFile is not None:
+            self.logFile.close()
+            self.logFile = None
+
+
+def getLogIndex(filename):
+    '''
+    Returns the index of the given log file, updated to the current end of
+    the log.
+    '''
+    index = LCMLogIndex(filename)
+    index.update()
+    return index
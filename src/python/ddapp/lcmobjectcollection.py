@@ -8,19 +8,69 @@ from ddapp.thirdparty import numpyjsoncoder
 from ddapp import callbacks
 from ddapp.utime import getUtime
 from ddapp.uuidutil import newUUID
+import numpy as np
 import drc as lcmdrc
 
 
+def _isEqual(a, b):
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return np.shape(a) == np.shape(b) and np.array_equal(a, b)
+    if isinstance(a, dict) and isinstance(b, dict):
+        return set(a.keys()) == set(b.keys()) and all(_isEqual(a[k], b[k]) for k in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(_isEqual(x, y) for x, y in zip(a, b))
+    try:
+        return bool(a == b)
+    except ValueError:
+        return False
+
+
+def computeDescriptionDelta(oldDesc, newDesc):
+    '''
+    Returns a tuple (changed, removedKeys) where changed is a dict of the
+    keys of newDesc whose values differ from oldDesc, and removedKeys is a
+    list of the keys of oldDesc that are not in newDesc.
+    '''
+    changed = dict((k, v) for k, v in newDesc.iteritems() if k not in oldDesc or not _isEqual(oldDesc[k], v))
+    removedKeys = [k for k in oldDesc if k not in newDesc]
+    return changed, removedKeys
+
+
 class LCMObjectCollection(object):
+    '''
+    Keeps a collection of description dicts in sync between Director
+    instances over LCM.  Each description has a revision that is advanced
+    when the description is published.  The first publish of a description
+    sends the full description, later publishes send only the keys that
+    changed since the revision they were computed from.  A receiver that
+    does not hold that base revision requests a snapshot of the
+    description.  A snapshot request carries the revisions already known to
+    the requester so that responders only send the descriptions that are
+    missing or out of date.
+
+    A revision is a (number, collectionId) pair compared in order, where
+    collectionId identifies the instance that published it.  When two
+    instances publish the same revision number concurrently, every instance
+    orders the two the same way, so the one with the lower collectionId
+    requests a snapshot and all instances converge on the same description.
+
+    Commands carry a protocol version.  Commands from instances that use a
+    different version, such as the older echo based protocol, are ignored
+    with a warning, since the two protocols cannot sync with each other.
+    '''
 
     DESCRIPTION_UPDATED_SIGNAL = 'DESCRIPTION_UPDATED_SIGNAL'
     DESCRIPTION_REMOVED_SIGNAL = 'DESCRIPTION_REMOVED_SIGNAL'
 
+    PROTOCOL_VERSION = 2
+    NO_REVISION = (0, '')
+
     def __init__(self, channel):
         self.collection = OrderedDict()
+        self.revisions = {}
         self.collectionId = newUUID()
         self.sentCommands = set()
-        self.sentRequest = None
+        self.rejectedCollections = set()
         self.channel = channel
 
         self.callbacks = callbacks.CallbackRegistry([self.DESCRIPTION_UPDATED_SIGNAL,
@@ -54,15 +104,22 @@ class LCMObjectCollection(object):
     def getDescription(self, descriptionId):
         return self.collection[descriptionId]
 
+    def getRevision(self, descriptionId):
+        return self.revisions.get(descriptionId, self.NO_REVISION)
+
+    def _getNextRevision(self, descriptionId):
+        return (self.getRevision(descriptionId)[0] + 1, self.collectionId)
+
     def updateDescription(self, desc, publish=True, notify=True):
-        self.collection[self.getDescriptionId(desc)] = desc
+        descriptionId = self.getDescriptionId(desc)
+        previousDesc = self.collection.get(descriptionId)
+        self.collection[descriptionId] = desc
         self._modified()
         if publish:
-            msg = self._newCommandMessage('update', description=desc)
-            lcmUtils.publish(self.channel, msg)
+            self._publishUpdate(descriptionId, previousDesc, desc)
 
         if notify:
-            self.callbacks.process(self.DESCRIPTION_UPDATED_SIGNAL, self, self.getDescriptionId(desc))
+            self.callbacks.process(self.DESCRIPTION_UPDATED_SIGNAL, self, descriptionId)
 
     def removeDescription(self, descriptionId, publish=True, notify=True):
 
@@ -72,6 +129,8 @@ class LCMObjectCollection(object):
         except KeyError:
             pass
 
+        self.revisions.pop(descriptionId, None)
+
         if publish:
             msg = self._newCommandMessage('remove', descriptionId=descriptionId,)
             lcmUtils.publish(self.channel, msg)
@@ -79,25 +138,76 @@ class LCMObjectCollection(object):
         if notify:
             self.callbacks.process(self.DESCRIPTION_REMOVED_SIGNAL, self, descriptionId)
 
-    def sendEchoRequest(self):
-        self.sentRequest = newUUID()
-        msg = self._newCommandMessage('echo_request', requestId=self.sentRequest)
+    def sendSnapshotRequest(self, descriptionIds=None):
+        '''
+        Requests the descriptions that are missing or out of date in this
+        collection.  If descriptionIds is given, only those descriptions
+        are requested.
+        '''
+        msg = self._newCommandMessage('snapshot_request', descriptionIds=descriptionIds, revisions=self.revisions)
         lcmUtils.publish(self.channel, msg)
 
+    def sendSnapshotResponse(self, knownRevisions, descriptionIds=None):
+        if descriptionIds is None:
+            descriptionIds = self.collection.keys()
+
+        descriptions = {}
+        revisions = {}
+        for descriptionId in descriptionIds:
+            if descriptionId not in self.collection:
+                continue
+            revision = self.getRevision(descriptionId)
+            knownRevision = knownRevisions.get(descriptionId)
+            if knownRevision is None or tuple(knownRevision) < revision:
+                descriptions[descriptionId] = self.collection[descriptionId]
+                revisions[descriptionId] = revision
+
+        if descriptions:
+            msg = self._newCommandMessage('snapshot', descriptions=descriptions, revisions=revisions)
+            lcmUtils.publish(self.channel, msg)
 
-    def sendEchoResponse(self, requestId=None):
-        if requestId is None:
-            requestId = newUUID()
-        msg = self._newCommandMessage('echo_response', requestId=requestId, descriptions=self.collection)
-        lcmUtils.publish(self.channel, msg)
-
-    def handleEchoResponse(self, data):
-        #if data['requestId'] != self.sentRequest:
-        #    return
+    def handleSnapshot(self, data):
+        for descriptionId, desc in data['descriptions'].iteritems():
+            revision = tuple(data['revisions'][descriptionId])
+            if descriptionId not in self.collection or self.getRevision(descriptionId) < revision:
+                self.revisions[descriptionId] = revision
+                self.updateDescription(desc, publish=False)
+
+    def handleDelta(self, data):
+        descriptionId = data['descriptionId']
+        revision = tuple(data['revision'])
+        localRevision = self.getRevision(descriptionId)
+
+        # the delta only applies to the revision it was computed from, a
+        # concurrent publish of the same revision number by another instance
+        # leaves a different base revision here
+        if descriptionId not in self.collection or localRevision != tuple(data['baseRevision']):
+            if descriptionId not in self.collection or localRevision < revision:
+                self.sendSnapshotRequest([descriptionId])
+            return
 
-        self.sentRequest = None
-        for desc in data['descriptions'].values():
-            self.updateDescription(desc, publish=False)
+        desc = OrderedDict(self.collection[descriptionId])
+        desc.update(data['changed'])
+        for key in data['removedKeys']:
+            desc.pop(key, None)
+
+        self.revisions[descriptionId] = revision
+        self.updateDescription(desc, publish=False)
+
+    def _publishUpdate(self, descriptionId, previousDesc, desc):
+        revision = self._getNextRevision(descriptionId)
+        if previousDesc is None:
+            msg = self._newCommandMessage('update', description=desc, revision=revision)
+        else:
+            changed, removedKeys = computeDescriptionDelta(previousDesc, desc)
+            if not changed and not removedKeys:
+                return
+            msg = self._newCommandMessage('delta', descriptionId=descriptionId, revision=revision,
+                                          baseRevision=self.getRevision(descriptionId),
+                                          changed=changed, removedKeys=removedKeys)
+
+        self.revisions[descriptionId] = revision
+        lcmUtils.publish(self.channel, msg)
 
     def _modified(self):
         self.mtime = getUtime()
@@ -108,6 +218,7 @@ class LCMObjectCollection(object):
         commandArgs['commandId'] = commandId
         commandArgs['collectionId'] = self.collectionId
         commandArgs['command'] = commandName
+        commandArgs['protocolVersion'] = self.PROTOCOL_VERSION
         msg = lcmdrc.affordance_collection_t()
         msg.name = numpyjsoncoder.encode(commandArgs)
         msg.utime = getUtime()
@@ -124,15 +235,31 @@ class LCMObjectCollection(object):
 
         command = data['command']
 
+        if data.get('protocolVersion') != self.PROTOCOL_VERSION:
+            self._rejectCommand(data)
+            return
+
         if command == 'update':
             desc = data['description']
+            self.revisions[self.getDescriptionId(desc)] = tuple(data['revision'])
             self.updateDescription(desc, publish=False)
 
+        elif command == 'delta':
+            self.handleDelta(data)
+
         elif command == 'remove':
             self.removeDescription(data['descriptionId'], publish=False)
 
-        elif command == 'echo_request':
-            self.sendEchoResponse(data['requestId'])
+        elif command == 'snapshot_request':
+            self.sendSnapshotResponse(data['revisions'], data['descriptionIds'])
 
-        elif command == 'echo_response':
-            self.handleEchoResponse(data)
+        elif command == 'snapshot':
+            self.handleSnapshot(data)
+
+    def _rejectCommand(self, data):
+        collectionId = data.get('collectionId')
+        if collectionId in self.rejectedCollections:
+            return
+        self.rejectedCollections.add(collectionId)
+        print 'ignoring commands on %s from collection %s: it uses sync protocol version %s, expected %d' % (
+                  self.channel, collectionId, data.get('protocolVersion', 1), self.PROTOCOL_VERSION)
@@ -5,6 +5,7 @@ import lcm
 import time
 import math
 import random
+from ddapp import lcmlogindex
 
 
 messageTypes = {}
@@ -161,15 +162,18 @@ def printLCMCatalog():
 
 def printLogFileDescription(filename):
 
-    log = lcm.EventLog(filename, 'r')
-
     print 'reading %s' % filename
-    print 'log file size: %.2f MB' % (log.size()/(1024.0**2))
+    print 'log file size: %.2f MB' % (os.path.getsize(filename)/(1024.0**2))
+
+    # only the first message of each channel is decoded, so the log index
+    # is used to read those messages without scanning the whole log
+    index = lcmlogindex.getLogIndex(filename)
 
-    for event in log:
+    for channel in index.getChannels():
+        event = index.readEvent(index.getEvents(channel)['offset'].min())
         onLCMMessage(event.channel, event.data)
 
-    log.close()
+    index.close()
 
     printLCMCatalog()
 
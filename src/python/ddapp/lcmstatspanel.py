@@ -0,0 +1,100 @@
+import PythonQt
+from PythonQt import QtCore, QtGui
+from ddapp import lcmUtils
+from ddapp import applogic as app
+from ddapp.timercallback import TimerCallback
+
+
+class LCMStatsPanel(object):
+    '''
+    Shows the statistics of the ddLCMSubscriber instances created with
+    lcmUtils.addSubscriber: message and byte rates, messages dropped by
+    coalescing or speed limits, the time messages wait between the LCM
+    thread and the python callback, and the callback wall time.  Rows are
+    sorted by the fraction of main thread time spent in the callbacks, so
+    the handlers that starve the render loop are at the top.
+    '''
+
+    columns = ['channel', 'msgs/s', 'kB/s', 'dropped', 'avg delay (ms)', 'max delay (ms)',
+               'avg callback (ms)', 'max callback (ms)', 'callback load (%)', 'delay histogram']
+
+    def __init__(self, updateRate=1.0):
+
+        self.widget = QtGui.QWidget()
+        self.widget.setWindowTitle('LCM Statistics')
+        layout = QtGui.QVBoxLayout(self.widget)
+
+        self.table = QtGui.QTableWidget()
+        self.table.setColumnCount(len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.verticalHeader().setVisible(False)
+        layout.addWidget(self.table)
+
+        self.resetButton = QtGui.QPushButton('Reset')
+        self.resetButton.connect('clicked()', self.resetStatistics)
+        layout.addWidget(self.resetButton)
+
+        binEdges = PythonQt.dd.ddLCMSubscriber.queueDelayHistogramBinEdges()
+        self.table.horizontalHeaderItem(len(self.columns) - 1).setToolTip(
+            'queue delay counts for bins with upper edges (ms): %s, inf' % ', '.join('%g' % x for x in binEdges))
+
+        self.timer = TimerCallback(targetFps=updateRate)
+        self.timer.callback = self.updateTable
+
+    def show(self):
+        self.widget.show()
+        self.widget.raise_()
+        self.updateTable()
+        self.timer.start()
+
+    def hide(self):
+        self.timer.stop()
+        self.widget.hide()
+
+    def resetStatistics(self):
+        for subscriber in self.getSubscribers():
+            subscriber.resetStatistics()
+        self.updateTable()
+
+    def getSubscribers(self):
+        return [sub for sub in lcmUtils.getSubscribers() if hasattr(sub, 'statistics')]
+
+    def getRows(self):
+        rows = []
+        for subscriber in self.getSubscribers():
+            stats = subscriber.statistics()
+            elapsed = stats['elapsedTime'] or 1.0
+            rows.append([subscriber.channel(),
+                         '%.1f' % (stats['messagesReceived'] / elapsed),
+                         '%.1f' % (stats['bytesPerSecond'] / 1024.0),
+                         '%d' % stats['messagesDropped'],
+                         '%.2f' % stats['averageQueueDelay'],
+                         '%.2f' % stats['maxQueueDelay'],
+                         '%.2f' % stats['averageCallbackTime'],
+                         '%.2f' % stats['maxCallbackTime'],
+                         '%.1f' % (100.0 * stats['totalCallbackTime'] * 1e-3 / elapsed),
+                         ' '.join('%d' % x for x in stats['queueDelayHistogram'])])
+
+        rows.sort(key=lambda row: float(row[8]), reverse=True)
+        return rows
+
+    def updateTable(self):
+        rows = self.getRows()
+        self.table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                item = self.table.item(row, column)
+                if item is None:
+                    item = QtGui.QTableWidgetItem()
+                    self.table.setItem(row, column, item)
+                item.setText(value)
+
+
+_panel = None
+
+def showPanel():
+    global _panel
+    if _panel is None:
+        _panel = LCMStatsPanel()
+    _panel.show()
+    return _panel
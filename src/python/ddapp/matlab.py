@@ -1,8 +1,10 @@
 from subprocess import Popen, PIPE, STDOUT
 
 import subprocess
-import select
 import socket
+import struct
+import tempfile
+import threading
 import os
 
 import ddapp
@@ -12,14 +14,98 @@ import numpy as np
 
 
 
-def startMatlab():
-    return subprocess.Popen(['matlab', '-nodisplay', '-nosplash'], stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
+def startMatlab(command=None):
+    '''
+    Starts MATLAB as a subprocess with piped stdin and stdout.  The command
+    may be given to start a different process that behaves like MATLAB, for
+    example a stand-in server for testing.
+    '''
+    command = command or ['matlab', '-nodisplay', '-nosplash']
+    return subprocess.Popen(command, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+
+class MatlabOutputReader(object):
+    '''
+    Reads the output of a MATLAB process on a background thread.  The
+    readFunction blocks until output is available and returns it, or
+    returns an empty string at the end of the stream.  Output is buffered
+    until it is taken with read(), and waitForData() blocks until there is
+    output to read, so clients never poll the stream.
+    '''
+
+    def __init__(self, readFunction):
+        self.readFunction = readFunction
+        self.buffer = bytearray()
+        self.atEnd = False
+        self.interrupted = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                data = self.readFunction()
+            except (IOError, OSError, socket.error):
+                data = ''
+
+            with self.condition:
+                if data:
+                    self.buffer.extend(data)
+                else:
+                    self.atEnd = True
+                self.condition.notify_all()
+
+            if not data:
+                return
+
+    def read(self):
+        '''
+        Returns the output received so far and clears the buffer.
+        '''
+        with self.condition:
+            data = str(self.buffer)
+            del self.buffer[:]
+            return data
+
+    def waitForData(self, timeout=None):
+        '''
+        Blocks until there is output to read, the end of the stream is
+        reached, the reader is interrupted, or the timeout expires.  Returns
+        True if there is output to read.
+        '''
+        with self.condition:
+            if not self.buffer and not self.atEnd and not self.interrupted:
+                self.condition.wait(timeout)
+            return len(self.buffer) > 0
+
+    def interrupt(self):
+        '''
+        Wakes up waitForData() and makes it return immediately until
+        clearInterrupt() is called.  The flag is set under the condition, so
+        an interrupt is not lost if it happens before the wait begins.
+        '''
+        with self.condition:
+            self.interrupted = True
+            self.condition.notify_all()
+
+    def clearInterrupt(self):
+        with self.condition:
+            self.interrupted = False
+
+    def isInterrupted(self):
+        with self.condition:
+            return self.interrupted
 
+    def isAtEnd(self):
+        with self.condition:
+            return self.atEnd and not self.buffer
 
-def _readAllSoFar(proc, retVal=''):
-    while proc.poll() is None and (select.select([proc.stdout],[],[],0)[0] != []):
-        retVal += proc.stdout.read(1)
-    return retVal
+
+def _createPipeReader(proc):
+    fd = proc.stdout.fileno()
+    return MatlabOutputReader(lambda: os.read(fd, 4096))
 
 
 
@@ -35,6 +121,7 @@ class MatlabServer(object):
 
     def start(self):
         self.proc = startMatlab()
+        self.reader = _createPipeReader(self.proc)
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.bind(('', self.port))
@@ -48,24 +135,40 @@ class MatlabServer(object):
 
     def serve(self, sock):
 
-        sock.settimeout(0.001)
+        def forwardOutput():
+            while not self.reader.isAtEnd():
+                self.reader.waitForData()
+                if self.reader.isInterrupted():
+                    return
+                data = self.reader.read()
+                if data:
+                    try:
+                        sock.sendall(data)
+                    except socket.error as e:
+                        return
+
+        self.reader.clearInterrupt()
+        outputThread = threading.Thread(target=forwardOutput)
+        outputThread.daemon = True
+        outputThread.start()
+
         while True:
-            data = _readAllSoFar(self.proc, '')
-            if data:
-                sock.send(data)
             try:
-                inData = sock.recv(1024)
-                if inData:
-                    self.proc.stdin.write(inData)
-                else:
-                    sock.close()
-                    return
-            except socket.timeout as e:
-                pass
+                inData = sock.recv(4096)
             except socket.error as e:
                 print 'socket error:', e
-                sock.close()
-                return
+                inData = ''
+
+            if inData:
+                self.proc.stdin.write(inData)
+                self.proc.stdin.flush()
+            else:
+                break
+
+        # output that arrives before the next client connects stays buffered
+        self.reader.interrupt()
+        outputThread.join()
+        sock.close()
 
 
 class MatlabSocketClient(object):
@@ -74,6 +177,7 @@ class MatlabSocketClient(object):
         self.host = host
         self.port = port
         self.sock = None
+        self.reader = None
         self.connect()
 
     def connect(self):
@@ -84,26 +188,25 @@ class MatlabSocketClient(object):
         except socket.error:
             self.sock = None
         else:
-            self.sock.settimeout(0.001)
+            sock = self.sock
+            self.reader = MatlabOutputReader(lambda: sock.recv(4096))
 
 
     def send(self, data):
-        self.sock.send(data)
+        self.sock.sendall(data)
 
     def receive(self):
         if not self.isAlive():
             return ''
 
-        try:
-            inData = self.sock.recv(1024)
-            if inData:
-                return inData
-            else:
-                self.sock.close()
-                self.sock = None
-                return ''
-        except socket.timeout as e:
-            return ''
+        data = self.reader.read()
+        if not data and self.reader.isAtEnd():
+            self.sock.close()
+            self.sock = None
+        return data
+
+    def waitForData(self, timeout=None):
+        return self.isAlive() and self.reader.waitForData(timeout)
 
     def isAlive(self):
         return (self.sock is not None)
@@ -111,23 +214,88 @@ class MatlabSocketClient(object):
 
 class MatlabPipeClient(object):
 
-    def __init__(self):
-        self.proc = startMatlab()
+    def __init__(self, command=None):
+        self.proc = startMatlab(command)
+        self.reader = _createPipeReader(self.proc)
 
     def send(self, data):
         self.proc.stdin.write(data)
+        self.proc.stdin.flush()
 
     def receive(self):
-        return _readAllSoFar(self.proc, '')
+        return self.reader.read()
+
+    def waitForData(self, timeout=None):
+        return self.reader.waitForData(timeout)
 
     def isAlive(self):
-        return (self.proc.poll() is None)
+        return (self.proc.poll() is None and not self.reader.isAtEnd())
+
+
+class MatlabArrayChannel(object):
+    '''
+    A binary side channel for transferring float arrays to and from MATLAB.
+    Arrays are written to a transfer file as raw float64 values in column
+    major order, after a header of a magic string and the array dimensions.
+    The transfer file is placed in shared memory when it is available, so
+    the transfer does not touch the disk.  MATLAB reads and writes the file
+    with ddReadArray.m and ddWriteArray.m from src/matlab, so the channel
+    requires MATLAB to run on the local host with those files on its path.
+    '''
+
+    MAGIC = 'DDAR'
+    _header = struct.Struct('<4sIII')
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        self.filename = os.path.join(directory, 'ddapp_matlab_array_%d_%d.bin' % (os.getpid(), id(self)))
+
+    def writeArray(self, array):
+        '''
+        Writes a 1D or 2D array to the transfer file.  A 1D array is
+        written as a column vector.
+        '''
+        array = np.asarray(array, dtype='<f8')
+        if array.ndim == 1:
+            array = array.reshape(-1, 1)
+        assert array.ndim == 2
+
+        rows, cols = array.shape
+        f = open(self.filename, 'wb')
+        f.write(self._header.pack(self.MAGIC, 2, rows, cols))
+        f.write(array.T.tostring())
+        f.close()
+
+    def readArray(self):
+        '''
+        Reads the array from the transfer file as a rows x cols numpy array.
+        '''
+        f = open(self.filename, 'rb')
+        data = f.read()
+        f.close()
+
+        if len(data) < self._header.size:
+            raise IOError('incomplete array file: %s' % self.filename)
+
+        magic, ndim, rows, cols = self._header.unpack_from(data)
+        if magic != self.MAGIC or ndim != 2 or len(data) != self._header.size + 8*rows*cols:
+            raise IOError('invalid array file: %s' % self.filename)
+
+        if not rows*cols:
+            return np.zeros((rows, cols))
+        return np.frombuffer(data, dtype='<f8', offset=self._header.size).reshape(cols, rows).T
+
+    def clear(self):
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
 
 
 class MatlabCommunicator(object):
 
     def __init__(self, matlabClient):
         self.client = matlabClient
+        self.arrayChannel = None
         self.prompt = '>> '
         self.outputConsole = None
         self.echoToStdOut = True
@@ -138,9 +306,12 @@ class MatlabCommunicator(object):
         self.clearResult()
 
     def checkForResult(self):
-        self.accumulatedOutput = self.accumulatedOutput + self.client.receive()
-        if  self.accumulatedOutput.endswith(self.prompt):
-            self.outputLines = self.accumulatedOutput.split('\n')[:-1]
+        # received output is appended in place and only the end of the
+        # output is checked for the prompt, so the check does not grow
+        # with the length of the output
+        self.accumulatedOutput.extend(self.client.receive())
+        if self.accumulatedOutput.endswith(self.prompt):
+            self.outputLines = str(self.accumulatedOutput).split('\n')[:-1]
             return self.outputLines
         else:
             return None
@@ -154,7 +325,12 @@ class MatlabCommunicator(object):
         return self.client.isAlive()
 
     def waitForResult(self, timeout=None):
-
+        '''
+        Blocks until the output of the last command ends with the prompt and
+        returns the output lines.  Returns None if the timeout expires or
+        the client is disconnected.  With a timeout of zero, the output
+        received so far is checked without blocking.
+        '''
         t = SimpleTimer()
 
         while self.isAlive():
@@ -163,8 +339,13 @@ class MatlabCommunicator(object):
             if result is not None:
                 return result
 
-            if timeout is not None and t.elapsed() > timeout:
-                return None
+            remaining = None
+            if timeout is not None:
+                remaining = timeout - t.elapsed()
+                if remaining <= 0:
+                    return None
+
+            self.client.waitForData(remaining)
 
     def _colorReplace(self, line):
         line = line.replace('[\x08', '<font color="orange">')
@@ -196,14 +377,14 @@ class MatlabCommunicator(object):
             scrollBar.setValue(scrollBar.maximum)
 
     def clearResult(self):
-        self.accumulatedOutput = ''
+        self.accumulatedOutput = bytearray()
         self.outputLines = []
 
     def getResult(self):
         return self.outputLines
 
     def getResultString(self):
-        return self.accumulatedOutput
+        return str(self.accumulatedOutput)
 
     def send(self, command):
         assert self.isAlive()
@@ -239,8 +420,44 @@ class MatlabCommunicator(object):
                 self.printResult()
 
 
+    def enableArrayChannel(self, directory=None):
+        '''
+        Transfers float arrays through a MatlabArrayChannel instead of as
+        text on the console.  See getFloatArray and assignFloatArray.
+        '''
+        self.arrayChannel = MatlabArrayChannel(directory)
+
+    def disableArrayChannel(self):
+        if self.arrayChannel is not None:
+            self.arrayChannel.clear()
+        self.arrayChannel = None
+
+    def _getFloatArrayBinary(self, expression):
+
+        # a stale file must not be mistaken for the result of a failed command
+        self.arrayChannel.clear()
+        self.send("ddWriteArray('%s', %s);" % (self.arrayChannel.filename, expression))
+        result = self.waitForResult()
+
+        try:
+            array = self.arrayChannel.readArray()
+        except IOError:
+            raise Exception('Failed to read float array %s.  Output was:\n%s' % (expression, '\n'.join(result or [])))
+
+        # match the layout of the text result: a list of values for a column
+        # vector, and a list of rows otherwise
+        if not array.size:
+            return []
+        elif array.shape[1] == 1:
+            return array[:,0].tolist()
+        else:
+            return array.tolist()
+
     def getFloatArray(self, expression):
 
+        if self.arrayChannel is not None:
+            return self._getFloatArrayBinary(expression)
+
         self.send('disp(%s)' % expression)
         result = self.waitForResult()
         if len(result) and not result[-1]:
@@ -260,6 +477,12 @@ class MatlabCommunicator(object):
 
     def assignFloatArray(self, array, arrayName):
 
+        if self.arrayChannel is not None:
+            self.arrayChannel.writeArray(array)
+            self.send("%s = ddReadArray('%s');" % (arrayName, self.arrayChannel.filename))
+            self.waitForResult()
+            return
+
         def joinFloats(values, sep):
             maxLength = 180.0
             pieces = np.array_split(values, np.ceil(len(values)/maxLength))
@@ -1,41 +1,408 @@
 from ddapp import lcmobjectcollection
+from ddapp import lcmUtils
 from ddapp import geometryencoder
 from ddapp import ioUtils
+from ddapp import callbacks
+from ddapp.timercallback import TimerCallback
+from ddapp import vtkAll as vtk
+from ddapp.shallowCopy import shallowCopy
 from ddapp.uuidutil import newUUID
+import hashlib
+import struct
+import time
 import os
+from collections import OrderedDict
+
+
+class MeshFileCache(object):
+    '''
+    A persistent, content addressed file cache for meshes.  Files are named
+    by the mesh content hash, so the same geometry is only written once and
+    is found again by later Director sessions.  Meshes are stored as vtp
+    files with raw appended binary data, which is fast to write and read.
+    Other file formats can be stored next to the vtp file for consumers that
+    need them.  When the total size of the cache exceeds maxSize bytes, the
+    least recently used files are removed.  A maxSize of None disables
+    eviction.  The total size is scanned once and then kept as a running
+    total of the files written, so the directory is only listed again when
+    the total exceeds maxSize.
+    '''
+
+    def __init__(self, directory, maxSize=512*1024*1024):
+        self.directory = directory
+        self.maxSize = maxSize
+        self.totalSize = None
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def getFilename(self, meshHash, extension='vtp'):
+        return os.path.join(self.directory, '%s.%s' % (meshHash, extension))
+
+    def contains(self, meshHash, extension='vtp'):
+        return os.path.isfile(self.getFilename(meshHash, extension))
+
+    def read(self, meshHash):
+        filename = self.getFilename(meshHash)
+        if not os.path.isfile(filename):
+            return None
+
+        reader = vtk.vtkXMLPolyDataReader()
+        reader.SetFileName(filename)
+        reader.Update()
+        self._touch(filename)
+        return shallowCopy(reader.GetOutput())
+
+    def write(self, polyData, meshHash, extension='vtp'):
+        '''
+        Writes the mesh to the cache unless a file for the hash already
+        exists.  Returns the cache filename.
+        '''
+        filename = self.getFilename(meshHash, extension)
+        if os.path.isfile(filename):
+            self._touch(filename)
+            return filename
+
+        # write to a temporary name and rename so that concurrent Director
+        # instances never read a partially written file
+        tempFilename = '%s.%d.tmp.%s' % (filename, os.getpid(), extension)
+        if extension == 'vtp':
+            writer = vtk.vtkXMLPolyDataWriter()
+            writer.SetDataModeToAppended()
+            writer.EncodeAppendedDataOff()
+            writer.SetFileName(tempFilename)
+            writer.SetInput(polyData)
+            writer.Write()
+        else:
+            ioUtils.writePolyData(polyData, tempFilename)
+
+        os.rename(tempFilename, filename)
+        if self.totalSize is not None:
+            self.totalSize += os.path.getsize(filename)
+        self.evict()
+        return filename
+
+    def getSize(self):
+        return sum(size for filename, size, mtime in self._getEntries())
+
+    def evict(self):
+        if self.maxSize is None:
+            return
+
+        if self.totalSize is not None and self.totalSize <= self.maxSize:
+            return
+
+        # the running total misses files written by other Director
+        # instances, so the directory is scanned before evicting
+        entries = self._getEntries()
+        totalSize = sum(size for filename, size, mtime in entries)
+        self.totalSize = totalSize
+        if totalSize <= self.maxSize:
+            return
+
+        entries.sort(key=lambda x: x[2])
+        for filename, size, mtime in entries:
+            if totalSize <= self.maxSize:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            totalSize -= size
+        self.totalSize = totalSize
+
+    def _touch(self, filename):
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+
+    def _getEntries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if '.tmp.' in name:
+                continue
+            filename = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((filename, stat.st_size, stat.st_mtime))
+        return entries
 
 
 class MeshManager(object):
+    '''
+    Shares meshes between Director instances.  Mesh descriptions published
+    on the collection channel are small: they carry the mesh id and the
+    content hash of the binary encoded mesh.  The encoded bytes are sent
+    in chunks on a separate data channel, and receivers that already hold
+    a mesh with the same hash reuse it without decoding.  The chunks for a
+    given hash are only published once by the sender.  A receiver that sees
+    a description for an unknown hash publishes a data request, and any
+    peer holding the mesh answers by publishing the chunks.  A request that
+    is not answered within requestTimeout seconds expires and is sent again
+    while a mesh still needs the data.  Incomplete transfers that receive no
+    chunk for transferTimeout seconds are dropped, as is the least recently
+    active transfer when more than maxPendingTransfers are in progress.
+    Data that does not match its hash is discarded and reported through the
+    mesh data error signal, as is a transfer whose chunk headers are
+    inconsistent.  Chunks for meshes that no description refers to, or that
+    are already held, are ignored.  Meshes are also stored in a
+    MeshFileCache, which is consulted before requesting mesh data from
+    peers.  The cache files are written from a timer, one mesh per timer
+    event, so adding or receiving a mesh does not block on disk writes.
+
+    Files returned by getFilesystemFilename are read by other programs at
+    any later time, so they are written to a separate export cache rather
+    than to the mesh cache.  The export cache has a larger size bound, and
+    getFilesystemFilename touches or rewrites the file on every call, so
+    only files that have not been requested for a long time are evicted.
+    '''
+
+    MESH_RECEIVED_SIGNAL = 'MESH_RECEIVED_SIGNAL'
+    MESH_DATA_ERROR_SIGNAL = 'MESH_DATA_ERROR_SIGNAL'
+
+    CHUNK_MAGIC = 'DDMC'
+    _chunkHeader = struct.Struct('<4s40sII')
 
     def __init__(self):
         self.meshes = {}
-        self.cacheDirectory = '/tmp'
+        self.meshHashes = {}
+        self.hashToMeshIds = {}
+        self.hashToPolyData = {}
+        self.pendingChunks = {}
+        self.pendingChunksTimes = {}
+        self.pendingChunksCounts = {}
+        self.requestedHashes = {}
+        self.requestTimeout = 5.0
+        self.transferTimeout = 10.0
+        self.maxPendingTransfers = 16
+        self.transferTimer = TimerCallback(targetFps=1)
+        self.transferTimer.callback = self._checkTransfers
+        self.publishedHashes = {}
         self.cacheDataType = 'stl'
+        self.fileCache = MeshFileCache(os.path.expanduser('~/.cache/director/meshes'))
+        self.exportCache = MeshFileCache(os.path.expanduser('~/.cache/director/mesh-exports'), maxSize=2*1024*1024*1024)
+        self.pendingWrites = OrderedDict()
+        self.writeTimer = TimerCallback()
+        self.writeTimer.callback = self._writeNextPendingMesh
+        self.writeDelay = 0.1
+        self.compressionEnabled = True
+        self.chunkSize = 256*1024
+        self.dataChannel = 'MESH_COLLECTION_DATA'
+        self.dataRequestChannel = 'MESH_COLLECTION_DATA_REQUEST'
+
+        self.callbacks = callbacks.CallbackRegistry([self.MESH_RECEIVED_SIGNAL,
+                                                     self.MESH_DATA_ERROR_SIGNAL])
+
         self.collection = lcmobjectcollection.LCMObjectCollection(channel='MESH_COLLECTION_COMMAND')
         self.collection.connectDescriptionUpdated(self._onDescriptionUpdated)
 
+        self.dataSub = lcmUtils.addSubscriber(self.dataChannel, callback=self._onDataMessage)
+        self.dataSub.setNotifyAllMessagesEnabled(True)
+        self.dataRequestSub = lcmUtils.addSubscriber(self.dataRequestChannel, callback=self._onDataRequestMessage)
+        self.dataRequestSub.setNotifyAllMessagesEnabled(True)
+
+    def connectMeshReceived(self, func):
+        return self.callbacks.connect(self.MESH_RECEIVED_SIGNAL, func)
+
+    def disconnectMeshReceived(self, callbackId):
+        self.callbacks.disconnect(callbackId)
+
+    def connectMeshDataError(self, func):
+        '''
+        Connects func(meshManager, meshHash, errorMessage), called when
+        received mesh data is discarded.
+        '''
+        return self.callbacks.connect(self.MESH_DATA_ERROR_SIGNAL, func)
+
+    def disconnectMeshDataError(self, callbackId):
+        self.callbacks.disconnect(callbackId)
+
     def add(self, polyData, publish=True):
+        data = geometryencoder.encodePolyDataBinary(polyData, compress=self.compressionEnabled)
+        meshHash = hashlib.sha1(data).hexdigest()
+
         meshId = newUUID()
-        self.meshes[meshId] = polyData
+        self._storeMesh(meshId, meshHash, polyData)
+        self._scheduleWrite(meshHash, polyData)
         if publish:
-            self.collection.updateDescription(dict(uuid=meshId, data=geometryencoder.encodePolyData(polyData)), notify=False)
+            # the description is published first, because receivers only
+            # collect the chunks of meshes that a description refers to
+            self.collection.updateDescription(dict(uuid=meshId, hash=meshHash, size=len(data)), notify=False)
+            if meshHash not in self.publishedHashes:
+                self.publishedHashes[meshHash] = time.time()
+                self._publishData(meshHash, data)
         return meshId
 
     def get(self, meshId):
         return self.meshes.get(meshId)
 
+    def getHash(self, meshId):
+        return self.meshHashes.get(meshId)
+
     def getFilesystemFilename(self, meshId):
         if meshId in self.meshes:
-            filename = os.path.join(self.cacheDirectory, '%s.%s' % (meshId, self.cacheDataType))
-            if not os.path.isfile(filename):
-                ioUtils.writePolyData(self.get(meshId), filename)
-            return filename
+            meshHash = self.meshHashes[meshId]
+            return self.exportCache.write(self.get(meshId), meshHash, self.cacheDataType)
         return None
 
+    def _scheduleWrite(self, meshHash, polyData):
+        if meshHash in self.pendingWrites or self.fileCache.contains(meshHash):
+            return
+        self.pendingWrites[meshHash] = polyData
+        if not self.writeTimer.singleShotTimer.isActive():
+            self.writeTimer.singleShot(self.writeDelay)
+
+    def _writeNextPendingMesh(self):
+        if not self.pendingWrites:
+            return
+        meshHash, polyData = self.pendingWrites.popitem(last=False)
+        self.fileCache.write(polyData, meshHash)
+        if self.pendingWrites:
+            self.writeTimer.singleShot(self.writeDelay)
+
+    def flushPendingWrites(self):
+        '''
+        Writes the meshes that are waiting to be written to the file cache.
+        '''
+        while self.pendingWrites:
+            self._writeNextPendingMesh()
+
+    def _storeMesh(self, meshId, meshHash, polyData):
+        self.meshes[meshId] = polyData
+        self.meshHashes[meshId] = meshHash
+        self.hashToMeshIds.setdefault(meshHash, set()).add(meshId)
+        self.hashToPolyData[meshHash] = polyData
+
+    def _publishData(self, meshHash, data):
+        numberOfChunks = max(1, (len(data) + self.chunkSize - 1) / self.chunkSize)
+        lc = lcmUtils.getGlobalLCM()
+        for chunkIndex in xrange(numberOfChunks):
+            chunk = data[chunkIndex*self.chunkSize:(chunkIndex+1)*self.chunkSize]
+            header = self._chunkHeader.pack(self.CHUNK_MAGIC, meshHash, chunkIndex, numberOfChunks)
+            lc.publish(self.dataChannel, header + chunk)
+
+    def _requestData(self, meshHash):
+        if meshHash in self.requestedHashes:
+            return
+        self._publishRequest(meshHash)
+        self._startTransferTimer()
+
+    def _publishRequest(self, meshHash):
+        self.requestedHashes[meshHash] = time.time()
+        lcmUtils.getGlobalLCM().publish(self.dataRequestChannel, meshHash)
+
+    def _isDataNeeded(self, meshHash):
+        return meshHash not in self.hashToPolyData and meshHash in self.hashToMeshIds
+
+    def _dropTransfer(self, meshHash):
+        self.pendingChunks.pop(meshHash, None)
+        self.pendingChunksTimes.pop(meshHash, None)
+        self.pendingChunksCounts.pop(meshHash, None)
+
+    def _startTransferTimer(self):
+        if not self.transferTimer.isActive():
+            self.transferTimer.start()
+
+    def _checkTransfers(self):
+        '''
+        Drops stalled transfers and expires unanswered requests, requesting
+        the data again if a mesh still needs it.  Returns False to stop the
+        timer when nothing is in progress.  This is the timer callback, so
+        it publishes requests without starting the timer.
+        '''
+        now = time.time()
+        for meshHash, lastTime in self.pendingChunksTimes.items():
+            if now - lastTime > self.transferTimeout:
+                self._dropTransfer(meshHash)
+
+        for meshHash, requestTime in self.requestedHashes.items():
+            if now - requestTime > self.requestTimeout and meshHash not in self.pendingChunks:
+                del self.requestedHashes[meshHash]
+                if self._isDataNeeded(meshHash):
+                    self._publishRequest(meshHash)
+
+        return bool(self.requestedHashes or self.pendingChunks)
+
+    def _reportDataError(self, meshHash, errorMessage):
+        self.callbacks.process(self.MESH_DATA_ERROR_SIGNAL, self, meshHash, errorMessage)
+
+    def _onDataRequestMessage(self, messageData, channel):
+        meshHash = str(messageData)
+        if time.time() - self.publishedHashes.get(meshHash, 0.0) < self.requestTimeout:
+            # receivers request the data when the description arrives, but
+            # the chunks published with it are already on their way.  If
+            # they were lost the request expires and is sent again.
+            return
+
+        polyData = self.hashToPolyData.get(meshHash)
+        if polyData is None:
+            polyData = self.fileCache.read(meshHash)
+        if polyData is not None:
+            data = geometryencoder.encodePolyDataBinary(polyData, compress=self.compressionEnabled)
+            if hashlib.sha1(data).hexdigest() == meshHash:
+                self._publishData(meshHash, data)
+
+    def _onDataMessage(self, messageData, channel):
+        messageData = str(messageData)
+        if len(messageData) < self._chunkHeader.size:
+            return
+
+        magic, meshHash, chunkIndex, numberOfChunks = self._chunkHeader.unpack_from(messageData)
+        if magic != self.CHUNK_MAGIC or not self._isDataNeeded(meshHash):
+            return
+
+        if not 0 <= chunkIndex < numberOfChunks or numberOfChunks != self.pendingChunksCounts.get(meshHash, numberOfChunks):
+            self._dropTransfer(meshHash)
+            self._reportDataError(meshHash, 'dropped transfer with invalid chunk %d of %d' % (chunkIndex, numberOfChunks))
+            return
+
+        if meshHash not in self.pendingChunks and len(self.pendingChunks) >= self.maxPendingTransfers:
+            oldestHash = min(self.pendingChunksTimes, key=self.pendingChunksTimes.get)
+            self._dropTransfer(oldestHash)
+            self._reportDataError(oldestHash, 'dropped incomplete transfer, more than %d transfers in progress' % self.maxPendingTransfers)
+
+        chunks = self.pendingChunks.setdefault(meshHash, {})
+        self.pendingChunksTimes[meshHash] = time.time()
+        self.pendingChunksCounts[meshHash] = numberOfChunks
+        self._startTransferTimer()
+        chunks[chunkIndex] = messageData[self._chunkHeader.size:]
+        if len(chunks) < numberOfChunks:
+            return
+
+        self._dropTransfer(meshHash)
+        data = ''.join(chunks[i] for i in xrange(numberOfChunks))
+        if hashlib.sha1(data).hexdigest() != meshHash:
+            # the request expires and is sent again while the mesh is needed
+            self._reportDataError(meshHash, 'discarded mesh data with mismatched hash')
+            return
+
+        self.requestedHashes.pop(meshHash, None)
+        polyData = geometryencoder.decodePolyDataBinary(data)
+        self.hashToPolyData[meshHash] = polyData
+        self._scheduleWrite(meshHash, polyData)
+        for meshId in list(self.hashToMeshIds.get(meshHash, [])):
+            self._resolveMesh(meshId, meshHash)
+
+    def _resolveMesh(self, meshId, meshHash):
+        self._storeMesh(meshId, meshHash, self.hashToPolyData[meshHash])
+        self.callbacks.process(self.MESH_RECEIVED_SIGNAL, self, meshId)
+
     def _onDescriptionUpdated(self, collection, descriptionId):
         desc = collection.getDescription(descriptionId)
         meshId = desc['uuid']
-        if meshId not in self.meshes:
-            polyData = geometryencoder.decodePolyData(desc['data'])
-            self.meshes[meshId] = polyData
-            #print 'decoded polydata with %d points' % polyData.GetNumberOfPoints()
+        if meshId in self.meshes:
+            return
+
+        meshHash = desc['hash']
+        self.hashToMeshIds.setdefault(meshHash, set()).add(meshId)
+        if meshHash not in self.hashToPolyData:
+            polyData = self.fileCache.read(meshHash)
+            if polyData is not None:
+                self.hashToPolyData[meshHash] = polyData
+
+        if meshHash in self.hashToPolyData:
+            self._resolveMesh(meshId, meshHash)
+        elif meshHash not in self.pendingChunks:
+            self._requestData(meshHash)
@@ -3,6 +3,8 @@ import PythonQt
 from PythonQt import QtCore, QtGui
 from ddapp.propertyset import PropertySet, PropertyAttributes, PropertyPanelHelper
 from ddapp import callbacks
+from contextlib import contextmanager
+from collections import OrderedDict
 
 class Icons(object):
 
@@ -175,7 +177,15 @@ class ObjectModelTree(object):
         self._treeWidget = None
         self._propertiesPanel = None
         self._objects = {}
+        self._itemForObject = {}
+        self._objectParents = {}
+        self._objectChildren = {None: OrderedDict()}
+        self._objectNames = {}
+        self._nameToObjects = {}
         self._blockSignals = False
+        self._batchDepth = 0
+        self._pendingItemUpdates = set()
+        self._pendingPanelUpdate = False
         self.actions = []
         self.callbacks = callbacks.CallbackRegistry([self.ACTION_SELECTED])
 
@@ -185,18 +195,17 @@ class ObjectModelTree(object):
     def getPropertiesPanel(self):
         return self._propertiesPanel
 
+    # the parent and children of each object are kept in maps that mirror
+    # the tree items, so relationship queries do not walk QTreeWidgetItems
+
     def getObjectParent(self, obj):
-        item = self._getItemForObject(obj)
-        if item.parent():
-            return self._getObjectForItem(item.parent())
+        return self._objectParents.get(obj)
 
     def getObjectChildren(self, obj):
-        item = self._getItemForObject(obj)
-        return [self._getObjectForItem(item.child(i)) for i in xrange(item.childCount())]
+        return self._objectChildren[obj].keys()
 
     def getTopLevelObjects(self):
-        return [self._getObjectForItem(self._treeWidget.topLevelItem(i))
-                  for i in xrange(self._treeWidget.topLevelItemCount)]
+        return self._objectChildren[None].keys()
 
     def getActiveObject(self):
         item = self._getSelectedItem()
@@ -217,29 +226,102 @@ class ObjectModelTree(object):
     def getObjects(self):
         return self._objects.values()
 
+    def hasObject(self, obj):
+        return obj in self._itemForObject
+
     def _getSelectedItem(self):
         items = self.getTreeWidget().selectedItems()
         return items[0] if len(items) == 1 else None
 
     def _getItemForObject(self, obj):
-        for item, itemObj in self._objects.iteritems():
-            if itemObj == obj:
-                return item
+        if obj is None:
+            return None
+        return self._itemForObject.get(obj)
 
     def _getObjectForItem(self, item):
         return self._objects[item]
 
+    def _addObjectName(self, obj, name):
+        self._objectNames[obj] = name
+        self._nameToObjects.setdefault(name, []).append(obj)
+
+    def _removeObjectName(self, obj):
+        name = self._objectNames.pop(obj, None)
+        objs = self._nameToObjects.get(name)
+        if objs is None:
+            return
+        objs.remove(obj)
+        if not objs:
+            del self._nameToObjects[name]
+
+    def _updateObjectNameIndex(self, obj):
+        name = obj.getProperty('Name')
+        if self._objectNames.get(obj) != name:
+            self._removeObjectName(obj)
+            self._addObjectName(obj, name)
+
     def findObjectByName(self, name, parent=None):
         if parent:
             return self.findChildByName(parent, name)
-        for obj in self._objects.values():
-            if obj.getProperty('Name') == name:
-                return obj
+        objs = self._nameToObjects.get(name)
+        if objs:
+            return objs[0]
 
     def findChildByName(self, parent, name):
-        for child in self.getObjectChildren(parent):
-            if child.getProperty('Name') == name:
-                return child
+        objs = self._nameToObjects.get(name)
+        if not objs:
+            return None
+        for obj in objs:
+            if self.getObjectParent(obj) is parent:
+                return obj
+
+    @contextmanager
+    def batchUpdates(self):
+        '''
+        Context manager that defers tree widget repaints, item icon and name
+        refreshes and properties panel rebuilds until the outermost batch
+        exits.  Use it when adding or removing many objects at once.
+        '''
+        self.beginBatchUpdate()
+        try:
+            yield
+        finally:
+            self.endBatchUpdate()
+
+    def beginBatchUpdate(self):
+        self._batchDepth += 1
+        if self._batchDepth == 1 and self._treeWidget is not None:
+            self._treeWidget.setUpdatesEnabled(False)
+
+    def endBatchUpdate(self):
+        assert self._batchDepth > 0
+        self._batchDepth -= 1
+        if self._batchDepth:
+            return
+
+        pendingItemUpdates = self._pendingItemUpdates
+        self._pendingItemUpdates = set()
+        for obj in pendingItemUpdates:
+            if obj._tree is self:
+                self._updateItem(obj)
+
+        if self._pendingPanelUpdate:
+            self._pendingPanelUpdate = False
+            self._onTreeSelectionChanged()
+
+        if self._treeWidget is not None:
+            self._treeWidget.setUpdatesEnabled(True)
+
+    def isBatchUpdating(self):
+        return self._batchDepth > 0
+
+    def _updateItem(self, obj):
+        item = self._getItemForObject(obj)
+        item.setText(0, obj.getProperty('Name'))
+        item.setIcon(0, Icons.getIcon(obj.getProperty('Icon')))
+        if obj.hasProperty('Visible'):
+            isVisible = obj.getProperty('Visible')
+            item.setIcon(1, Icons.getIcon(Icons.Eye if isVisible else Icons.EyeOff))
 
     def onPropertyChanged(self, prop):
 
@@ -254,6 +336,10 @@ class ObjectModelTree(object):
 
     def _onTreeSelectionChanged(self):
 
+        if self._batchDepth:
+            self._pendingPanelUpdate = True
+            return
+
         panel = self.getPropertiesPanel()
         self._blockSignals = True
         panel.clear()
@@ -272,15 +358,25 @@ class ObjectModelTree(object):
         if not obj.hasProperty('Visible'):
             return
 
+        if self._batchDepth:
+            self._pendingItemUpdates.add(obj)
+            return
+
         isVisible = obj.getProperty('Visible')
         item = self._getItemForObject(obj)
         item.setIcon(1, Icons.getIcon(Icons.Eye if isVisible else Icons.EyeOff))
 
     def updateObjectIcon(self, obj):
+        if self._batchDepth:
+            self._pendingItemUpdates.add(obj)
+            return
         item = self._getItemForObject(obj)
         item.setIcon(0, Icons.getIcon(obj.getProperty('Icon')))
 
     def updateObjectName(self, obj):
+        if self._batchDepth:
+            self._pendingItemUpdates.add(obj)
+            return
         item = self._getItemForObject(obj)
         item.setText(0, obj.getProperty('Name'))
 
@@ -289,11 +385,15 @@ class ObjectModelTree(object):
         if propertyName == 'Visible':
             self.updateVisIcon(obj)
         elif propertyName == 'Name':
+            self._updateObjectNameIndex(obj)
             self.updateObjectName(obj)
         elif propertyName == 'Icon':
             self.updateObjectIcon(obj)
 
-        if obj == self.getActiveObject():
+        if self._batchDepth:
+            if not self._pendingPanelUpdate and obj == self.getActiveObject():
+                self._pendingPanelUpdate = True
+        elif obj == self.getActiveObject():
             self._blockSignals = True
             PropertyPanelHelper.onPropertyValueChanged(self.getPropertiesPanel(), obj.properties, propertyName)
             self._blockSignals = False
@@ -307,15 +407,16 @@ class ObjectModelTree(object):
             self.updateVisIcon(obj)
 
 
-    def _removeItemFromObjectModel(self, item):
-        while item.childCount():
-            self._removeItemFromObjectModel(item.child(0))
-
-        try:
-            obj = self._getObjectForItem(item)
-        except KeyError:
+    def _removeObjectFromObjectModel(self, obj):
+        # a removal callback may already have removed the object
+        if not self.hasObject(obj):
             return
 
+        for child in self.getObjectChildren(obj):
+            self._removeObjectFromObjectModel(child)
+
+        item = self._getItemForObject(obj)
+
         obj.callbacks.process(obj.REMOVED_FROM_OBJECT_MODEL, self, obj)
         obj.onRemoveFromObjectModel()
         obj._tree = None
@@ -327,29 +428,38 @@ class ObjectModelTree(object):
             tree.takeTopLevelItem(tree.indexOfTopLevelItem(item))
 
         del self._objects[item]
+        del self._itemForObject[obj]
+        del self._objectChildren[obj]
+        del self._objectChildren[self._objectParents.pop(obj)][obj]
+        self._removeObjectName(obj)
 
 
     def removeFromObjectModel(self, obj):
         if obj is None:
             return
 
-        item = self._getItemForObject(obj)
-        if item:
-            self._removeItemFromObjectModel(item)
+        self._removeObjectFromObjectModel(obj)
 
 
     def addToObjectModel(self, obj, parentObj=None):
         assert obj._tree is None
 
         parentItem = self._getItemForObject(parentObj)
+        if parentItem is None:
+            parentObj = None
         objName = obj.getProperty('Name')
 
         item = QtGui.QTreeWidgetItem(parentItem, [objName])
-        item.setIcon(0, Icons.getIcon(obj.getProperty('Icon')))
 
         obj._tree = self
 
         self._objects[item] = obj
+        self._itemForObject[obj] = item
+        self._objectParents[obj] = parentObj
+        self._objectChildren[obj] = OrderedDict()
+        self._objectChildren[parentObj][obj] = None
+        self._addObjectName(obj, objName)
+        self.updateObjectIcon(obj)
         self.updateVisIcon(obj)
 
         if parentItem is None:
@@ -443,9 +553,12 @@ class ObjectModelTree(object):
 
     def removeSelectedItems(self):
         for item in self.getTreeWidget().selectedItems():
-            obj = self._getObjectForItem(item)
+            # an item is gone if it was the child of an earlier removed item
+            obj = self._objects.get(item)
+            if obj is None:
+                continue
             if (not obj.hasProperty('Deletable')) or obj.getProperty('Deletable'):
-                self._removeItemFromObjectModel(item)
+                self._removeObjectFromObjectModel(obj)
 
 
     def _filterEvent(self, obj, event):
@@ -501,9 +614,15 @@ def clearSelection():
 def getObjects():
     return _t.getObjects()
 
+def hasObject(obj):
+    return _t.hasObject(obj)
+
 def findObjectByName(name, parent=None):
     return _t.findObjectByName(name, parent)
 
+def batchUpdates():
+    return _t.batchUpdates()
+
 def removeFromObjectModel(obj):
     _t.removeFromObjectModel(obj)
 
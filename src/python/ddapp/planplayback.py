@@ -3,6 +3,7 @@ import vtkAll as vtk
 import math
 import time
 import re
+import hashlib
 import numpy as np
 
 from ddapp.timercallback import TimerCallback
@@ -10,9 +11,133 @@ from ddapp import objectmodel as om
 from ddapp.simpletimer import SimpleTimer
 from ddapp.utime import getUtime
 from ddapp import robotstate
+from ddapp import vtkNumpy as vnp
+from ddapp.shallowCopy import shallowCopy
 
 import pickle
 import scipy.interpolate
+from collections import OrderedDict
+
+
+class PlanCache(object):
+    '''
+    A bounded least recently used cache of decoded plans.  Each entry holds
+    the pose times and pose matrix of a plan, or of a list of plans, and the
+    pose interpolators that have been fit to them.  Plans are keyed by a
+    digest of their encoded message.
+    '''
+
+    def __init__(self, maxSize=16):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+
+    @staticmethod
+    def getPlanKey(msgOrList):
+        if isinstance(msgOrList, list):
+            return tuple(PlanCache.getPlanKey(msg) for msg in msgOrList)
+
+        msg = robotstate.asRobotPlan(msgOrList)
+        return hashlib.sha1(msg.encode()).hexdigest()
+
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.entries[key] = entry
+        return entry
+
+    def add(self, key, entry):
+        self.entries[key] = entry
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+_planCache = PlanCache()
+
+
+class RobotLinkMeshes(object):
+    '''
+    The triangulated link meshes of a robot model, expressed in link frames
+    and merged into a single template mesh.  The points of each link are
+    stored contiguously, so posing the robot is one matrix product per link
+    on the template points, instead of re-transforming and appending every
+    visual mesh of the model.
+    '''
+
+    def __init__(self, model):
+
+        self.linkNames = []
+        self.linkRanges = []
+        points = []
+        triangles = []
+        numberOfPoints = 0
+
+        for linkName in model.getLinkNames():
+            polyData = vtk.vtkPolyData()
+            model.getLinkModelMesh(linkName, polyData)
+            if not polyData.GetNumberOfPoints():
+                continue
+
+            triangleFilter = vtk.vtkTriangleFilter()
+            triangleFilter.SetInput(polyData)
+            triangleFilter.Update()
+            polyData = shallowCopy(triangleFilter.GetOutput())
+            if not polyData.GetNumberOfPolys():
+                continue
+
+            linkPoints = vnp.getNumpyFromVtk(polyData, 'Points')
+            linkTriangles = vnp.numpy_support.vtk_to_numpy(polyData.GetPolys().GetData()).reshape(-1, 4)[:,1:]
+
+            self.linkNames.append(str(linkName))
+            self.linkRanges.append((numberOfPoints, numberOfPoints + len(linkPoints)))
+            points.append(linkPoints)
+            triangles.append(linkTriangles + numberOfPoints)
+            numberOfPoints += len(linkPoints)
+
+        self.points = np.vstack(points) if points else np.zeros((0, 3))
+        self.triangles = np.vstack(triangles) if triangles else np.zeros((0, 3), dtype=int)
+
+    def getLinksToWorld(self, model):
+        '''
+        Returns an array of shape (numberOfLinks, 4, 4) with the link to
+        world matrices at the current model pose.
+        '''
+        return np.array(model.getLinksToWorld(self.linkNames)).reshape(-1, 4, 4)
+
+    def transformPoints(self, linksToWorld):
+        '''
+        Given the link to world matrices, returns the template points in
+        world coordinates.
+        '''
+        points = np.empty(self.points.shape, dtype=np.float32)
+        for (start, end), linkToWorld in zip(self.linkRanges, linksToWorld):
+            points[start:end] = np.dot(self.points[start:end], linkToWorld[:3,:3].T) + linkToWorld[:3,3]
+        return points
+
+    def getPolyData(self, pointsList):
+        '''
+        Given a list of transformed point arrays, returns a vtkPolyData with
+        one copy of the template triangles per point array, and a point data
+        array named 'sample index' with the list index of each point.
+        '''
+        numberOfCopies = len(pointsList)
+        numberOfPoints = len(self.points)
+        offsets = np.arange(numberOfCopies).repeat(len(self.triangles)) * numberOfPoints
+        triangles = np.tile(self.triangles, (numberOfCopies, 1)) + offsets[:,np.newaxis]
+
+        cells = np.empty((len(triangles), 4), dtype=vnp.numpy_support.ID_TYPE_CODE)
+        cells[:,0] = 3
+        cells[:,1:] = triangles
+
+        polyData = vtk.vtkPolyData()
+        polyData.SetPoints(vnp.getVtkPointsFromNumpy(np.vstack(pointsList) if pointsList else self.points.astype(np.float32)[:0]))
+        polys = vtk.vtkCellArray()
+        polys.SetCells(len(triangles), vnp.numpy_support.numpy_to_vtkIdTypeArray(cells.ravel(), deep=1))
+        polyData.SetPolys(polys)
+        vnp.addNumpyToVtk(polyData, np.arange(numberOfCopies, dtype=np.int32).repeat(numberOfPoints), 'sample index')
+        return polyData
 
 
 class PlanPlayback(object):
@@ -23,31 +148,49 @@ class PlanPlayback(object):
         self.interpolationMethod = 'slinear'
         self.playbackSpeed = 1.0
         self.jointNameRegex = ''
+        self._linkMeshes = {}
 
     @staticmethod
     def getPlanPoses(msgOrList):
+        '''
+        Returns a tuple (poseTimes, poses) where poses is an array with one
+        drake pose per row.  If given a list of plans, the plans are joined
+        end to end in time.  The returned arrays are copies of the arrays
+        held by the plan cache.
+        '''
+        poseTimes, poses = PlanPlayback._getCachedPlanEntry(msgOrList)['poses']
+        return poseTimes.copy(), poses.copy()
 
-        if isinstance(msgOrList, list):
-            messages = msgOrList
-            allPoseTimes, allPoses = PlanPlayback.getPlanPoses(messages[0])
-
-            for msg in messages[1:]:
-                poseTimes, poses = PlanPlayback.getPlanPoses(msg)
-                poseTimes += allPoseTimes[-1]
-                allPoseTimes = np.hstack((allPoseTimes, poseTimes[1:]))
-                allPoses += poses[1:]
-            return allPoseTimes, allPoses
+    @staticmethod
+    def _getCachedPlanEntry(msgOrList):
 
-        else:
-            msg = robotstate.asRobotPlan(msgOrList)
+        key = PlanCache.getPlanKey(msgOrList)
+        entry = _planCache.get(key)
+        if entry is None:
+            entry = dict(poses=PlanPlayback._computePlanPoses(msgOrList), interpolators={})
+            _planCache.add(key, entry)
+        return entry
 
-            poses = []
-            poseTimes = []
-            for plan in msg.plan:
-                pose = robotstate.convertStateMessageToDrakePose(plan)
-                poseTimes.append(plan.utime / 1e6)
-                poses.append(pose)
-            return np.array(poseTimes), poses
+    @staticmethod
+    def _computePlanPoses(msgOrList):
+
+        if not isinstance(msgOrList, list):
+            return robotstate.convertPlanToDrakePoses(msgOrList)
+
+        allPoseTimes = []
+        allPoses = []
+        timeOffset = 0.0
+        for i, msg in enumerate(msgOrList):
+            poseTimes, poses = PlanPlayback._getCachedPlanEntry(msg)['poses']
+            if i > 0:
+                # the first pose of each following plan repeats the last pose of the previous plan
+                poseTimes, poses = poseTimes[1:], poses[1:]
+            allPoseTimes.append(poseTimes + timeOffset)
+            allPoses.append(poses)
+            if len(allPoseTimes[-1]):
+                timeOffset = allPoseTimes[-1][-1]
+
+        return np.concatenate(allPoseTimes), np.concatenate(allPoses)
 
     @staticmethod
     def getPlanElapsedTime(msg):
@@ -68,20 +211,31 @@ class PlanPlayback(object):
 
     def playPlan(self, msg, jointController):
 
-        self.playPlans(poseTimes, [msg], jointController)
+        self.playPlans([msg], jointController)
 
 
     def playPlans(self, messages, jointController):
 
         assert len(messages)
 
-        poseTimes, poses = self.getPlanPoses(messages)
-        self.playPoses(poseTimes, poses, jointController)
+        poseTimes, poses = self._getCachedPlanEntry(messages)['poses']
+        f = self.getPoseInterpolatorFromPlan(messages)
+        self.playPoses(poseTimes, poses, jointController, poseInterpolator=f)
 
 
     def getPoseInterpolatorFromPlan(self, message):
-        poseTimes, poses = self.getPlanPoses(message)
-        return self.getPoseInterpolator(poseTimes, poses)
+        '''
+        Returns the pose interpolator for the plan, or list of plans, using
+        the current interpolation method.  Interpolators are cached with the
+        plan poses.
+        '''
+        entry = self._getCachedPlanEntry(message)
+        f = entry['interpolators'].get(self.interpolationMethod)
+        if f is None:
+            poseTimes, poses = entry['poses']
+            f = self.getPoseInterpolator(poseTimes, poses)
+            entry['interpolators'][self.interpolationMethod] = f
+        return f
 
 
     def getPoseInterpolator(self, poseTimes, poses, unwrap_rpy=True):
@@ -96,22 +250,51 @@ class PlanPlayback(object):
         return f
 
 
-    def getPlanPoseMeshes(self, messages, jointController, robotModel, numberOfSamples):
-
-        poseTimes, poses = self.getPlanPoses(messages)
-        f = self.getPoseInterpolator(poseTimes, poses)
+    def getLinkMeshes(self, robotModel):
+        '''
+        Returns the RobotLinkMeshes for the robot model.  The link meshes
+        are extracted once per model and cached.
+        '''
+        key = (robotModel, robotModel.model.filename())
+        linkMeshes = self._linkMeshes.get(key)
+        if linkMeshes is None:
+            linkMeshes = RobotLinkMeshes(robotModel.model)
+            self._linkMeshes[key] = linkMeshes
+        return linkMeshes
+
+    def getPlanSamplePoints(self, messages, jointController, robotModel, numberOfSamples):
+        '''
+        Samples the plan at evenly spaced times and returns a list with the
+        robot mesh points at each sample, see RobotLinkMeshes.
+        '''
+        poseTimes, poses = self._getCachedPlanEntry(messages)['poses']
+        f = self.getPoseInterpolatorFromPlan(messages)
         sampleTimes = np.linspace(poseTimes[0], poseTimes[-1], numberOfSamples)
-        meshes = []
+        linkMeshes = self.getLinkMeshes(robotModel)
+        samplePoints = []
 
         for sampleTime in sampleTimes:
+            jointController.setPose('plan_playback', f(sampleTime))
+            linksToWorld = linkMeshes.getLinksToWorld(robotModel.model)
+            samplePoints.append(linkMeshes.transformPoints(linksToWorld))
 
-            pose = f(sampleTime)
-            jointController.setPose('plan_playback', pose)
-            polyData = vtk.vtkPolyData()
-            robotModel.model.getModelMesh(polyData)
-            meshes.append(polyData)
+        return samplePoints
+
+    def getPlanPoseMeshes(self, messages, jointController, robotModel, numberOfSamples):
+
+        linkMeshes = self.getLinkMeshes(robotModel)
+        samplePoints = self.getPlanSamplePoints(messages, jointController, robotModel, numberOfSamples)
+        return [linkMeshes.getPolyData([points]) for points in samplePoints]
 
-        return meshes
+    def getPlanSweptMesh(self, messages, jointController, robotModel, numberOfSamples):
+        '''
+        Returns a single vtkPolyData with the robot mesh at each of the plan
+        samples.  The 'sample index' point data array gives the sample
+        number of each point.
+        '''
+        linkMeshes = self.getLinkMeshes(robotModel)
+        samplePoints = self.getPlanSamplePoints(messages, jointController, robotModel, numberOfSamples)
+        return linkMeshes.getPolyData(samplePoints)
 
 
     def showPoseAtTime(self, time, jointController, poseInterpolator):
@@ -119,9 +302,9 @@ class PlanPlayback(object):
         jointController.setPose('plan_playback', pose)
 
 
-    def playPoses(self, poseTimes, poses, jointController):
+    def playPoses(self, poseTimes, poses, jointController, poseInterpolator=None):
 
-        f = self.getPoseInterpolator(poseTimes, poses)
+        f = poseInterpolator if poseInterpolator is not None else self.getPoseInterpolator(poseTimes, poses)
 
         timer = SimpleTimer()
 
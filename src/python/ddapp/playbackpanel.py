@@ -4,10 +4,10 @@ import math
 import numpy as np
 from ddapp.timercallback import TimerCallback
 from ddapp.simpletimer import SimpleTimer
-from ddapp.debugVis import DebugData
 from ddapp import robotstate
 import ddapp.visualization as vis
 import ddapp.vtkAll as vtk
+from ddapp import vtkNumpy as vnp
 import scipy.interpolate
 
 
@@ -275,23 +275,17 @@ class PlaybackPanel(object):
 
         numberOfSamples = self.getNumberOfSamples()
 
-        meshes = self.planPlayback.getPlanPoseMeshes(self.plan, self.playbackJointController, self.playbackRobotModel, numberOfSamples)
-        d = DebugData()
+        polyData = self.planPlayback.getPlanSweptMesh(self.plan, self.playbackJointController, self.playbackRobotModel, numberOfSamples)
 
         startColor = [0.8, 0.8, 0.8]
         endColor = [85/255.0, 255/255.0, 255/255.0]
-        colorFunc = scipy.interpolate.interp1d([0, numberOfSamples-1], [startColor, endColor], axis=0, kind='slinear')
+        colorFunc = scipy.interpolate.interp1d([0, max(numberOfSamples-1, 1)], [startColor, endColor], axis=0, kind='slinear')
 
-        for i, mesh in reversed(list(enumerate(meshes))):
-            d.addPolyData(mesh, color=colorFunc(i))
+        sampleIndices = vnp.getNumpyFromVtk(polyData, 'sample index')
+        colors = (colorFunc(np.arange(numberOfSamples))*255).astype(np.uint8)
+        vnp.addNumpyToVtk(polyData, colors[sampleIndices], 'RGB255')
 
-        pd = d.getPolyData()
-        clean = vtk.vtkCleanPolyData()
-        clean.SetInput(pd)
-        clean.Update()
-        pd = clean.GetOutput()
-
-        self.planFramesObj = vis.updatePolyData(d.getPolyData(), 'robot plan', alpha=1.0, visible=False, colorByName='RGB255', parent='planning')
+        self.planFramesObj = vis.updatePolyData(polyData, 'robot plan', alpha=1.0, visible=False, colorByName='RGB255', parent='planning')
         self.showPlanFrames()
 
 
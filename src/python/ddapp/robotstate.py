@@ -11,6 +11,8 @@ _drakePoseToRobotStateJointMap = None
 _drakePoseJointNames = None
 _robotStateJointNames = None
 _numPositions = None
+_jointIndicesCache = {}
+_atlasCommandIndices = None
 
 
 def getRollPitchYawFromRobotState(robotState):
@@ -50,15 +52,40 @@ def getDrakePoseToRobotStateJointMap():
     return _drakePoseToRobotStateJointMap
 
 
-def convertStateMessageToDrakePose(msg):
+def getDrakePoseJointIndices(jointNames):
+    '''
+    Given the joint_name list of a robot_state_t message, returns an integer
+    array of indices into that list, such that indexing the joint_position
+    array with it gives the joint positions in drake pose order (the drake
+    pose excluding the 6 base coordinates).  The result is cached for each
+    distinct joint name list.
+    '''
+    key = tuple(jointNames)
+    indices = _jointIndicesCache.get(key)
+    if indices is None:
+        nameToIndex = dict((name, i) for i, name in enumerate(jointNames))
+        indices = np.array([nameToIndex[name] for name in getDrakePoseJointNames()[6:]], dtype=int)
+        _jointIndicesCache[key] = indices
+    return indices
+
+
+def quaternionsToRollPitchYaw(quats):
+    '''
+    Given an Nx4 array of quaternions in w, x, y, z order, returns an Nx3
+    array of roll, pitch, yaw angles.  This is the vectorized form of
+    transformUtils.quaternionToRollPitchYaw.
+    '''
+    quats = np.asarray(quats, dtype=float)
+    w, x, y, z = quats[:,0], quats[:,1], quats[:,2], quats[:,3]
+    roll = np.arctan2(2*(w*x + y*z), w*w - x*x - y*y + z*z)
+    pitch = np.arcsin(np.clip(2*(w*y - x*z), -1.0, 1.0))
+    yaw = np.arctan2(2*(w*z + x*y), w*w + x*x - y*y - z*z)
+    return np.column_stack((roll, pitch, yaw))
+
 
-    jointMap = {}
-    for name, position in zip(msg.joint_name, msg.joint_position):
-        jointMap[name] = position
+def convertStateMessageToDrakePose(msg):
 
-    jointPositions = []
-    for name in getDrakePoseJointNames()[6:]:
-        jointPositions.append(jointMap[name])
+    jointPositions = np.asarray(msg.joint_position)[getDrakePoseJointIndices(msg.joint_name)]
 
     trans = msg.pose.translation
     quat = msg.pose.rotation
@@ -70,11 +97,64 @@ def convertStateMessageToDrakePose(msg):
     assert len(pose) == getNumPositions()
     return pose
 
+
+def convertStateMessagesToDrakePoses(messages):
+    '''
+    Given a list of robot_state_t messages, returns an array of
+    shape (len(messages), numPositions) of drake poses.
+    '''
+    poses = np.empty((len(messages), getNumPositions()))
+    if not len(messages):
+        return poses
+
+    translations = [(m.pose.translation.x, m.pose.translation.y, m.pose.translation.z) for m in messages]
+    quats = [(m.pose.rotation.w, m.pose.rotation.x, m.pose.rotation.y, m.pose.rotation.z) for m in messages]
+    poses[:,:3] = translations
+    poses[:,3:6] = quaternionsToRollPitchYaw(quats)
+
+    jointNames = messages[0].joint_name
+    if all(m.joint_name == jointNames for m in messages):
+        jointPositions = np.array([m.joint_position for m in messages], dtype=float)
+        poses[:,6:] = jointPositions[:,getDrakePoseJointIndices(jointNames)]
+    else:
+        for i, m in enumerate(messages):
+            poses[i,6:] = np.asarray(m.joint_position)[getDrakePoseJointIndices(m.joint_name)]
+
+    return poses
+
+
+def convertPlanToDrakePoses(msg):
+    '''
+    Given a robot_plan_t (or robot_plan_with_supports_t) message, returns
+    a tuple (poseTimes, poses) where poseTimes is an array of the plan
+    state times in seconds and poses is an array of shape
+    (numberOfStates, numPositions) of drake poses.
+    '''
+    states = asRobotPlan(msg).plan
+    poseTimes = np.array([state.utime for state in states], dtype=float) / 1e6
+    return poseTimes, convertStateMessagesToDrakePoses(states)
+
+
+def getAtlasCommandIndices():
+    '''
+    Returns a tuple of integer arrays (robotStateIndices, drakePoseIndices)
+    for the robot state to drake pose joint map.
+    '''
+    global _atlasCommandIndices
+
+    if _atlasCommandIndices is None:
+        jointIndexMap = getRobotStateToDrakePoseJointMap()
+        robotStateIndices = np.array(jointIndexMap.keys(), dtype=int)
+        drakePoseIndices = np.array(jointIndexMap.values(), dtype=int)
+        _atlasCommandIndices = (robotStateIndices, drakePoseIndices)
+
+    return _atlasCommandIndices
+
+
 def atlasCommandToDrakePose(msg):
-    jointIndexMap = getRobotStateToDrakePoseJointMap()
+    robotStateIndices, drakePoseIndices = getAtlasCommandIndices()
     drakePose = np.zeros(len(getDrakePoseJointNames()))
-    for jointIdx, drakeIdx in jointIndexMap.iteritems():
-        drakePose[drakeIdx] = msg.position[jointIdx]
+    drakePose[drakePoseIndices] = np.asarray(msg.position)[robotStateIndices]
     return drakePose.tolist()
 
 
@@ -156,8 +156,8 @@ class RobotSystem(object):
             manipPlanner = robotplanlistener.ManipulationPlanDriver(ikPlanner)
 
             affordanceManager = affordancemanager.AffordanceObjectModelManager(view)
-            affordanceitems.MeshAffordanceItem.getMeshManager().collection.sendEchoRequest()
-            affordanceManager.collection.sendEchoRequest()
+            affordanceitems.MeshAffordanceItem.getMeshManager().collection.sendSnapshotRequest()
+            affordanceManager.collection.sendSnapshotRequest()
             segmentation.affordanceManager = affordanceManager
 
             plannerPub = plannerPublisher.PlannerPublisher(ikPlanner,affordanceManager)
@@ -25,6 +25,7 @@ from ddapp.filterUtils import *
 from ddapp.fieldcontainer import FieldContainer
 from ddapp.segmentationroutines import *
 from ddapp import cameraview
+from ddapp import segmentationworker
 
 import numpy as np
 import vtkNumpy
@@ -75,14 +76,37 @@ def initAffordanceManager(view):
     affordanceManager = affordancemanager.AffordanceObjectModelManager(view)
 
 
-def cropToLineSegment(polyData, point1, point2):
-
+def _getDistanceAlongLineSegment(polyData, point1, point2):
     line = np.array(point2) - np.array(point1)
     length = np.linalg.norm(line)
     axis = line / length
 
-    polyData = labelPointDistanceAlongAxis(polyData, axis, origin=point1, resultArrayName='dist_along_line')
-    return thresholdPoints(polyData, 'dist_along_line', [0.0, length])
+    points = vtkNumpy.getNumpyFromVtk(polyData, 'Points')
+    return np.dot(points - point1, axis), length
+
+
+def getLineSegmentMask(polyData, point1, point2):
+    '''
+    Returns a boolean mask of the points whose projection onto the line
+    through point1 and point2 falls between the two points.
+    '''
+    dist, length = _getDistanceAlongLineSegment(polyData, point1, point2)
+    return getRangeMask(dist, [0.0, length])
+
+
+def _extractPointsWithDistance(polyData, mask, dist):
+    '''
+    Extracts the masked points and labels them with their distance along
+    the crop line in the dist_along_line array.
+    '''
+    polyData = extractPoints(polyData, mask)
+    vtkNumpy.addNumpyToVtk(polyData, dist[mask], 'dist_along_line')
+    return polyData
+
+
+def cropToLineSegment(polyData, point1, point2):
+    dist, length = _getDistanceAlongLineSegment(polyData, point1, point2)
+    return _extractPointsWithDistance(polyData, getRangeMask(dist, [0.0, length]), dist)
 
 
 
@@ -235,27 +259,50 @@ def segmentGround(polyData, groundThickness=0.02, sceneHeightFromGround=0.05):
     ''' A More complex ground removal algorithm. Works when plane isn't
     preceisely flat. First clusters on z to find approx ground height, then fits a plane there
     '''
+    origin, normal, groundPoints, scenePoints, searchRegion = _computeGround(polyData, groundThickness, sceneHeightFromGround)
+    updatePolyData(searchRegion, 'ground search region', parent=getDebugFolder(), colorByName='z', visible=False)
+    return origin, normal, groundPoints, scenePoints
+
+
+def _computeGround(polyData, groundThickness, sceneHeightFromGround):
+    # cached stages must not display anything, their side effects would be
+    # skipped on a cache hit, so the search region is returned to the caller
+    return getSegmentationPipelineCache().compute('segmentGround', _segmentGround, polyData, groundThickness, sceneHeightFromGround)
+
+
+def _segmentGround(polyData, groundThickness, sceneHeightFromGround):
+
+    polyData = shallowCopy(polyData)
 
     searchRegionThickness = 0.5
 
     zvalues = vtkNumpy.getNumpyFromVtk(polyData, 'Points')[:,2]
     groundHeight = np.percentile(zvalues, 5)
 
+    # the z array is carried through to the search region and the ground
+    # and scene outputs, as before, but is added to a copy of the input
     vtkNumpy.addNumpyToVtk(polyData, zvalues.copy(), 'z')
-    searchRegion = thresholdPoints(polyData, 'z', [groundHeight - searchRegionThickness/2.0, groundHeight + searchRegionThickness/2.0])
-
-    updatePolyData(searchRegion, 'ground search region', parent=getDebugFolder(), colorByName='z', visible=False)
-
-    _, origin, normal = applyPlaneFit(searchRegion, distanceThreshold=0.02, expectedNormal=[0,0,1], perpendicularAxis=[0,0,1], returnOrigin=True)
+    searchRegionMask = getRangeMask(zvalues, [groundHeight - searchRegionThickness/2.0, groundHeight + searchRegionThickness/2.0])
+    searchRegion = extractPoints(polyData, searchRegionMask)
+
+    # the ground plane is fit with a fixed seed, so that a cloud always gets
+    # the same ground
+    planes = fitPlanes(searchRegion, maxModels=1, distanceThreshold=0.02, minInliers=3, perpendicularAxis=[0,0,1], seed=0)
+    if planes:
+        origin, normal = planes[0].origin, planes[0].normal
+    else:
+        origin, normal = np.array([0.0, 0.0, groundHeight]), np.array([0.0, 0.0, 1.0])
+    if normal[2] < 0:
+        normal = -normal
 
     points = vtkNumpy.getNumpyFromVtk(polyData, 'Points')
     dist = np.dot(points - origin, normal)
     vtkNumpy.addNumpyToVtk(polyData, dist, 'dist_to_plane')
 
-    groundPoints = thresholdPoints(polyData, 'dist_to_plane', [-groundThickness/2.0, groundThickness/2.0])
-    scenePoints = thresholdPoints(polyData, 'dist_to_plane', [sceneHeightFromGround, 100])
+    groundPoints = extractPoints(polyData, getRangeMask(dist, [-groundThickness/2.0, groundThickness/2.0]))
+    scenePoints = extractPoints(polyData, getRangeMask(dist, [sceneHeightFromGround, 100]))
 
-    return origin, normal, groundPoints, scenePoints
+    return origin, normal, groundPoints, scenePoints, searchRegion
 
 
 def segmentGroundPlane():
@@ -337,8 +384,9 @@ def applyLocalPlaneFit(polyData, searchPoint, searchRadius, searchRadiusEnd=None
     clusters = extractClusters(surfaces, clusterTolerance=0.1, minClusterSize=5)
     clusters = clusters[:10]
 
-    for i, cluster in enumerate(clusters):
-        showPolyData(cluster, 'plane cluster %i' % i, parent=getDebugFolder(), visible=False)
+    with om.batchUpdates():
+        for i, cluster in enumerate(clusters):
+            showPolyData(cluster, 'plane cluster %i' % i, parent=getDebugFolder(), visible=False)
 
     return fitPoints
 
@@ -382,26 +430,19 @@ def getMajorPlanes(polyData, useVoxelGrid=True):
 
     minClusterSize = 100
 
-    while len(polyDataList) < 25:
+    planes = fitPlanes(polyData, maxModels=25, distanceThreshold=distanceToPlaneThreshold, minInliers=minClusterSize)
 
-        f = planeSegmentationFilter()
-        f.SetInput(polyData)
-        f.SetDistanceThreshold(distanceToPlaneThreshold)
-        f.Update()
-        polyData = shallowCopy(f.GetOutput())
+    for plane in planes:
 
-        outliers = thresholdPoints(polyData, 'ransac_labels', [0, 0])
-        inliers = thresholdPoints(polyData, 'ransac_labels', [1, 1])
+        inliers = extractPoints(polyData, plane.inliers)
         largestCluster = extractLargestCluster(inliers)
 
         #i = len(polyDataList)
         #showPolyData(inliers, 'inliers %d' % i, color=getRandomColor(), parent='major planes')
-        #showPolyData(outliers, 'outliers %d' % i, color=getRandomColor(), parent='major planes')
         #showPolyData(largestCluster, 'cluster %d' % i, color=getRandomColor(), parent='major planes')
 
         if largestCluster.GetNumberOfPoints() > minClusterSize:
             polyDataList.append(largestCluster)
-            polyData = outliers
         else:
             break
 
@@ -425,9 +466,10 @@ def showMajorPlanes(polyData=None):
 
     polyDataList = getMajorPlanes(polyData)
 
-    for i, polyData in enumerate(polyDataList):
-        obj = showPolyData(polyData, 'plane %d' % i, color=getRandomColor(), visible=True, parent='major planes')
-        obj.setProperty('Point Size', 3)
+    with om.batchUpdates():
+        for i, polyData in enumerate(polyDataList):
+            obj = showPolyData(polyData, 'plane %d' % i, color=getRandomColor(), visible=True, parent='major planes')
+            obj.setProperty('Point Size', 3)
 
 
 def cropToBox(polyData, transform, dimensions):
@@ -437,11 +479,13 @@ def cropToBox(polyData, transform, dimensions):
     origin = np.array(transform.GetPosition())
     axes = transformUtils.getAxesFromTransform(transform)
 
+    mask = np.ones(polyData.GetNumberOfPoints(), dtype=bool)
     for axis, length in zip(axes, dimensions):
         cropAxis = np.array(axis)*(length/2.0)
-        polyData = cropToLineSegment(polyData, origin - cropAxis, origin + cropAxis)
+        dist, lineLength = _getDistanceAlongLineSegment(polyData, origin - cropAxis, origin + cropAxis)
+        mask &= getRangeMask(dist, [0.0, lineLength])
 
-    return polyData
+    return _extractPointsWithDistance(polyData, mask, dist)
 
 def cropToBounds(polyData, transform, bounds):
     '''
@@ -450,16 +494,20 @@ def cropToBounds(polyData, transform, bounds):
     origin = np.array(transform.GetPosition())
     axes = transformUtils.getAxesFromTransform(transform)
 
+    mask = np.ones(polyData.GetNumberOfPoints(), dtype=bool)
     for axis, bound in zip(axes, bounds):
         axis = np.array(axis)/np.linalg.norm(axis)
-        polyData = cropToLineSegment(polyData, origin + axis*bound[0], origin + axis*bound[1])
+        dist, length = _getDistanceAlongLineSegment(polyData, origin + axis*bound[0], origin + axis*bound[1])
+        mask &= getRangeMask(dist, [0.0, length])
 
-    return polyData
+    return _extractPointsWithDistance(polyData, mask, dist)
 
 
 def cropToSphere(polyData, origin, radius):
-    polyData = labelDistanceToPoint(polyData, origin)
-    return thresholdPoints(polyData, 'distance_to_point', [0, radius])
+    ids, dists = getSpatialIndex(polyData).findPointsWithinRadius(origin, radius)
+    polyData = extractPoints(polyData, ids)
+    vtkNumpy.addNumpyToVtk(polyData, dists, 'distance_to_point')
+    return polyData
 
 
 def applyPlaneFit(polyData, distanceThreshold=0.02, expectedNormal=None, perpendicularAxis=None, angleEpsilon=0.2, returnOrigin=False, searchOrigin=None, searchRadius=None):
@@ -506,16 +554,22 @@ def flipNormalsWithViewDirection(polyData, viewDirection):
 
 
 def normalEstimation(dataObj, searchCloud=None, searchRadius=0.05, useVoxelGrid=False, voxelGridLeafSize=0.05):
+    return getSegmentationPipelineCache().compute('normalEstimation', _normalEstimation, dataObj, searchCloud, searchRadius, useVoxelGrid, voxelGridLeafSize)
 
-    f = vtk.vtkPCLNormalEstimation()
-    f.SetSearchRadius(searchRadius)
-    f.SetInput(dataObj)
-    if searchCloud:
-        f.SetInput(1, searchCloud)
-    elif useVoxelGrid:
-        f.SetInput(1, applyVoxelGrid(dataObj, voxelGridLeafSize))
-    f.Update()
-    dataObj = shallowCopy(f.GetOutput())
+
+def _normalEstimation(dataObj, searchCloud, searchRadius, useVoxelGrid, voxelGridLeafSize):
+
+    if not searchCloud:
+        searchCloud = applyVoxelGrid(dataObj, voxelGridLeafSize) if useVoxelGrid else dataObj
+
+    # the neighborhoods come from the shared spatial index of the search
+    # cloud, so the outlier labeling and later normal estimations on the
+    # same cloud reuse it
+    points = vtkNumpy.getNumpyFromVtk(dataObj, 'Points')
+    normals = getSpatialIndex(searchCloud, searchRadius).estimateNormals(points, searchRadius)
+
+    dataObj = shallowCopy(dataObj)
+    vtkNumpy.addNumpyToVtk(dataObj, normals, 'normals')
     dataObj.GetPointData().SetNormals(dataObj.GetPointData().GetArray('normals'))
 
     return dataObj
@@ -697,8 +751,8 @@ def removeGroundSimple(polyData, groundThickness=0.02, sceneHeightFromGround=0.0
     dist = np.dot(points - origin, normal)
     vtkNumpy.addNumpyToVtk(polyData, dist, 'dist_to_plane')
 
-    groundPoints = thresholdPoints(polyData, 'dist_to_plane', [-groundThickness/2.0, groundThickness/2.0])
-    scenePoints = thresholdPoints(polyData, 'dist_to_plane', [sceneHeightFromGround, 100])
+    groundPoints = extractPoints(polyData, getRangeMask(dist, [-groundThickness/2.0, groundThickness/2.0]))
+    scenePoints = extractPoints(polyData, getRangeMask(dist, [sceneHeightFromGround, 100]))
 
     return groundPoints, scenePoints
 
@@ -866,7 +920,7 @@ def cropToPlane(polyData, origin, normal, threshold):
     points = vtkNumpy.getNumpyFromVtk(polyData, 'Points')
     dist = np.dot(points - origin, normal)
     vtkNumpy.addNumpyToVtk(polyData, dist, 'dist_to_plane')
-    cropped = thresholdPoints(polyData, 'dist_to_plane', threshold)
+    cropped = extractPoints(polyData, getRangeMask(dist, threshold))
     return cropped, polyData
 
 
@@ -1277,15 +1331,32 @@ def segmentValveByRim(polyData, rimPoint1, rimPoint2):
 
 def segmentValveByWallPlane(expectedValveRadius, point1, point2):
 
+    inputObj = om.findObjectByName('pointcloud snapshot')
+    viewDirection = SegmentationContext.getGlobalInstance().getViewDirection()
+    showValveByWallPlaneFit(fitValveByWallPlane(inputObj.polyData, expectedValveRadius, point1, point2, viewDirection))
 
-    centerPoint = (point1 + point2) / 2.0
 
+def segmentValveByWallPlaneInBackground(expectedValveRadius, point1, point2):
+    '''
+    Runs the point cloud processing of segmentValveByWallPlane in a worker
+    process and shows the valve affordance when the fit completes.
+    '''
     inputObj = om.findObjectByName('pointcloud snapshot')
-    polyData = inputObj.polyData
+    viewDirection = SegmentationContext.getGlobalInstance().getViewDirection()
+    return segmentationworker.startTask('valve fit', fitValveByWallPlane, args=(inputObj.polyData, expectedValveRadius, point1, point2, viewDirection), onResult=showValveByWallPlaneFit)
+
+
+def fitValveByWallPlane(polyData, expectedValveRadius, point1, point2, viewDirection):
+    '''
+    Fits the wall plane and the valve circle between point1 and point2.
+    Only does point cloud processing, so it may run in a segmentation
+    worker.  Returns the valve frame and radius.
+    '''
+    centerPoint = (point1 + point2) / 2.0
 
     _ , polyData =  removeGround(polyData)
+    segmentationworker.reportProgress(0.3, 'wall plane')
 
-    viewDirection = SegmentationContext.getGlobalInstance().getViewDirection()
     polyData, origin, normal = applyPlaneFit(polyData, expectedNormal=-viewDirection, returnOrigin=True)
 
 
@@ -1314,6 +1385,7 @@ def segmentValveByWallPlane(expectedValveRadius, point1, point2):
     searchRegion = thresholdPoints(searchRegion, 'dist_to_plane', [-0.015, 0.015])
 
     updatePolyData(searchRegion, 'valve search region 2', parent=getDebugFolder(), color=[0,1,0], visible=False)
+    segmentationworker.reportProgress(0.7, 'valve plane')
 
 
     largestCluster = extractLargestCluster(searchRegion, minClusterSize=1)
@@ -1375,6 +1447,16 @@ def segmentValveByWallPlane(expectedValveRadius, point1, point2):
     else:
         spoke_angle = 0
 
+    segmentationworker.reportProgress(1.0, 'valve')
+    return dict(frame=t, radius=radius, spokeAngle=spoke_angle)
+
+
+def showValveByWallPlaneFit(fit):
+
+    t = fit['frame']
+    radius = fit['radius']
+    spoke_angle = fit['spokeAngle']
+
     spokeAngleTransform = transformUtils.frameFromPositionAndRPY([0,0,0], [0,0,spoke_angle])
     spokeTransform = transformUtils.copyFrame(t)
     spokeAngleTransform.Concatenate(spokeTransform)
@@ -2500,9 +2582,10 @@ def segmentTableSceneClusters(polyData, searchPoint, clusterInXY=False):
     objectClusters = extractClusters(searchRegion, clusterInXY, clusterTolerance=0.02, minClusterSize=10)
 
     #print 'got %d clusters' % len(objectClusters)
-    for i,c in enumerate(objectClusters):
-        name= "cluster %d" % i
-        showPolyData(c, name, color=getRandomColor(), visible=False, parent=getDebugFolder())
+    with om.batchUpdates():
+        for i,c in enumerate(objectClusters):
+            name= "cluster %d" % i
+            showPolyData(c, name, color=getRandomColor(), visible=False, parent=getDebugFolder())
 
     return objectClusters, tablePoints, plane_origin, plane_normal
 
@@ -2567,20 +2650,40 @@ def segmentDrillAuto(point1, polyData=None):
         inputObj = om.findObjectByName('pointcloud snapshot')
         polyData = inputObj.polyData
 
+    showDrillAutoFit(fitDrillAuto(polyData, point1))
+
+
+def segmentDrillAutoInBackground(point1, polyData=None):
+    '''
+    Runs the point cloud processing of segmentDrillAuto in a worker process
+    and shows the drill affordance when the fit completes.
+    '''
+    if polyData is None:
+        inputObj = om.findObjectByName('pointcloud snapshot')
+        polyData = inputObj.polyData
+
+    return segmentationworker.startTask('drill fit', fitDrillAuto, args=(polyData, point1), onResult=showDrillAutoFit)
+
+
+def fitDrillAuto(polyData, point1):
+    '''
+    Fits the table plane near point1 and the drill standing on it.  Only
+    does point cloud processing, so it may run in a segmentation worker.
+    Returns a dict with the fit results, see showDrillAutoFit.
+    '''
     expectedNormal = np.array([0.0, 0.0, 1.0])
 
     polyData, origin, normal = applyPlaneFit(polyData, expectedNormal=expectedNormal, perpendicularAxis=expectedNormal, searchOrigin=point1, searchRadius=0.4, angleEpsilon=0.2, returnOrigin=True)
+    segmentationworker.reportProgress(0.4, 'table plane')
 
+    tablePlanePoints = thresholdPoints(polyData, 'dist_to_plane', [-0.01, 0.01])
 
-    tablePoints = thresholdPoints(polyData, 'dist_to_plane', [-0.01, 0.01])
-    updatePolyData(tablePoints, 'table plane points', parent=getDebugFolder(), visible=False)
-
-    tablePoints = labelDistanceToPoint(tablePoints, point1)
+    tablePoints = labelDistanceToPoint(tablePlanePoints, point1)
     tablePointsClusters = extractClusters(tablePoints)
     tablePointsClusters.sort(key=lambda x: vtkNumpy.getNumpyFromVtk(x, 'distance_to_point').min())
 
     tablePoints = tablePointsClusters[0]
-    updatePolyData(tablePoints, 'table points', parent=getDebugFolder(), visible=False)
+    segmentationworker.reportProgress(0.7, 'table clusters')
 
     searchRegion = thresholdPoints(polyData, 'dist_to_plane', [0.03, 0.4])
     searchRegion = cropToSphere(searchRegion, point1, 0.30)
@@ -2590,9 +2693,22 @@ def segmentDrillAuto(point1, polyData=None):
     # determine drill orientation (rotation about z axis)
 
     centroids = computeCentroids(drillPoints, axis=normal)
+    segmentationworker.reportProgress(1.0, 'drill')
+
+    return dict(origin=np.array(origin), normal=np.array(normal), centroids=centroids,
+                tablePlanePoints=tablePlanePoints, tablePoints=tablePoints)
+
+
+def showDrillAutoFit(fit):
+
+    updatePolyData(fit['tablePlanePoints'], 'table plane points', parent=getDebugFolder(), visible=False)
+    updatePolyData(fit['tablePoints'], 'table points', parent=getDebugFolder(), visible=False)
+
+    origin = fit['origin']
+    normal = fit['normal']
+    centroids = fit['centroids']
 
     centroidsPolyData = vtkNumpy.getVtkPolyDataFromNumpyPoints(centroids)
-    d = DebugData()
     updatePolyData(centroidsPolyData, 'cluster centroids', parent=getDebugFolder(), visible=False)
 
     drillToTopPoint = np.array([-0.002904, -0.010029, 0.153182])
@@ -2708,25 +2824,14 @@ def findHorizontalSurfaces(polyData, removeGroundFirst=False, normalEstimationSe
 
     if (removeGroundFirst):
         groundPoints, scenePoints =  removeGround(polyData, groundThickness=0.02, sceneHeightFromGround=0.05)
-        scenePoints = thresholdPoints(scenePoints, 'dist_to_plane', searchZ)
         updatePolyData(groundPoints, 'ground points', parent=getDebugFolder(), visible=verboseFlag)
-    else:
-        scenePoints = polyData
 
+    scenePoints = getSegmentationPipelineCache().compute('findHorizontalSurfacesNormals', _computeSceneNormals,
+                      polyData, removeGroundFirst, searchZ, normalEstimationSearchRadius, voxelGridLeafSize)
 
-
-    if not scenePoints.GetNumberOfPoints():
+    if scenePoints is None:
         return
 
-    f = vtk.vtkPCLNormalEstimation()
-    f.SetSearchRadius(normalEstimationSearchRadius)
-    f.SetInput(scenePoints)
-    f.SetInput(1, applyVoxelGrid(scenePoints, voxelGridLeafSize))
-
-    # Duration 0.2 sec for V1 log:
-    f.Update()
-    scenePoints = shallowCopy(f.GetOutput())
-
     normals = vtkNumpy.getNumpyFromVtk(scenePoints, 'normals')
     normalsDotUp = np.abs(np.dot(normals, [0,0,1]))
 
@@ -2762,6 +2867,21 @@ def findHorizontalSurfaces(polyData, removeGroundFirst=False, normalEstimationSe
     return clustersLarge
 
 
+def _computeSceneNormals(polyData, removeGroundFirst, searchZ, normalEstimationSearchRadius, voxelGridLeafSize):
+
+    if (removeGroundFirst):
+        _, _, groundPoints, scenePoints, _ = _computeGround(polyData, 0.02, 0.05)
+        scenePoints = thresholdPoints(scenePoints, 'dist_to_plane', searchZ)
+    else:
+        scenePoints = polyData
+
+    if not scenePoints.GetNumberOfPoints():
+        return None
+
+    # Duration 0.2 sec for V1 log:
+    return normalEstimation(scenePoints, searchRadius=normalEstimationSearchRadius, useVoxelGrid=True, voxelGridLeafSize=voxelGridLeafSize)
+
+
 def fitVerticalPosts(polyData):
 
     groundPoints, scenePoints =  removeGround(polyData)
@@ -3031,7 +3151,21 @@ def segmentDrillBarrel(point1):
 
     forwardDirection = -np.array(getCurrentView().camera().GetViewPlaneNormal())
 
-    t = segmentDrillBarrel(point1, polyData, forwardDirection)
+    return showDrillBarrelFit(segmentDrillBarrelFrame(point1, polyData, forwardDirection))
+
+
+def segmentDrillBarrelInBackground(point1):
+    '''
+    Runs the point cloud processing of segmentDrillBarrel in a worker
+    process and shows the drill affordance when the fit completes.
+    '''
+    inputObj = om.findObjectByName('pointcloud snapshot')
+    forwardDirection = -np.array(getCurrentView().camera().GetViewPlaneNormal())
+    return segmentationworker.startTask('drill barrel fit', segmentDrillBarrelFrame, args=(point1, inputObj.polyData, forwardDirection), onResult=showDrillBarrelFit)
+
+
+def showDrillBarrelFit(t):
+
     assert t is not None
 
     drillMesh = getDrillBarrelMesh()
@@ -3055,7 +3189,27 @@ def segmentDrillAlignedWithTable(point, polyData = None):
     '''
     inputObj = om.findObjectByName('pointcloud snapshot')
     polyData = polyData or inputObj.polyData
+    viewDirection = SegmentationContext.getGlobalInstance().getViewDirection()
+    showDrillAlignedWithTableFit(fitDrillAlignedWithTable(polyData, point, viewDirection))
+
+
+def segmentDrillAlignedWithTableInBackground(point, polyData=None):
+    '''
+    Runs the point cloud processing of segmentDrillAlignedWithTable in a
+    worker process and shows the drill affordance when the fit completes.
+    '''
+    inputObj = om.findObjectByName('pointcloud snapshot')
+    polyData = polyData or inputObj.polyData
+    viewDirection = SegmentationContext.getGlobalInstance().getViewDirection()
+    return segmentationworker.startTask('drill fit', fitDrillAlignedWithTable, args=(polyData, point, viewDirection), onResult=showDrillAlignedWithTableFit)
+
 
+def fitDrillAlignedWithTable(polyData, point, viewDirection):
+    '''
+    Fits the table and the drill standing on it.  Only does point cloud
+    processing, so it may run in a segmentation worker.  Returns the drill
+    frame.
+    '''
     # segment the table and recover the precise up direction normal:
     polyDataOut, tablePoints, origin, normal = segmentTable(polyData,point)
     #print origin # this origin is bunk
@@ -3072,7 +3226,6 @@ def segmentDrillAlignedWithTable(point, polyData = None):
     #print axes
 
     # check which direction the robot is facing and flip x-axis of table if necessary
-    viewDirection = SegmentationContext.getGlobalInstance().getViewDirection()
     #print "main axes", axes[1]
     #print "viewDirection", viewDirection
     #dp = np.dot(axes[1], viewDirection)
@@ -3108,6 +3261,10 @@ def segmentDrillAlignedWithTable(point, polyData = None):
     #table_xaxis, table_yaxis, table_zaxis = transformUtils.getAxesFromTransform( data.table.frame )
     #drillOrientation = transformUtils.orientationFromAxes( table_yaxis, table_xaxis,  -1*np.array( table_zaxis) )
     drillTransform = transformUtils.frameFromPositionAndRPY( data.clusters[0].frame.GetPosition() , tableOrientation.GetOrientation() )
+    return drillTransform
+
+
+def showDrillAlignedWithTableFit(drillTransform):
 
     drillMesh = getDrillMesh()
 
@@ -3434,62 +3591,106 @@ def getPlaneEquationFromPolyData(polyData, expectedNormal):
 
 def computeEdge(polyData, edgeAxis, perpAxis, binWidth=0.03):
 
-    polyData = labelPointDistanceAlongAxis(polyData, edgeAxis, resultArrayName='dist_along_edge')
-    polyData = labelPointDistanceAlongAxis(polyData, perpAxis, resultArrayName='dist_perp_to_edge')
+    stats = computeBinStatisticsAlongAxis(polyData, edgeAxis, binWidth, valueAxis=perpAxis)
+    return vtkNumpy.getNumpyFromVtk(polyData, 'Points')[stats.argmax]
 
 
-    polyData, bins = binByScalar(polyData, 'dist_along_edge', binWidth)
-    points = vtkNumpy.getNumpyFromVtk(polyData, 'Points')
-    binLabels = vtkNumpy.getNumpyFromVtk(polyData, 'bin_labels')
-    distToEdge = vtkNumpy.getNumpyFromVtk(polyData, 'dist_perp_to_edge')
+def computeCentroids(polyData, axis, binWidth=0.025):
 
-    numberOfBins = len(bins) - 1
-    edgePoints = []
-    for i in xrange(numberOfBins):
-        binPoints = points[binLabels == i]
-        binDists = distToEdge[binLabels == i]
-        if len(binDists):
-            edgePoints.append(binPoints[binDists.argmax()])
+    stats = computeBinStatisticsAlongAxis(polyData, axis, binWidth)
+    return stats.centroids
 
-    return np.array(edgePoints)
 
+def computePointCountsAlongAxis(polyData, axis, binWidth=0.025):
 
-def computeCentroids(polyData, axis, binWidth=0.025):
+    stats = computeBinStatisticsAlongAxis(polyData, axis, binWidth)
+    binCounts = np.zeros(stats.numberOfBins, dtype=int)
+    binCounts[stats.bins] = stats.counts
+    return binCounts
 
-    polyData = labelPointDistanceAlongAxis(polyData, axis, resultArrayName='dist_along_axis')
 
-    polyData, bins = binByScalar(polyData, 'dist_along_axis', binWidth)
+def computeBinStatisticsAlongAxis(polyData, axis, binWidth, valueAxis=None):
+    '''
+    Bins the points of polyData by their distance along axis, using bins of
+    size binWidth, and returns computeBinStatistics() for the bins.  If
+    valueAxis is given, argmax and argmin locate the point of each bin that
+    is farthest and nearest along valueAxis.  The returned container also
+    has the bin edges and the total numberOfBins, including empty bins.
+    '''
     points = vtkNumpy.getNumpyFromVtk(polyData, 'Points')
-    binLabels = vtkNumpy.getNumpyFromVtk(polyData, 'bin_labels')
-
+    binLabels, bins = computeBinLabels(np.dot(points, axis), binWidth)
     numberOfBins = len(bins) - 1
-    centroids = []
-    for i in xrange(numberOfBins):
-        binPoints = points[binLabels == i]
 
-        if len(binPoints):
-            centroids.append(np.average(binPoints, axis=0))
+    # points beyond the last bin edge are not assigned to a bin
+    inRange = binLabels < numberOfBins
+    pointIds = np.flatnonzero(inRange)
 
-    return np.array(centroids)
+    values = np.dot(points[pointIds], valueAxis) if valueAxis is not None else None
+    stats = computeBinStatistics(points[pointIds], binLabels[pointIds], values)
+    if values is not None:
+        stats.argmax = pointIds[stats.argmax]
+        stats.argmin = pointIds[stats.argmin]
 
+    stats._add_fields(binEdges=bins, numberOfBins=numberOfBins)
+    return stats
 
-def computePointCountsAlongAxis(polyData, axis, binWidth=0.025):
 
-    polyData = labelPointDistanceAlongAxis(polyData, axis, resultArrayName='dist_along_axis')
+def computeBinStatistics(points, binLabels, values=None):
+    '''
+    Computes statistics for groups of points in a single pass.  binLabels
+    holds an integer bin label for each point, and values an optional
+    scalar for each point.  Returns a FieldContainer with, for each non empty
+    bin in increasing label order:
+
+        bins: the bin label
+        counts: the number of points in the bin
+        centroids: the mean of the points in the bin
+        argmax, argmin: the index into points of the point with the
+                        largest and smallest value in the bin
+
+    argmax and argmin are None if values is not given.  When several points
+    share the extreme value, the first one is returned, like numpy argmax.
+    '''
+    binLabels = np.asarray(binLabels)
+    points = np.asarray(points)
 
-    polyData, bins = binByScalar(polyData, 'dist_along_axis', binWidth)
-    points = vtkNumpy.getNumpyFromVtk(polyData, 'Points')
-    binLabels = vtkNumpy.getNumpyFromVtk(polyData, 'bin_labels')
+    if not len(binLabels):
+        emptyIds = np.zeros(0, dtype=int)
+        return FieldContainer(bins=emptyIds, counts=emptyIds, centroids=np.zeros((0, points.shape[1])),
+                              argmax=emptyIds if values is not None else None,
+                              argmin=emptyIds if values is not None else None)
 
-    numberOfBins = len(bins) - 1
-    binCount = []
-    for i in xrange(numberOfBins):
-        binPoints = points[binLabels == i]
-        binCount.append(len(binPoints))
+    order = np.argsort(binLabels, kind='mergesort')
+    sortedLabels = binLabels[order]
+    starts = np.flatnonzero(np.concatenate(([True], sortedLabels[1:] != sortedLabels[:-1])))
+    ends = np.concatenate((starts[1:], [len(sortedLabels)]))
+    counts = ends - starts
 
-    return np.array(binCount)
+    centroids = np.add.reduceat(points[order], starts, axis=0) / counts[:,np.newaxis].astype(float)
 
+    argmax = argmin = None
+    if values is not None:
+        # sort by label, then value, then point index so that the first
+        # point of each run is the first minimum of the bin
+        pointIndices = np.arange(len(binLabels))
+        argmin = np.lexsort((pointIndices, values, binLabels))[starts]
+        # sorting by descending index makes the last point of each run the
+        # first maximum of the bin
+        argmax = np.lexsort((-pointIndices, values, binLabels))[ends - 1]
 
+    return FieldContainer(bins=sortedLabels[starts], counts=counts, centroids=centroids, argmax=argmax, argmin=argmin)
+
+
+def computeBinLabels(scalars, binWidth):
+    '''
+    Divides the range of scalars into bins of size binWidth.  Returns the
+    bin label of each scalar, where the first bin is labeled with 0, and the
+    bin edges.
+    '''
+    bins = np.arange(scalars.min(), scalars.max()+binWidth, binWidth)
+    binLabels = np.digitize(scalars, bins) - 1
+    assert(len(binLabels) == len(scalars))
+    return binLabels, bins
 
 
 def binByScalar(lidarData, scalarArrayName, binWidth, binLabelsArrayName='bin_labels'):
@@ -3503,9 +3704,7 @@ def binByScalar(lidarData, scalarArrayName, binWidth, binLabelsArrayName='bin_la
     '''
 
     scalars = vtkNumpy.getNumpyFromVtk(lidarData, scalarArrayName)
-    bins = np.arange(scalars.min(), scalars.max()+binWidth, binWidth)
-    binLabels = np.digitize(scalars, bins) - 1
-    assert(len(binLabels) == len(scalars))
+    binLabels, bins = computeBinLabels(scalars, binWidth)
     newData = shallowCopy(lidarData)
     vtkNumpy.addNumpyToVtk(newData, binLabels, binLabelsArrayName)
     return newData, bins
@@ -4062,7 +4261,7 @@ def startValveSegmentationByWallPlane(expectedValveRadius):
     addViewPicker(picker)
     picker.enabled = True
     picker.start()
-    picker.annotationFunc = functools.partial(segmentValveByWallPlane, expectedValveRadius)
+    picker.annotationFunc = functools.partial(segmentValveByWallPlaneInBackground, expectedValveRadius)
 
 
 def startValveSegmentationManual(expectedValveRadius):
@@ -4172,7 +4371,7 @@ def startDrillAutoSegmentation():
     picker.enabled = True
     picker.drawLines = False
     picker.start()
-    picker.annotationFunc = functools.partial(segmentDrillAuto)
+    picker.annotationFunc = functools.partial(segmentDrillAutoInBackground)
 
 
 def startDrillButtonSegmentation():
@@ -4202,7 +4401,7 @@ def startDrillAutoSegmentationAlignedWithTable():
     picker.enabled = True
     picker.drawLines = False
     picker.start()
-    picker.annotationFunc = functools.partial(segmentDrillAlignedWithTable)
+    picker.annotationFunc = functools.partial(segmentDrillAlignedWithTableInBackground)
 
 
 def startDrillBarrelSegmentation():
@@ -4212,7 +4411,7 @@ def startDrillBarrelSegmentation():
     picker.enabled = True
     picker.drawLines = False
     picker.start()
-    picker.annotationFunc = functools.partial(segmentDrillBarrel)
+    picker.annotationFunc = functools.partial(segmentDrillBarrelInBackground)
 
 
 def startDrillWallSegmentation():
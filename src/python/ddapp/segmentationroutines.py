@@ -20,6 +20,8 @@ import vtkNumpy
 import numpy as np
 from shallowCopy import shallowCopy
 from debugVis import DebugData
+from collections import OrderedDict
+from ddapp.fieldcontainer import FieldContainer
 
 
 
@@ -178,6 +180,244 @@ def applyLineFit(dataObj, distanceThreshold=0.02):
     return origin, direction, shallowCopy(f.GetOutput())
 
 
+def fitPlanes(polyData, maxModels=5, distanceThreshold=0.02, minInliers=100, perpendicularAxis=None, angleEpsilon=0.2, **kwargs):
+    '''
+    Extracts up to maxModels planes from polyData, largest first, using
+    RANSAC.  The inliers of each plane are removed before the next plane is
+    fit.  Returns a list of FieldContainers with fields origin, normal,
+    inliers (a boolean mask over the points of polyData) and
+    numberOfInliers.  Fitting stops early when the best plane has fewer than
+    minInliers points.  If perpendicularAxis is given, only planes whose
+    normal is within angleEpsilon radians of the axis are fit, like the
+    perpendicular constraint of applyPlaneFit.  See fitModels for the other
+    keyword arguments.
+    '''
+    points = vtkNumpy.getNumpyFromVtk(polyData, 'Points')
+    model = _PerpendicularPlaneModel(perpendicularAxis, angleEpsilon) if perpendicularAxis is not None else _PlaneModel
+    models = fitModels(points, model, maxModels, distanceThreshold, minInliers, **kwargs)
+    return [FieldContainer(origin=origin, normal=normal, inliers=inliers, numberOfInliers=int(inliers.sum()))
+              for (origin, normal), inliers in models]
+
+
+def fitLines(polyData, maxModels=5, distanceThreshold=0.02, minInliers=10, **kwargs):
+    '''
+    Extracts up to maxModels lines from polyData, like fitPlanes.  Returns
+    a list of FieldContainers with fields origin, direction, inliers and
+    numberOfInliers.
+    '''
+    points = vtkNumpy.getNumpyFromVtk(polyData, 'Points')
+    models = fitModels(points, _LineModel, maxModels, distanceThreshold, minInliers, **kwargs)
+    return [FieldContainer(origin=origin, direction=direction, inliers=inliers, numberOfInliers=int(inliers.sum()))
+              for (origin, direction), inliers in models]
+
+
+class _PlaneModel(object):
+
+    sampleSize = 3
+
+    @staticmethod
+    def fromSamples(p0, p1, p2):
+        normals = np.cross(p1 - p0, p2 - p0)
+        norms = np.sqrt(np.sum(normals**2, axis=1))
+        valid = norms > 1e-9
+        normals[valid] /= norms[valid][:,np.newaxis]
+        return (p0, normals), valid
+
+    @staticmethod
+    def scoreDistances(points, hypotheses):
+        '''
+        Returns the MxH matrix of point to plane distances.
+        '''
+        origins, normals = hypotheses
+        return np.abs(np.dot(points, normals.T) - np.sum(origins*normals, axis=1))
+
+    @staticmethod
+    def refine(points):
+        origin = points.mean(axis=0)
+        _, _, vt = np.linalg.svd(points - origin, full_matrices=False)
+        return origin, vt[2]
+
+    @staticmethod
+    def distances(points, model):
+        origin, normal = model
+        return np.abs(np.dot(points - origin, normal))
+
+    @staticmethod
+    def accepts(model):
+        return True
+
+
+class _PerpendicularPlaneModel(_PlaneModel):
+    '''
+    A plane model that only accepts normals within angleEpsilon radians of
+    the axis, in either direction.
+    '''
+
+    def __init__(self, axis, angleEpsilon):
+        self.axis = np.asarray(axis, dtype=np.float64) / np.linalg.norm(axis)
+        self.minAxisDot = np.cos(angleEpsilon)
+
+    def fromSamples(self, p0, p1, p2):
+        (origins, normals), valid = _PlaneModel.fromSamples(p0, p1, p2)
+        valid &= np.abs(np.dot(normals, self.axis)) >= self.minAxisDot
+        return (origins, normals), valid
+
+    def accepts(self, model):
+        return abs(np.dot(model[1], self.axis)) >= self.minAxisDot
+
+
+class _LineModel(object):
+
+    sampleSize = 2
+
+    @staticmethod
+    def fromSamples(p0, p1):
+        directions = p1 - p0
+        norms = np.sqrt(np.sum(directions**2, axis=1))
+        valid = norms > 1e-9
+        directions[valid] /= norms[valid][:,np.newaxis]
+        return (p0, directions), valid
+
+    @staticmethod
+    def scoreDistances(points, hypotheses):
+        '''
+        Returns the MxH matrix of point to line distances, using
+        |v x d|^2 = |v|^2 - (v.d)^2 with v = p - o, so the whole matrix is
+        computed with matrix products.
+        '''
+        origins, directions = hypotheses
+        pointsDotOrigins = np.dot(points, origins.T)
+        pointsDotDirections = np.dot(points, directions.T)
+        squaredNorms = np.sum(points**2, axis=1)[:,np.newaxis]
+        originsSquaredNorms = np.sum(origins**2, axis=1)
+        originsDotDirections = np.sum(origins*directions, axis=1)
+        squaredDistances = (squaredNorms - 2*pointsDotOrigins + originsSquaredNorms
+                             - (pointsDotDirections - originsDotDirections)**2)
+        return np.sqrt(np.maximum(squaredDistances, 0.0))
+
+    @staticmethod
+    def refine(points):
+        origin = points.mean(axis=0)
+        _, _, vt = np.linalg.svd(points - origin, full_matrices=False)
+        return origin, vt[0]
+
+    @staticmethod
+    def distances(points, model):
+        origin, direction = model
+        v = points - origin
+        return np.sqrt(np.maximum(np.sum(v**2, axis=1) - np.dot(v, direction)**2, 0.0))
+
+    @staticmethod
+    def accepts(model):
+        return True
+
+
+def getRequiredHypotheses(inlierRatio, sampleSize, confidence):
+    '''
+    Returns the number of random samples needed to draw at least one sample
+    of only inliers with the given confidence, when inlierRatio of the
+    points are inliers.
+    '''
+    allInliersProbability = inlierRatio**sampleSize
+    if allInliersProbability >= 1.0:
+        return 1
+    if allInliersProbability <= 0.0:
+        return np.inf
+    return int(np.ceil(np.log(1.0 - confidence) / np.log(1.0 - allInliersProbability)))
+
+
+def fitModels(points, model, maxModels, distanceThreshold, minInliers, numberOfHypotheses=256,
+              maxScoringPoints=20000, seed=None, numberOfWorkers=4, confidence=0.99, hypothesesPerBatch=64):
+    '''
+    Sequential multi-model RANSAC over an Nx3 point array.  For each model,
+    candidates are sampled from the remaining points in batches of
+    hypothesesPerBatch and scored against a random subset of at most
+    maxScoringPoints of them.  Sampling stops once enough candidates were
+    drawn to find the best model with the given confidence, estimated from
+    the inlier ratio of the best candidate so far, or after
+    numberOfHypotheses candidates.  The scoring is done with matrix products
+    split across numberOfWorkers threads; numpy releases the GIL for these,
+    so they run on several cores.  The best candidate is refit to all of
+    its inliers by least squares.  All random samples are drawn from a
+    RandomState seeded with seed, so results are reproducible for a given
+    seed.
+
+    Returns a list of (model, inlierMask) pairs.
+    '''
+    from multiprocessing.pool import ThreadPool
+
+    rng = np.random.RandomState(seed)
+    points = np.asarray(points, dtype=np.float64)
+    remaining = np.isfinite(points).all(axis=1)
+    pool = ThreadPool(numberOfWorkers) if numberOfWorkers > 1 else None
+
+    results = []
+    try:
+        while len(results) < maxModels:
+
+            remainingIds = np.flatnonzero(remaining)
+            if len(remainingIds) < max(minInliers, model.sampleSize):
+                break
+
+            if len(remainingIds) > maxScoringPoints:
+                scoringIds = remainingIds[rng.permutation(len(remainingIds))[:maxScoringPoints]]
+            else:
+                scoringIds = remainingIds
+            scoringPoints = points[scoringIds]
+
+            def scoreChunk(args):
+                hypotheses, chunk = args
+                chunkHypotheses = tuple(h[chunk] for h in hypotheses)
+                return np.sum(model.scoreDistances(scoringPoints, chunkHypotheses) <= distanceThreshold, axis=0)
+
+            bestModel = None
+            bestScore = -1
+            numberOfSamples = 0
+            requiredHypotheses = numberOfHypotheses
+            while numberOfSamples < min(numberOfHypotheses, requiredHypotheses):
+
+                batchSize = min(hypothesesPerBatch, numberOfHypotheses - numberOfSamples)
+                numberOfSamples += batchSize
+                sampleIds = rng.randint(0, len(remainingIds), size=(batchSize, model.sampleSize))
+                samples = [points[remainingIds[sampleIds[:,i]]] for i in xrange(model.sampleSize)]
+                hypotheses, valid = model.fromSamples(*samples)
+                if not valid.any():
+                    continue
+                hypotheses = tuple(h[valid] for h in hypotheses)
+
+                chunks = np.array_split(np.arange(len(hypotheses[0])), numberOfWorkers if pool else 1)
+                chunks = [(hypotheses, chunk) for chunk in chunks if len(chunk)]
+                scores = np.concatenate(pool.map(scoreChunk, chunks) if pool else [scoreChunk(c) for c in chunks])
+
+                best = scores.argmax()
+                if scores[best] > bestScore:
+                    bestScore = scores[best]
+                    bestModel = tuple(h[best] for h in hypotheses)
+                    requiredHypotheses = getRequiredHypotheses(float(bestScore) / len(scoringIds), model.sampleSize, confidence)
+
+            if bestModel is None:
+                break
+
+            inliers = remainingIds[model.distances(points[remainingIds], bestModel) <= distanceThreshold]
+            if len(inliers) < max(minInliers, model.sampleSize):
+                break
+
+            refinedModel = model.refine(points[inliers])
+            refinedInliers = remainingIds[model.distances(points[remainingIds], refinedModel) <= distanceThreshold]
+            if len(refinedInliers) >= len(inliers) and model.accepts(refinedModel):
+                bestModel, inliers = refinedModel, refinedInliers
+
+            inlierMask = np.zeros(len(points), dtype=bool)
+            inlierMask[inliers] = True
+            remaining[inliers] = False
+            results.append((bestModel, inlierMask))
+    finally:
+        if pool is not None:
+            pool.close()
+
+    return results
+
+
 def projectPointToPlane(point, origin, normal):
     projectedPoint = np.zeros(3)
     vtk.vtkPlane.ProjectPoint(point, origin, normal, projectedPoint)
@@ -222,8 +462,387 @@ def labelPointDistanceAlongAxis(polyData, axis, origin=None, resultArrayName='di
     return newData
 
 
+class SpatialIndex(object):
+    '''
+    A voxel hash over the points of a polyData.  Points are binned into
+    cubic cells of size cellSize and sorted by cell key, so a radius or box
+    query only visits the cells that overlap the query region.  Building the
+    index is a single sort; use getSpatialIndex() to share one index between
+    all the shallow copies of a point cloud.
+    '''
+
+    def __init__(self, polyData, cellSize=0.1):
+        self.points = polyData.GetPoints()
+        self.pointsMTime = self.points.GetMTime() if self.points is not None else 0
+        self.cellSize = float(cellSize)
+
+        pts = vtkNumpy.getNumpyFromVtk(polyData, 'Points') if self.points is not None else np.zeros((0, 3))
+        finiteIds = np.flatnonzero(np.isfinite(pts).all(axis=1))
+        self.xyz = np.asarray(pts, dtype=np.float64)
+
+        if len(finiteIds):
+            self.minCell = np.floor(self.xyz[finiteIds].min(axis=0) / self.cellSize).astype(np.int64)
+            maxCell = np.floor(self.xyz[finiteIds].max(axis=0) / self.cellSize).astype(np.int64)
+        else:
+            self.minCell = np.zeros(3, dtype=np.int64)
+            maxCell = np.zeros(3, dtype=np.int64)
+        self.gridShape = maxCell - self.minCell + 1
+
+        keys = self._getCellKeys(self._getCells(self.xyz[finiteIds]))
+        order = np.argsort(keys, kind='mergesort')
+        self.sortedKeys = keys[order]
+        self.sortedIds = finiteIds[order]
+
+    def isValidFor(self, polyData):
+        points = polyData.GetPoints()
+        return points is self.points and (points is None or points.GetMTime() == self.pointsMTime)
+
+    def _getCells(self, pts):
+        return np.floor(pts / self.cellSize).astype(np.int64) - self.minCell
+
+    def _getCellKeys(self, cells):
+        return (cells[:,0]*self.gridShape[1] + cells[:,1])*self.gridShape[2] + cells[:,2]
+
+    def findPointsInBox(self, minPoint, maxPoint):
+        '''
+        Returns the sorted ids of the points inside the axis aligned box.
+        '''
+        minPoint = np.asarray(minPoint, dtype=np.float64)
+        maxPoint = np.asarray(maxPoint, dtype=np.float64)
+        lo = np.maximum(self._getCells(minPoint[np.newaxis,:])[0], 0)
+        hi = np.minimum(self._getCells(maxPoint[np.newaxis,:])[0], self.gridShape - 1)
+        if not len(self.sortedIds) or (lo > hi).any():
+            return np.zeros(0, dtype=np.int64)
+
+        # cells are sorted x, y, z major, so each (x, y) column of cells is
+        # one contiguous run of sorted keys
+        xs, ys = np.mgrid[lo[0]:hi[0]+1, lo[1]:hi[1]+1]
+        columns = np.column_stack((xs.ravel(), ys.ravel()))
+        loKeys = self._getCellKeys(np.column_stack((columns, np.repeat(lo[2], len(columns)))))
+        hiKeys = self._getCellKeys(np.column_stack((columns, np.repeat(hi[2], len(columns)))))
+        starts = np.searchsorted(self.sortedKeys, loKeys, side='left')
+        ends = np.searchsorted(self.sortedKeys, hiKeys, side='right')
+
+        candidates = [self.sortedIds[start:end] for start, end in zip(starts, ends) if end > start]
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+        candidates = np.concatenate(candidates)
+
+        pts = self.xyz[candidates]
+        inside = np.logical_and(pts >= minPoint, pts <= maxPoint).all(axis=1)
+        return np.sort(candidates[inside])
+
+    def findPointsWithinRadius(self, origin, radius):
+        '''
+        Returns the sorted ids of the points within radius of origin and
+        their distances to origin.
+        '''
+        origin = np.asarray(origin, dtype=np.float64)
+        ids = self.findPointsInBox(origin - radius, origin + radius)
+        dists = np.sqrt(np.sum((self.xyz[ids] - origin)**2, axis=1))
+        inside = dists <= radius
+        return ids[inside], dists[inside]
+
+    def findClosestPoint(self, point, maxRadius=None):
+        '''
+        Returns the id of the point closest to the given point, or None.  The
+        search grows outward from the query cell; if maxRadius is given, no
+        point farther than maxRadius is returned.
+        '''
+        if not len(self.sortedIds):
+            return None
+
+        point = np.asarray(point, dtype=np.float64)
+        radius = self.cellSize
+        maxExtent = self.cellSize*np.linalg.norm(self.gridShape + 1) + np.linalg.norm(point - self.minCell*self.cellSize)
+        while True:
+            if maxRadius is not None:
+                radius = min(radius, maxRadius)
+            ids, dists = self.findPointsWithinRadius(point, radius)
+            if len(ids):
+                return ids[np.argmin(dists)]
+            if (maxRadius is not None and radius >= maxRadius) or radius > maxExtent:
+                return None
+            radius *= 2.0
+
+    def _iterNeighborPairs(self, queryPoints, radius, chunkSize=20000):
+        '''
+        Yields (queryIds, pointIds, offsets) for every pair of a query point
+        and an indexed point within radius of it, where offsets is the
+        indexed point minus the query point.  Pairs are generated one block
+        of query points and one neighboring cell offset at a time, so memory
+        stays bounded by the density of the cloud rather than its size.
+        '''
+        queryPoints = np.asarray(queryPoints, dtype=np.float64)
+        queryIds = np.flatnonzero(np.isfinite(queryPoints).all(axis=1))
+        if not len(queryIds) or not len(self.sortedIds):
+            return
+
+        rings = int(np.ceil(radius / self.cellSize))
+        cellOffsets = np.array([(x, y, z) for x in xrange(-rings, rings+1)
+                                           for y in xrange(-rings, rings+1)
+                                           for z in xrange(-rings, rings+1)], dtype=np.int64)
+        radius2 = radius*radius
+
+        for chunkStart in xrange(0, len(queryIds), chunkSize):
+            chunkIds = queryIds[chunkStart:chunkStart+chunkSize]
+            chunkPoints = queryPoints[chunkIds]
+            chunkCells = self._getCells(chunkPoints)
+
+            for cellOffset in cellOffsets:
+                cells = chunkCells + cellOffset
+                valid = np.logical_and(cells >= 0, cells < self.gridShape).all(axis=1)
+                validIds = np.flatnonzero(valid)
+                if not len(validIds):
+                    continue
+
+                keys = self._getCellKeys(cells[validIds])
+                starts = np.searchsorted(self.sortedKeys, keys, side='left')
+                counts = np.searchsorted(self.sortedKeys, keys, side='right') - starts
+                total = counts.sum()
+                if not total:
+                    continue
+
+                # expand each query into the run of sorted ids of its cell
+                pairQuery = np.repeat(validIds, counts)
+                runStarts = np.cumsum(counts) - counts
+                positions = np.arange(total) - np.repeat(runStarts - starts, counts)
+                pointIds = self.sortedIds[positions]
+
+                offsets = self.xyz[pointIds] - chunkPoints[pairQuery]
+                inside = np.sum(offsets**2, axis=1) <= radius2
+                yield chunkIds[pairQuery[inside]], pointIds[inside], offsets[inside]
+
+    def countPointsWithinRadius(self, queryPoints, radius):
+        '''
+        Returns for each query point the number of indexed points within
+        radius of it.  A query point that is also indexed counts itself.
+        '''
+        counts = np.zeros(len(queryPoints), dtype=np.int64)
+        for queryIds, _, _ in self._iterNeighborPairs(queryPoints, radius):
+            counts += np.bincount(queryIds, minlength=len(counts))
+        return counts
+
+    def estimateNormals(self, queryPoints, radius, viewPoint=(0.0, 0.0, 0.0)):
+        '''
+        Returns the surface normal at each query point, computed as the
+        direction of least variance of the indexed points within radius.
+        Normals are flipped to face viewPoint.  Query points with fewer than
+        three neighbors get a nan normal.
+        '''
+        numberOfQueries = len(queryPoints)
+        counts = np.zeros(numberOfQueries)
+        sums = np.zeros((numberOfQueries, 3))
+        products = np.zeros((numberOfQueries, 3, 3))
+
+        for queryIds, _, offsets in self._iterNeighborPairs(queryPoints, radius):
+            counts += np.bincount(queryIds, minlength=numberOfQueries)
+            for i in xrange(3):
+                sums[:,i] += np.bincount(queryIds, offsets[:,i], minlength=numberOfQueries)
+                for j in xrange(i, 3):
+                    products[:,i,j] += np.bincount(queryIds, offsets[:,i]*offsets[:,j], minlength=numberOfQueries)
+
+        normals = np.empty((numberOfQueries, 3))
+        normals[:] = np.nan
+        valid = np.flatnonzero(counts >= 3)
+        if not len(valid):
+            return normals
+
+        n = counts[valid]
+        means = sums[valid] / n[:,np.newaxis]
+        covariances = products[valid] / n[:,np.newaxis,np.newaxis] - means[:,:,np.newaxis]*means[:,np.newaxis,:]
+        for i in xrange(3):
+            for j in xrange(i):
+                covariances[:,i,j] = covariances[:,j,i]
+
+        _, eigenvectors = np.linalg.eigh(covariances)
+        validNormals = eigenvectors[:,:,0]
+
+        toView = np.asarray(viewPoint, dtype=np.float64) - np.asarray(queryPoints, dtype=np.float64)[valid]
+        validNormals[np.sum(validNormals*toView, axis=1) < 0] *= -1
+        normals[valid] = validNormals
+        return normals
+
+
+_spatialIndexCache = []
+_spatialIndexCacheSize = 8
+_spatialIndexMinCachedPoints = 20000
+
+def getSpatialIndex(polyData, cellSize=0.1):
+    '''
+    Returns a SpatialIndex for the points of polyData, reusing a cached index
+    if one was built for the same vtkPoints object with the same cell size.
+    The segmentation filters pass around shallow copies that share their
+    vtkPoints, so one index serves every routine that works on the same
+    cloud.  An index is rebuilt when the points are modified, and only the
+    few most recently used indexes are kept, so indexes of old revolutions
+    are dropped as new data arrives.  The crops, the outlier labeling and
+    the normal estimation each ask for a cell size that suits their search
+    radius, so one cloud may have a few indexes.  Small clouds, such as the output of
+    a crop, are indexed without being cached so they do not evict the
+    index of the full cloud.
+    '''
+    if polyData.GetNumberOfPoints() < _spatialIndexMinCachedPoints:
+        return SpatialIndex(polyData, cellSize)
+
+    for i, index in enumerate(_spatialIndexCache):
+        if index.cellSize == cellSize and index.isValidFor(polyData):
+            del _spatialIndexCache[i]
+            _spatialIndexCache.insert(0, index)
+            return index
+
+    index = SpatialIndex(polyData, cellSize)
+    _spatialIndexCache.insert(0, index)
+    del _spatialIndexCache[_spatialIndexCacheSize:]
+    return index
+
+
+def clearSpatialIndexCache():
+    del _spatialIndexCache[:]
+
+
+class SegmentationPipelineCache(object):
+    '''
+    Memoizes the results of segmentation stages.  A result is keyed by the
+    stage name, the stage arguments and, for point cloud arguments, the
+    identity and modification time of the cloud's vtkPoints and point data
+    arrays.  The segmentation helpers pass around shallow copies that share
+    these, so a stage run again on the same revolution returns the cached
+    result even though each routine works on its own copy.  Cached polyData
+    results are returned as shallow copies, so callers may add arrays to
+    them.  Results are evicted in least recently used order when there are
+    more than maxEntries, or when their estimated size exceeds maxMemory
+    bytes.  The size of an entry includes the input points and arrays it
+    keeps alive, since they are pinned by the entry as well.
+
+    Inputs are compared by modification time, not by content.  Code that
+    changes the points or arrays of a cloud in place, such as through a
+    numpy view, must call Modified() on the changed vtk object, otherwise
+    stages run on that cloud return stale results.  Stage functions must
+    not have side effects such as displaying debug objects, because they
+    are skipped on a cache hit; return the data to display to an uncached
+    wrapper instead.
+    '''
+
+    def __init__(self, maxEntries=32, maxMemory=512*1024*1024):
+        self.maxEntries = maxEntries
+        self.maxMemory = maxMemory
+        self.enabled = True
+        self.entries = OrderedDict()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+
+    def compute(self, stageName, func, *args, **kwargs):
+        '''
+        Returns func(*args, **kwargs), computing it only if no result is
+        cached for the stage with the same inputs.
+        '''
+        if not self.enabled:
+            return func(*args, **kwargs)
+
+        references = []
+        try:
+            key = (stageName, self._makeKey(args, references), self._makeKey(kwargs, references))
+            hash(key)
+        except TypeError:
+            return func(*args, **kwargs)
+
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.entries[key] = entry
+            self.hits += 1
+            return self._copyResult(entry[0])
+
+        self.misses += 1
+        result = func(*args, **kwargs)
+
+        # the key holds object ids, so the referenced objects are kept alive
+        # with the entry to prevent their ids from being reused, and they
+        # count against the memory limit like the result does
+        size = self._getResultSize(result) + self._getReferencesSize(references)
+        self.entries[key] = (result, size, references)
+        self.memory += size
+        self._evict()
+        return self._copyResult(result)
+
+    def clear(self):
+        self.entries.clear()
+        self.memory = 0
+
+    def _evict(self):
+        while len(self.entries) > self.maxEntries or (self.memory > self.maxMemory and len(self.entries) > 1):
+            key, entry = self.entries.popitem(last=False)
+            self.memory -= entry[1]
+
+    def _makeKey(self, value, references):
+        if isinstance(value, vtk.vtkDataSet):
+            return self._makeDataSetKey(value, references)
+        elif isinstance(value, vtk.vtkObject):
+            references.append(value)
+            return ('vtkObject', id(value), value.GetMTime())
+        elif isinstance(value, np.ndarray):
+            return ('ndarray', value.dtype.str, value.shape, value.tostring())
+        elif isinstance(value, (list, tuple)):
+            return tuple(self._makeKey(x, references) for x in value)
+        elif isinstance(value, dict):
+            return tuple(sorted((k, self._makeKey(v, references)) for k, v in value.iteritems()))
+        else:
+            return value
+
+    def _makeDataSetKey(self, dataSet, references):
+        points = dataSet.GetPoints() if isinstance(dataSet, vtk.vtkPointSet) else None
+        if points is not None:
+            references.append(points)
+            pointsKey = (id(points), points.GetMTime())
+        else:
+            pointsKey = None
+
+        pointData = dataSet.GetPointData()
+        arraysKey = []
+        for i in xrange(pointData.GetNumberOfArrays()):
+            array = pointData.GetAbstractArray(i)
+            references.append(array)
+            arraysKey.append((array.GetName(), id(array), array.GetMTime()))
+
+        return ('vtkDataSet', dataSet.GetClassName(), dataSet.GetNumberOfPoints(), pointsKey, tuple(arraysKey))
+
+    def _copyResult(self, result):
+        if isinstance(result, vtk.vtkPolyData):
+            return shallowCopy(result)
+        elif isinstance(result, (list, tuple)):
+            return type(result)(self._copyResult(x) for x in result)
+        else:
+            return result
+
+    def _getReferencesSize(self, references):
+        uniqueReferences = dict((id(x), x) for x in references)
+        return sum(x.GetActualMemorySize()*1024 for x in uniqueReferences.itervalues()
+                   if isinstance(x, (vtk.vtkDataObject, vtk.vtkAbstractArray, vtk.vtkPoints)))
+
+    def _getResultSize(self, result):
+        if isinstance(result, vtk.vtkDataObject):
+            return result.GetActualMemorySize()*1024
+        elif isinstance(result, np.ndarray):
+            return result.nbytes
+        elif isinstance(result, (list, tuple)):
+            return sum(self._getResultSize(x) for x in result)
+        else:
+            return 0
+
+
+_pipelineCache = SegmentationPipelineCache()
+
+def getSegmentationPipelineCache():
+    return _pipelineCache
+
+
 def applyEuclideanClustering(dataObj, clusterTolerance=0.05, minClusterSize=100, maxClusterSize=1e6):
 
+    # clustering stays with the pcl filter: labeling connected components
+    # over the spatial index would need the whole neighbor graph in memory
+    # at once, where the pcl filter grows each cluster from its own kd-tree
+
     f = vtk.vtkPCLEuclideanClusterExtraction()
     f.SetInput(dataObj)
     f.SetClusterTolerance(clusterTolerance)
@@ -265,6 +884,10 @@ def extractClusters(polyData, clusterInXY=False, **kwargs):
 
 
 def applyVoxelGrid(polyData, leafSize=0.01):
+    return getSegmentationPipelineCache().compute('applyVoxelGrid', _applyVoxelGrid, polyData, leafSize)
+
+
+def _applyVoxelGrid(polyData, leafSize):
 
     v = vtk.vtkPCLVoxelGrid()
     v.SetLeafSize(leafSize, leafSize, leafSize)
@@ -274,13 +897,19 @@ def applyVoxelGrid(polyData, leafSize=0.01):
 
 
 def labelOutliers(dataObj, searchRadius=0.03, neighborsInSearchRadius=10):
-
-    f = vtk.vtkPCLRadiusOutlierRemoval()
-    f.SetInput(dataObj)
-    f.SetSearchRadius(searchRadius)
-    f.SetNeighborsInSearchRadius(int(neighborsInSearchRadius))
-    f.Update()
-    return shallowCopy(f.GetOutput())
+    '''
+    Adds an is_outlier array that is 1 for the points with fewer than
+    neighborsInSearchRadius other points within searchRadius.  The
+    neighbors are counted with the shared spatial index of the cloud.
+    '''
+    points = vtkNumpy.getNumpyFromVtk(dataObj, 'Points')
+    counts = getSpatialIndex(dataObj, searchRadius).countPointsWithinRadius(points, searchRadius)
+
+    # counts include the point itself
+    isOutlier = np.array(counts <= neighborsInSearchRadius, dtype=np.int32)
+    dataObj = shallowCopy(dataObj)
+    vtkNumpy.addNumpyToVtk(dataObj, isOutlier, 'is_outlier')
+    return dataObj
 
 
 def sparsifyStereoCloud(polyData):
@@ -0,0 +1,433 @@
+'''
+Runs segmentation fits in a worker process so that the Qt main thread, and
+with it the render loop and the robot state updates, stays live while the
+VTK and PCL filters run.
+
+A fit is split into a compute function, which only uses the point cloud
+filters and returns its results, and a result callback, which adds the
+fitted affordance to the object model.  The compute function runs in a
+forked worker process and its results are sent back to the main thread,
+where the result callback is called.
+
+Compute functions may show intermediate results with the display functions
+of ddapp.visualization, as the segmentation routines do for their debug
+output.  In the worker these calls are forwarded to the main thread, which
+makes the call on its own object model.  The worker never touches the Qt
+object model itself: the debug folder is sent as a reference that the main
+thread resolves, and om.batchUpdates does nothing in the worker.
+'''
+
+import sys
+import contextlib
+import traceback
+import multiprocessing
+import Queue
+
+import numpy as np
+from PythonQt import QtCore, QtGui
+from ddapp import callbacks
+from ddapp import objectmodel as om
+from ddapp import vtkAll as vtk
+from ddapp import vtkNumpy
+from ddapp.timercallback import TimerCallback
+
+
+# When False, tasks run synchronously on the main thread, which is useful
+# when debugging a compute function.
+useWorkerProcess = True
+
+_progressQueue = None
+
+
+def reportProgress(fraction, message=''):
+    '''
+    Reports the progress of the running fit as a fraction between 0 and 1.
+    Compute functions may call this at any time; it does nothing when the
+    function is not running in a worker process.
+    '''
+    if _progressQueue is not None:
+        _progressQueue.put(('progress', fraction, message))
+
+
+class _PolyDataMessage(object):
+    '''
+    A picklable copy of a vtkPolyData: points, cells and point data arrays.
+    '''
+
+    cellTypes = ('Verts', 'Lines', 'Polys', 'Strips')
+
+    def __init__(self, polyData):
+        self.points = vtkNumpy.getNumpyFromVtk(polyData, 'Points').copy() if polyData.GetPoints() else None
+
+        self.cells = {}
+        for cellType in self.cellTypes:
+            cellArray = getattr(polyData, 'Get' + cellType)()
+            if cellArray.GetNumberOfCells():
+                self.cells[cellType] = (cellArray.GetNumberOfCells(), vtkNumpy.numpy_support.vtk_to_numpy(cellArray.GetData()).copy())
+
+        self.arrays = []
+        pointData = polyData.GetPointData()
+        for i in xrange(pointData.GetNumberOfArrays()):
+            array = pointData.GetArray(i)
+            if array is not None and array.GetName():
+                self.arrays.append((array.GetName(), vtkNumpy.numpy_support.vtk_to_numpy(array).copy()))
+
+        normals = pointData.GetNormals()
+        self.normalsName = normals.GetName() if normals is not None else None
+
+    def toPolyData(self):
+        polyData = vtk.vtkPolyData()
+        if self.points is not None:
+            polyData.SetPoints(vtkNumpy.getVtkPointsFromNumpy(self.points))
+
+        for cellType, (numberOfCells, cellData) in self.cells.iteritems():
+            cellArray = vtk.vtkCellArray()
+            cellArray.SetCells(numberOfCells, vtkNumpy.numpy_support.numpy_to_vtkIdTypeArray(cellData, deep=True))
+            getattr(polyData, 'Set' + cellType)(cellArray)
+
+        for name, values in self.arrays:
+            vtkNumpy.addNumpyToVtk(polyData, values, name)
+
+        if self.normalsName:
+            polyData.GetPointData().SetNormals(polyData.GetPointData().GetArray(self.normalsName))
+
+        return polyData
+
+
+class _TransformMessage(object):
+
+    def __init__(self, transform):
+        matrix = transform.GetMatrix()
+        self.matrix = [[matrix.GetElement(r, c) for c in xrange(4)] for r in xrange(4)]
+
+    def toTransform(self):
+        matrix = vtk.vtkMatrix4x4()
+        for r in xrange(4):
+            for c in xrange(4):
+                matrix.SetElement(r, c, self.matrix[r][c])
+        t = vtk.vtkTransform()
+        t.SetMatrix(matrix)
+        return t
+
+
+class _ObjectMessage(object):
+    '''
+    A reference to an object model item by the names of the item and its
+    parents, such as the parent folder of a displayed result.
+    '''
+
+    def __init__(self, obj):
+        self.path = []
+        while obj is not None:
+            self.path.insert(0, obj.getProperty('Name'))
+            obj = obj.parent()
+
+    def toObject(self):
+        obj = None
+        for name in self.path:
+            obj = om.getOrCreateContainer(name, obj)
+        return obj
+
+
+class _DebugFolderMessage(_ObjectMessage):
+    '''
+    A reference to the segmentation debug folder, which is found or created
+    on the main thread by segmentationroutines.getDebugFolder.
+    '''
+
+    def __init__(self):
+        self.path = ['segmentation', 'debug']
+
+    def toObject(self):
+        from ddapp import segmentationroutines
+        return segmentationroutines.getDebugFolder()
+
+
+def encodeResult(value):
+    '''
+    Converts the vtkPolyData and vtkTransform objects in a result, which may
+    be nested in lists, tuples and dicts, to picklable messages.  Object
+    model items are sent as references by name.
+    '''
+    if isinstance(value, vtk.vtkPolyData):
+        return _PolyDataMessage(value)
+    elif isinstance(value, vtk.vtkTransform):
+        return _TransformMessage(value)
+    elif isinstance(value, om.ObjectModelItem):
+        return _ObjectMessage(value)
+    elif isinstance(value, (list, tuple)):
+        return type(value)(encodeResult(x) for x in value)
+    elif isinstance(value, dict):
+        return dict((k, encodeResult(v)) for k, v in value.iteritems())
+    else:
+        return value
+
+
+def decodeResult(value):
+    if isinstance(value, _PolyDataMessage):
+        return value.toPolyData()
+    elif isinstance(value, _TransformMessage):
+        return value.toTransform()
+    elif isinstance(value, _ObjectMessage):
+        return value.toObject()
+    elif isinstance(value, (list, tuple)):
+        return type(value)(decodeResult(x) for x in value)
+    elif isinstance(value, dict):
+        return dict((k, decodeResult(v)) for k, v in value.iteritems())
+    else:
+        return value
+
+
+_displayFunctionNames = ('showPolyData', 'updatePolyData', 'showFrame', 'updateFrame')
+
+
+def _replaceFunction(name, func, replacement):
+    '''
+    Replaces func, and the copies of it bound by from-imports in other
+    modules, with replacement.
+    '''
+    for module in sys.modules.values():
+        if module is not None and getattr(module, name, None) is func:
+            setattr(module, name, replacement)
+
+
+@contextlib.contextmanager
+def _noBatchUpdates():
+    yield
+
+
+def _forwardDisplayFunctions(queue):
+    '''
+    Replaces the visualization display functions in the worker process with
+    functions that send the call to the main thread, and the object model
+    functions that the segmentation routines use with ones that do not touch
+    Qt.  This only changes the forked worker, never the Director process.
+    '''
+    from ddapp import visualization as vis
+    from ddapp import segmentationroutines
+
+    def makeForwarder(name):
+        def forwardDisplayCall(*args, **kwargs):
+            queue.put(('display', name, encodeResult(args), encodeResult(kwargs)))
+        return forwardDisplayCall
+
+    for name in _displayFunctionNames:
+        _replaceFunction(name, getattr(vis, name), makeForwarder(name))
+
+    _replaceFunction('getDebugFolder', segmentationroutines.getDebugFolder, _DebugFolderMessage)
+    _replaceFunction('batchUpdates', om.batchUpdates, _noBatchUpdates)
+
+
+def _callDisplayFunction(name, args, kwargs):
+    from ddapp import visualization as vis
+    getattr(vis, name)(*decodeResult(args), **decodeResult(kwargs))
+
+
+def _runWorker(func, args, kwargs, queue):
+    global _progressQueue
+    _progressQueue = queue
+    _forwardDisplayFunctions(queue)
+    try:
+        result = func(*args, **kwargs)
+        queue.put(('result', encodeResult(result)))
+    except Exception:
+        queue.put(('error', traceback.format_exc()))
+
+
+class SegmentationTask(object):
+    '''
+    Runs func(*args, **kwargs) in a worker process and calls onResult with
+    its result on the main thread.  The worker is forked from the Director
+    process, so func and its arguments are not pickled and may be any
+    function and any VTK objects.  The result may contain vtkPolyData,
+    vtkTransform, numpy arrays and plain Python values.  The display
+    functions of ddapp.visualization return None in the worker, so func
+    must not use the objects they return.
+
+    While the task runs, a progress dialog with a cancel button is shown.
+    Cancelling terminates the worker and the result is discarded.
+    '''
+
+    TASK_FINISHED_SIGNAL = 'TASK_FINISHED_SIGNAL'
+    TASK_FAILED_SIGNAL = 'TASK_FAILED_SIGNAL'
+    TASK_CANCELED_SIGNAL = 'TASK_CANCELED_SIGNAL'
+    PROGRESS_SIGNAL = 'PROGRESS_SIGNAL'
+
+    # the number of timer ticks to wait for the last messages of a worker
+    # that has exited
+    maxExitedPolls = 10
+
+    def __init__(self, name, func, args=(), kwargs=None, onResult=None, showProgress=True):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.onResult = onResult
+        self.showProgress = showProgress
+        self.process = None
+        self.queue = None
+        self.progressDialog = None
+        self.exitedPolls = 0
+        self.timer = TimerCallback(targetFps=30)
+        self.timer.callback = self._poll
+        self.callbacks = callbacks.CallbackRegistry([self.TASK_FINISHED_SIGNAL,
+                                                     self.TASK_FAILED_SIGNAL,
+                                                     self.TASK_CANCELED_SIGNAL,
+                                                     self.PROGRESS_SIGNAL])
+
+    def connectTaskFinished(self, func):
+        return self.callbacks.connect(self.TASK_FINISHED_SIGNAL, func)
+
+    def connectTaskFailed(self, func):
+        return self.callbacks.connect(self.TASK_FAILED_SIGNAL, func)
+
+    def connectTaskCanceled(self, func):
+        return self.callbacks.connect(self.TASK_CANCELED_SIGNAL, func)
+
+    def connectProgress(self, func):
+        return self.callbacks.connect(self.PROGRESS_SIGNAL, func)
+
+    def isRunning(self):
+        return self.process is not None
+
+    def start(self):
+        assert not self.isRunning()
+
+        if not useWorkerProcess:
+            self._onFinished(self.func(*self.args, **self.kwargs))
+            return
+
+        # Python 2 multiprocessing can only fork.  The fork copies only the
+        # calling thread, so the Qt, render and LCM threads of Director do
+        # not run in the worker, and the worker must not use them: func only
+        # runs the VTK, PCL and numpy filters, display calls are forwarded
+        # back to this process, and the worker exits with os._exit so Qt
+        # and VTK destructors and atexit handlers never run in the child.
+        # A lock that another thread held at the time of the fork stays
+        # locked in the child, which is why func must not touch LCM or Qt.
+        self.queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_runWorker, args=(self.func, self.args, self.kwargs, self.queue))
+        self.process.daemon = True
+        self.process.start()
+        self.exitedPolls = 0
+
+        if self.showProgress:
+            self._showProgressDialog()
+        self.timer.start()
+
+    def cancel(self):
+        if not self.isRunning():
+            return
+        self.process.terminate()
+        self.timer.stop()
+        self._cleanup()
+        self.callbacks.process(self.TASK_CANCELED_SIGNAL, self)
+
+    def _showProgressDialog(self):
+        self.progressDialog = QtGui.QProgressDialog()
+        self.progressDialog.setWindowTitle('Segmentation')
+        self.progressDialog.setLabelText('Running %s...' % self.name)
+        self.progressDialog.setWindowModality(QtCore.Qt.NonModal)
+        self.progressDialog.setMinimumDuration(500)
+        # a busy indicator until the worker reports progress
+        self.progressDialog.setRange(0, 0)
+        self.progressDialog.connect('canceled()', self.cancel)
+
+    def _onProgress(self, fraction, message):
+        if self.progressDialog is not None:
+            self.progressDialog.setRange(0, 100)
+            self.progressDialog.setValue(int(round(100*fraction)))
+            if message:
+                self.progressDialog.setLabelText('%s: %s' % (self.name, message))
+        self.callbacks.process(self.PROGRESS_SIGNAL, self, fraction, message)
+
+    def _handleMessages(self):
+        '''
+        Handles the queued messages from the worker until the queue is empty.
+        '''
+        while self.isRunning():
+            try:
+                message = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+
+            if message[0] == 'progress':
+                self._onProgress(message[1], message[2])
+            elif message[0] == 'display':
+                try:
+                    _callDisplayFunction(*message[1:])
+                except Exception:
+                    print 'segmentation task %s failed to display a result:' % self.name
+                    traceback.print_exc()
+            elif message[0] == 'result':
+                self._cleanup()
+                self._onFinished(decodeResult(message[1]))
+            elif message[0] == 'error':
+                self._cleanup()
+                self._onFailed(message[1])
+
+    def _poll(self):
+        '''
+        The timer callback.  Returns False, which stops the timer, once the
+        task has finished.
+        '''
+        self._handleMessages()
+
+        if self.isRunning() and not self.process.is_alive():
+            # the worker may have queued its result and exited after the
+            # queue was found empty above, and the last messages may still
+            # be on their way through the queue's pipe, so the queue is
+            # polled for a few more ticks before the task is reported as
+            # failed
+            self.exitedPolls += 1
+            if self.exitedPolls > self.maxExitedPolls:
+                exitCode = self.process.exitcode
+                self._cleanup()
+                self._onFailed('worker process exited with code %s' % exitCode)
+
+        return self.isRunning()
+
+    def _cleanup(self):
+        if self.progressDialog is not None:
+            self.progressDialog.disconnect('canceled()', self.cancel)
+            self.progressDialog.close()
+            self.progressDialog = None
+        process = self.process
+        self.process = None
+        self.queue = None
+        if process is not None:
+            process.join(0.1)
+
+    def _onFinished(self, result):
+        if self.onResult is not None:
+            self.onResult(result)
+        self.callbacks.process(self.TASK_FINISHED_SIGNAL, self, result)
+
+    def _onFailed(self, errorMessage):
+        print 'segmentation task %s failed:' % self.name
+        print errorMessage
+        self.callbacks.process(self.TASK_FAILED_SIGNAL, self, errorMessage)
+
+
+_currentTask = None
+
+def startTask(name, func, args=(), kwargs=None, onResult=None, showProgress=True):
+    '''
+    Starts a SegmentationTask and returns it.  Only one fit runs at a time,
+    so a task that is still running is cancelled first.
+    '''
+    global _currentTask
+    if _currentTask is not None:
+        _currentTask.cancel()
+    _currentTask = SegmentationTask(name, func, args, kwargs, onResult, showProgress)
+    _currentTask.start()
+    return _currentTask
+
+
+def getCurrentTask():
+    return _currentTask
+
+
+def cancelCurrentTask():
+    if _currentTask is not None:
+        _currentTask.cancel()
@@ -918,16 +918,19 @@ class AffordanceTextureUpdater(object):
 
     def __init__(self, affordanceManager):
         self.affordanceManager = affordanceManager
-        self.timer = TimerCallback(targetFps=10)
+        self.timer = TimerCallback(targetFps=30)
         self.timer.callback = self.updateTextures
         self.timer.start()
 
     def updateTexture(self, obj):
-        if obj.getProperty('Camera Texture Enabled'):
-            cameraview.applyCameraTexture(obj, cameraview.imageManager)
+        if obj.getProperty('Camera Texture Enabled') and obj.getProperty('Visible'):
+            if cameraview.imageManager.hasImage('CAMERA_LEFT'):
+                cameraview.imageManager.updateImage('CAMERA_LEFT')
+            updated = cameraview.applyCameraTexture(obj, cameraview.imageManager)
         else:
-            cameraview.disableCameraTexture(obj)
-        obj._renderAllViews()
+            updated = cameraview.disableCameraTexture(obj)
+        if updated:
+            obj._renderAllViews()
 
     def updateTextures(self):
 
@@ -6,12 +6,14 @@ from ddapp.timercallback import TimerCallback
 from ddapp import transformUtils
 from ddapp import callbacks
 from ddapp import frameupdater
+from ddapp import vtkNumpy as vnp
 import numpy as np
 from PythonQt import QtCore, QtGui
 
 
 
 import os
+import time
 import weakref
 import itertools
 
@@ -39,6 +41,7 @@ class PolyDataItem(om.ObjectModelItem):
         self.mapper.SetInput(self.polyData)
         self.actor = vtk.vtkActor()
         self.actor.SetMapper(self.mapper)
+        _registerPropObject(self.actor, self)
         self.shadowActor = None
         self.scalarBarWidget = None
         self.extraViewRenderers = {}
@@ -438,6 +441,7 @@ class FrameItem(PolyDataItem):
         self.widget.CreateDefaultRepresentation()
         self.widget.EnabledOff()
         self.rep = self.widget.GetRepresentation()
+        _registerPropObject(self.rep, self)
         self.rep.SetTransform(transform)
         self.traceData = None
         self._frameSync = None
@@ -533,6 +537,7 @@ class FrameItem(PolyDataItem):
             if trace and not self.traceData:
                 self.traceData = FrameTraceVisualizer(self)
             elif not trace and self.traceData:
+                self.traceData.stop()
                 om.removeFromObjectModel(self.traceData.getTraceData())
                 self.traceData = None
         elif propertyName == 'Tube':
@@ -551,48 +556,164 @@ class FrameItem(PolyDataItem):
 
 
 class FrameTraceVisualizer(object):
+    '''
+    Draws the path of a frame as a polyline child of the frame.
+
+    The trace positions are kept in a fixed capacity ring buffer, so a long
+    session does not grow the trace without bound: when the buffer is full
+    the oldest positions are dropped.  A position is only recorded when the
+    frame has moved at least minDistance since the last recorded position
+    and minInterval seconds have passed, which decimates traces of frames
+    that are updated at high rate.  If historyWindow is set, positions older
+    than historyWindow seconds are dropped as well.
+
+    The trace polyData is drawn as line segments.  A new position appends
+    a point and a segment to it, so the trace is only rebuilt from the ring
+    buffer when more than a tenth of the capacity has been dropped since the
+    last rebuild; until then the drawn trace keeps the dropped positions.
+    '''
 
-    def __init__(self, frame):
+    def __init__(self, frame, capacity=10000, minDistance=0.001, minInterval=0.0, historyWindow=None):
         self.frame = frame
         self.traceName = '%s trace' % frame.getProperty('Name')
-        self.lastPosition = np.array(frame.transform.GetPosition())
-        self.lineCell = vtk.vtkLine()
-        frame.connectFrameModified(self.onFrameModified)
+        self.capacity = capacity
+        self.minDistance = minDistance
+        self.minInterval = minInterval
+        self.historyWindow = historyWindow
+
+        self.points = np.zeros((capacity, 3))
+        self.times = np.zeros(capacity)
+        self.head = 0
+        self.count = 0
+        self.numberOfRecorded = 0
+
+        self.polyData = None
+        self.polyDataStart = 0
+        self.rebuildSlack = capacity // 10
+
+        self._record(np.array(frame.transform.GetPosition()), time.time())
+        self.callbackId = frame.connectFrameModified(self.onFrameModified)
 
     def getTraceData(self):
         t = self.frame.findChild(self.traceName)
         if not t:
-            pts = vtk.vtkPoints()
-            pts.SetDataTypeToDouble()
-            pts.InsertNextPoint(self.frame.transform.GetPosition())
             pd = vtk.vtkPolyData()
-            pd.SetPoints(pts)
-            pd.SetLines(vtk.vtkCellArray())
+            self._updatePolyData(pd)
             t = showPolyData(pd, self.traceName, parent=self.frame)
         return t
 
-    def addPoint(self, point):
-        traceData = self.getTraceData()
-        pd = traceData.polyData
-
-        pd.GetPoints().InsertNextPoint(point)
-        numberOfPoints = pd.GetNumberOfPoints()
-        line = self.lineCell
-        ids = line.GetPointIds()
-        ids.SetId(0, numberOfPoints-2)
-        ids.SetId(1, numberOfPoints-1)
-        pd.GetLines().InsertNextCell(line.GetPointIds())
+    def getPoints(self):
+        '''
+        Returns the recorded positions, oldest first, as an N x 3 array.
+        '''
+        return self.points[self._getOrderedIndices()]
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        self.polyData = None
+        self.addPoint(np.array(self.frame.transform.GetPosition()))
+
+    def stop(self):
+        '''
+        Stops tracing the frame.  The trace data is left in the object model.
+        '''
+        if self.callbackId is not None:
+            self.frame.disconnectFrameModified(self.callbackId)
+            self.callbackId = None
+
+    def _getOrderedIndices(self):
+        return np.arange(self.head - self.count, self.head) % self.capacity
+
+    def _getLastPoint(self):
+        return self.points[(self.head - 1) % self.capacity]
+
+    def _getLastTime(self):
+        return self.times[(self.head - 1) % self.capacity]
+
+    def _record(self, point, t):
+        self.points[self.head] = point
+        self.times[self.head] = t
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.numberOfRecorded += 1
+
+        if self.historyWindow is not None:
+            times = self.times[self._getOrderedIndices()]
+            self.count -= np.searchsorted(times, t - self.historyWindow)
+            self.count = max(self.count, 1)
+
+    def _updatePolyData(self, pd):
+        points = self.getPoints()
+        numberOfPoints = len(points)
+
+        # one line segment between each pair of consecutive points, built in
+        # bulk, so that later points can be appended as new segments
+        numberOfLines = max(numberOfPoints - 1, 0)
+        cells = np.empty((numberOfLines, 3), dtype=vnp.numpy_support.ID_TYPE_CODE)
+        cells[:,0] = 2
+        cells[:,1] = np.arange(numberOfLines)
+        cells[:,2] = cells[:,1] + 1
+        lines = vtk.vtkCellArray()
+        lines.SetCells(numberOfLines, vnp.numpy_support.numpy_to_vtkIdTypeArray(cells.ravel(), deep=True))
+
+        vtkPoints = vtk.vtkPoints()
+        vtkPoints.SetData(vnp.numpy_support.numpy_to_vtk(points, deep=True))
+        pd.SetPoints(vtkPoints)
+        pd.SetLines(lines)
+        pd.Modified()
 
+        self.polyData = pd
+        self.polyDataStart = self.numberOfRecorded - self.count
+
+    def _appendToPolyData(self, pd, point):
+        pointId = pd.GetPoints().InsertNextPoint(point)
+        if pointId > 0:
+            pd.GetLines().InsertNextCell(2)
+            pd.GetLines().InsertCellPoint(pointId - 1)
+            pd.GetLines().InsertCellPoint(pointId)
+        pd.GetPoints().Modified()
+        pd.GetLines().Modified()
         pd.Modified()
+
+    def addPoint(self, point):
+        self._record(point, time.time())
+
+        traceData = self.frame.findChild(self.traceName)
+        droppedPoints = self.numberOfRecorded - self.count - self.polyDataStart
+        if traceData and traceData.polyData is self.polyData and droppedPoints <= self.rebuildSlack:
+            self._appendToPolyData(traceData.polyData, point)
+        else:
+            traceData = self.getTraceData()
+            if traceData.polyData is not self.polyData or droppedPoints:
+                self._updatePolyData(traceData.polyData)
         traceData._renderAllViews()
 
     def onFrameModified(self, frame):
         position = np.array(frame.transform.GetPosition())
-        if not np.allclose(position, self.lastPosition):
-            self.addPoint(position)
+        if self.count:
+            if np.linalg.norm(position - self._getLastPoint()) < self.minDistance:
+                return
+            if time.time() - self._getLastTime() < self.minInterval:
+                return
+        self.addPoint(position)
 
 
 class FrameSync(object):
+    '''
+    Keeps a set of frames rigidly attached to each other.  When one frame
+    is modified, the others are moved so that the relative transforms
+    between the frames, recorded when they were added, are preserved.
+
+    Each frame stores a base transform as a 4x4 numpy matrix.  Moving frame
+    f in response to a change of the modified frame m sets
+
+        T_f = T_m * inv(B_m) * B_f
+
+    so a modification computes T_m * inv(B_m) once and applies it to all
+    dependent frames in a single pass.  Frames are looked up by identity, so
+    the cost of a drag event does not depend on how frames are found.
+    '''
 
     class FrameData(object):
         def __init__(self, **kwargs):
@@ -600,6 +721,7 @@ class FrameSync(object):
 
     def __init__(self):
         self.frames = {}
+        self._frameIds = {}
         self._blockCallbacks = False
         self._ids = itertools.count()
 
@@ -618,7 +740,9 @@ class FrameSync(object):
             ref=weakref.ref(frame),
             baseTransform=self._computeBaseTransform(frame),
             callbackId=callbackId,
-            ignoreIncoming=ignoreIncoming)
+            ignoreIncoming=ignoreIncoming,
+            key=id(frame))
+        self._frameIds[id(frame)] = frameId
 
     def removeFrame(self, frame):
 
@@ -630,49 +754,42 @@ class FrameSync(object):
         self._removeFrameId(frameId)
 
     def _computeBaseTransform(self, frame):
+        '''
+        Returns the base transform for a frame so that its current pose is
+        consistent with the frames that are already synced:
+        B_f = B_o * inv(T_o) * T_f for any other live frame o.
+        '''
+        frameTransform = transformUtils.getNumpyFromTransform(frame.transform)
 
-        currentDelta = None
         for frameId, frameData in self.frames.items():
-
-            if frameData.ref() is None:
+            otherFrame = frameData.ref()
+            if otherFrame is None:
                 self._removeFrameId(frameId)
-            elif frameData.ref() is frame:
-                continue
-            else:
-                currentDelta = transformUtils.copyFrame(frameData.baseTransform.GetLinearInverse())
-                currentDelta.Concatenate(transformUtils.copyFrame(frameData.ref().transform))
-                break
+            elif otherFrame is not frame:
+                otherTransform = transformUtils.getNumpyFromTransform(otherFrame.transform)
+                return np.dot(frameData.baseTransform, np.linalg.solve(otherTransform, frameTransform))
 
-        t = transformUtils.copyFrame(frame.transform)
-        t.PostMultiply()
-        if currentDelta:
-            t.Concatenate(currentDelta.GetLinearInverse())
-
-        return t
+        return frameTransform
 
     def _removeFrameId(self, frameId):
-        del self.frames[frameId]
+        frameData = self.frames.pop(frameId)
+        if self._frameIds.get(frameData.key) == frameId:
+            del self._frameIds[frameData.key]
 
     def _findFrameId(self, frame):
 
-        for frameId, frameData in self.frames.items():
-
-            if frameData.ref() is None:
-                self._removeFrameId(frameId)
-            elif frameData.ref() is frame:
-                return frameId
-
-    def _moveFrame(self, frameId, modifiedFrameId):
+        frameId = self._frameIds.get(id(frame))
+        if frameId is None:
+            return None
 
         frameData = self.frames[frameId]
-        modifiedFrameData = self.frames[modifiedFrameId]
+        if frameData.ref() is frame:
+            return frameId
 
-        t = vtk.vtkTransform()
-        t.PostMultiply()
-        t.Concatenate(frameData.baseTransform)
-        t.Concatenate(modifiedFrameData.baseTransform.GetLinearInverse())
-        t.Concatenate(modifiedFrameData.ref().transform)
-        frameData.ref().copyFrame(t)
+        # the id belonged to a frame that has been deleted
+        if frameData.ref() is None:
+            self._removeFrameId(frameId)
+        return None
 
     def _onFrameModified(self, frame):
 
@@ -682,23 +799,25 @@ class FrameSync(object):
         modifiedFrameId = self._findFrameId(frame)
         assert modifiedFrameId is not None
 
-        #print self, 'onFrameModified:', self.frames[modifiedFrameId].ref().getProperty('Name')
+        modifiedFrameData = self.frames[modifiedFrameId]
 
-        if self.frames[modifiedFrameId].ignoreIncoming:
-            self.frames[modifiedFrameId].baseTransform = self._computeBaseTransform(frame)
+        if modifiedFrameData.ignoreIncoming:
+            modifiedFrameData.baseTransform = self._computeBaseTransform(frame)
             return
 
-        self._blockCallbacks = True
-
-        for frameId, frameData in self.frames.items():
-            if frameData.ref() is None:
-                self._removeFrameId(frameId)
-            elif frameId != modifiedFrameId:
-
-                #print '  ', self, 'moving:', self.frames[frameId].ref().getProperty('Name')
-                self._moveFrame(frameId, modifiedFrameId)
+        # T_m * inv(B_m), shared by all the dependent frames
+        delta = np.linalg.solve(modifiedFrameData.baseTransform.T, transformUtils.getNumpyFromTransform(frame.transform).T).T
 
-        self._blockCallbacks = False
+        self._blockCallbacks = True
+        try:
+            for frameId, frameData in self.frames.items():
+                dependentFrame = frameData.ref()
+                if dependentFrame is None:
+                    self._removeFrameId(frameId)
+                elif frameId != modifiedFrameId:
+                    dependentFrame.copyFrame(transformUtils.getTransformFromNumpy(np.dot(delta, frameData.baseTransform)))
+        finally:
+            self._blockCallbacks = False
 
 
 class ViewOptionsItem(om.ObjectModelItem):
@@ -1094,6 +1213,194 @@ def pickProp(displayPoint, view):
     return None, None, None
 
 
+def _getNumpyMatrix(vtkMatrix):
+    return np.array([[vtkMatrix.GetElement(r, c) for c in xrange(4)] for r in xrange(4)])
+
+
+class ScreenSpacePointIndex(object):
+    '''
+    The display coordinates of the points of a point cloud actor, binned
+    into a grid of square pixel cells.  A point pick only needs to visit the
+    cells around the pick position instead of testing every point.  The
+    index is valid for the camera, viewport, actor transform and points it
+    was built with, see isValid.
+
+    The grid is sorted lazily, on the second pick with the same camera.  A
+    single pick after each camera change, the common case while navigating,
+    tests the projected points directly and skips the sort.
+    '''
+
+    cellSize = 8.0
+
+    def __init__(self, actor, renderer):
+        self.polyData = actor.GetMapper().GetInput()
+        self.key = self._getKey(actor, renderer)
+
+        camera = renderer.GetActiveCamera()
+        width, height = renderer.GetSize()
+        viewportOrigin = renderer.GetOrigin()
+        projection = _getNumpyMatrix(camera.GetCompositeProjectionTransformMatrix(renderer.GetTiledAspectRatio(), -1, 1))
+        self.modelToWorld = _getNumpyMatrix(actor.GetMatrix())
+        m = np.dot(projection, self.modelToWorld)
+
+        points = vnp.getNumpyFromVtk(self.polyData, 'Points')
+        clip = np.dot(points, m[:3,:3].T) + m[:3,3]
+        w = np.dot(points, m[3,:3]) + m[3,3]
+
+        inFront = np.flatnonzero(w > 0)
+        ndc = clip[inFront] / w[inFront][:,np.newaxis]
+        inside = np.logical_and(np.abs(ndc) <= 1.0, np.isfinite(ndc)).all(axis=1)
+
+        self.pointIds = inFront[inside]
+        ndc = ndc[inside]
+        self.depth = ndc[:,2]
+        self.display = np.column_stack(((ndc[:,0] + 1.0)*0.5*width + viewportOrigin[0],
+                                        (ndc[:,1] + 1.0)*0.5*height + viewportOrigin[1]))
+
+        self.cellOrigin = np.array(viewportOrigin, dtype=float)
+        self.gridHeight = int(np.ceil(height / self.cellSize)) + 1
+        self.sortedKeys = None
+        self.sortedIndices = None
+        self.numberOfPicks = 0
+
+    def _buildGrid(self):
+        cells = self._getCells(self.display)
+        keys = cells[:,0]*self.gridHeight + cells[:,1]
+        order = np.argsort(keys, kind='mergesort')
+        self.sortedKeys = keys[order]
+        self.sortedIndices = order
+
+    def _getCandidatesFromGrid(self, displayPoint, tolerance):
+        if self.sortedKeys is None:
+            self._buildGrid()
+
+        lo = self._getCells((displayPoint - tolerance)[np.newaxis,:])[0]
+        hi = self._getCells((displayPoint + tolerance)[np.newaxis,:])[0]
+        lo[1] = max(lo[1], 0)
+        hi[1] = min(hi[1], self.gridHeight - 1)
+        if lo[1] > hi[1]:
+            return np.zeros(0, dtype=np.int64)
+
+        candidates = []
+        for cellX in xrange(lo[0], hi[0] + 1):
+            start = np.searchsorted(self.sortedKeys, cellX*self.gridHeight + lo[1], side='left')
+            end = np.searchsorted(self.sortedKeys, cellX*self.gridHeight + hi[1], side='right')
+            if end > start:
+                candidates.append(self.sortedIndices[start:end])
+
+        return np.concatenate(candidates) if candidates else np.zeros(0, dtype=np.int64)
+
+    @staticmethod
+    def _getKey(actor, renderer):
+        polyData = actor.GetMapper().GetInput()
+        points = polyData.GetPoints()
+        matrix = actor.GetMatrix()
+        return (polyData.GetMTime(), points.GetMTime() if points else 0,
+                tuple(matrix.GetElement(r, c) for r in xrange(4) for c in xrange(4)),
+                renderer.GetActiveCamera().GetMTime(), tuple(renderer.GetSize()), tuple(renderer.GetOrigin()))
+
+    def isValid(self, actor, renderer):
+        return actor.GetMapper().GetInput() is self.polyData and self._getKey(actor, renderer) == self.key
+
+    def _getCells(self, display):
+        return np.floor((display - self.cellOrigin) / self.cellSize).astype(np.int64)
+
+    def pick(self, displayPoint, tolerance):
+        '''
+        Returns (pointId, depth) for the point nearest to the camera among the
+        points within tolerance pixels of displayPoint, or None.
+        '''
+        displayPoint = np.array(displayPoint[:2], dtype=float)
+
+        self.numberOfPicks += 1
+        if self.numberOfPicks == 1:
+            candidates = np.flatnonzero(np.all(np.abs(self.display - displayPoint) <= tolerance, axis=1))
+        else:
+            candidates = self._getCandidatesFromGrid(displayPoint, tolerance)
+
+        if not len(candidates):
+            return None
+
+        distances = np.sqrt(np.sum((self.display[candidates] - displayPoint)**2, axis=1))
+        candidates = candidates[distances <= tolerance]
+        if not len(candidates):
+            return None
+
+        nearest = candidates[np.argmin(self.depth[candidates])]
+        return self.pointIds[nearest], self.depth[nearest]
+
+    def getWorldPoint(self, pointId):
+        point = vnp.getNumpyFromVtk(self.polyData, 'Points')[pointId]
+        return np.dot(self.modelToWorld[:3,:3], point) + self.modelToWorld[:3,3]
+
+
+# point clouds with at least this many points are picked with a
+# ScreenSpacePointIndex instead of a vtkPointPicker
+screenSpacePickMinPoints = 100000
+
+_screenSpaceIndexes = []
+_screenSpaceIndexCacheSize = 8
+
+
+def getScreenSpacePointIndex(actor, renderer):
+    '''
+    Returns a ScreenSpacePointIndex for the actor, reusing the cached index
+    if it is still valid.  Indexes for the most recently picked actors are
+    kept and rebuilt lazily when the camera, actor or points change.
+    '''
+    for i, (indexActor, indexRenderer, index) in enumerate(_screenSpaceIndexes):
+        if indexActor is actor and indexRenderer is renderer:
+            del _screenSpaceIndexes[i]
+            if not index.isValid(actor, renderer):
+                index = ScreenSpacePointIndex(actor, renderer)
+            _screenSpaceIndexes.insert(0, (actor, renderer, index))
+            return index
+
+    index = ScreenSpacePointIndex(actor, renderer)
+    _screenSpaceIndexes.insert(0, (actor, renderer, index))
+    del _screenSpaceIndexes[_screenSpaceIndexCacheSize:]
+    return index
+
+
+def _isIndexedPointCloud(prop):
+    if not isinstance(prop, vtk.vtkActor) or not prop.GetVisibility() or not prop.GetPickable():
+        return False
+    polyData = prop.GetMapper().GetInput() if prop.GetMapper() else None
+    if not isinstance(polyData, vtk.vtkPolyData) or polyData.GetNumberOfPoints() < screenSpacePickMinPoints:
+        return False
+    return polyData.GetNumberOfCells() == polyData.GetNumberOfVerts()
+
+
+def _getDisplayDepth(renderer, worldPoint):
+    renderer.SetWorldPoint(worldPoint[0], worldPoint[1], worldPoint[2], 1.0)
+    renderer.WorldToDisplay()
+    return renderer.GetDisplayPoint()[2]
+
+
+def _pickPointsWithIndex(displayPoint, renderer, props, tolerance):
+    '''
+    Picks the point clouds in props with screen space indexes.  The pick
+    tolerance is a fraction of the window diagonal, as for vtkPointPicker.
+    Returns (pickedPoint, pickedProp, pointId, displayDepth) or None.
+    '''
+    width, height = renderer.GetRenderWindow().GetSize()
+    tolerancePixels = max(tolerance*np.sqrt(width**2 + height**2), 1.0)
+
+    best = None
+    for prop in props:
+        index = getScreenSpacePointIndex(prop, renderer)
+        result = index.pick(displayPoint, tolerancePixels)
+        if result is not None and (best is None or result[1] < best[1]):
+            best = (index, prop, result[0], result[1])
+
+    if best is None:
+        return None
+
+    index, prop, pointId, _ = best
+    pickedPoint = index.getWorldPoint(pointId)
+    return pickedPoint, prop, pointId, _getDisplayDepth(renderer, pickedPoint)
+
+
 def pickPoint(displayPoint, view, obj=None, pickType='points', tolerance=0.01, returnNormal=False):
 
     assert pickType in ('points', 'cells', 'render')
@@ -1113,18 +1420,48 @@ def pickPoint(displayPoint, view, obj=None, pickType='points', tolerance=0.01, r
         picker.SetTolerance(tolerance)
 
 
+    pickList = None
     if obj:
         if isinstance(obj, list):
-            for o in obj:
-                picker.AddPickList(o.actor)
+            pickList = [o.actor for o in obj]
             obj = None
         else:
-            picker.AddPickList(obj.actor)
+            pickList = [obj.actor]
+
+    # large point clouds are picked with screen space indexes, and only the
+    # remaining props are tested by the vtk picker
+    indexedProps = []
+    if pickType == 'points':
+        renderer = view.renderer()
+        candidateProps = pickList
+        if candidateProps is None:
+            viewProps = renderer.GetViewProps()
+            candidateProps = [viewProps.GetItemAsObject(i) for i in xrange(viewProps.GetNumberOfItems())]
+        indexedProps = [prop for prop in candidateProps if _isIndexedPointCloud(prop)]
+        if indexedProps:
+            pickList = [prop for prop in candidateProps if not any(prop is p for p in indexedProps)]
+
+    if pickList is not None:
+        for prop in pickList:
+            picker.AddPickList(prop)
         picker.PickFromListOn()
 
-    picker.Pick(displayPoint[0], displayPoint[1], 0, view.renderer())
-    pickedProp = picker.GetViewProp()
-    pickedPoint = np.array(picker.GetPickPosition())
+    pickedPointId = None
+    if pickList is None or pickList:
+        picker.Pick(displayPoint[0], displayPoint[1], 0, view.renderer())
+        pickedProp = picker.GetViewProp()
+        pickedPoint = np.array(picker.GetPickPosition())
+        if pickType == 'points' and pickedProp:
+            pickedPointId = picker.GetPointId()
+    else:
+        pickedProp = None
+        pickedPoint = np.zeros(3)
+
+    if indexedProps:
+        indexedPick = _pickPointsWithIndex(displayPoint, view.renderer(), indexedProps, tolerance)
+        if indexedPick is not None and (not pickedProp or indexedPick[3] < _getDisplayDepth(view.renderer(), pickedPoint)):
+            pickedPoint, pickedProp, pickedPointId, _ = indexedPick
+
     pickedDataset = pickedProp.GetMapper().GetInput() if isinstance(pickedProp, vtk.vtkActor) else None
 
     pickedNormal = np.zeros(3)
@@ -1133,7 +1470,7 @@ def pickPoint(displayPoint, view, obj=None, pickType='points', tolerance=0.01, r
         if pickType == 'cells':
           pickedNormal = np.array(picker.GetPickNormal())
         elif pickType == 'points' and pickedDataset:
-          pointId = picker.GetPointId()
+          pointId = pickedPointId
           normals = pickedDataset.GetPointData().GetNormals()
           if normals:
               pickedNormal = np.array(normals.GetTuple3(pointId))
@@ -1153,19 +1490,64 @@ def mapMousePosition(widget, mouseEvent):
     return mousePosition.x(), widget.height - mousePosition.y()
 
 
+# caches for the prop and dataset lookups done on every pick.  Props are
+# registered when their objects are created.  Entries are checked against the
+# object model when they are used, so stale entries for removed objects or
+# replaced datasets are never returned.
+_objectByDataSet = weakref.WeakValueDictionary()
+_objectByProp = weakref.WeakValueDictionary()
+
+
+def _registerPropObject(prop, obj):
+    _objectByProp[prop.GetAddressAsString('vtkObject')] = obj
+
+
+def _isDataSetOfObject(obj, polyData):
+    return obj is not None and om.hasObject(obj) and obj.hasDataSet(polyData)
+
+
+def _isPropOfObject(obj, prop):
+    if obj is None or not om.hasObject(obj):
+        return False
+    if isinstance(prop, vtk.vtkActor):
+        return obj.hasDataSet(prop.GetMapper().GetInput())
+    return isinstance(obj, FrameItem) and obj.widget.GetRepresentation() == prop
+
+
 def getObjectByDataSet(polyData):
+    key = polyData.GetAddressAsString('vtkObject') if polyData else None
+    obj = _objectByDataSet.get(key)
+    if _isDataSetOfObject(obj, polyData):
+        return obj
+
     for obj in om.getObjects():
         if obj.hasDataSet(polyData):
+            _objectByDataSet[key] = obj
             return obj
 
 def getObjectByProp(prop):
     if not prop:
         return None
+
+    key = prop.GetAddressAsString('vtkObject')
+    obj = _objectByProp.get(key)
+    if _isPropOfObject(obj, prop):
+        return obj
+
+    # the object that owns an actor is found by its dataset.  This is only
+    # reached for actors that were not registered, or whose registered
+    # object does not own the dataset, such as a sensor item that wraps a
+    # PolyDataItem that is not in the object model
+    if isinstance(prop, vtk.vtkActor):
+        obj = getObjectByDataSet(prop.GetMapper().GetInput())
+        if obj is not None:
+            _objectByProp[key] = obj
+        return obj
+
     for obj in om.getObjects():
         if isinstance(obj, FrameItem) and obj.widget.GetRepresentation() == prop:
+            _objectByProp[key] = obj
             return obj
-    if isinstance(prop, vtk.vtkActor):
-        return getObjectByDataSet(prop.GetMapper().GetInput())
 
 
 def findPickedObject(displayPoint, view):
@@ -10,8 +10,8 @@ def main():
     meshCollection = lcmobjectcollection.LCMObjectCollection('MESH_COLLECTION_COMMAND')
     affordanceCollection = lcmobjectcollection.LCMObjectCollection('AFFORDANCE_COLLECTION_COMMAND')
 
-    meshCollection.sendEchoRequest()
-    affordanceCollection.sendEchoRequest()
+    meshCollection.sendSnapshotRequest()
+    affordanceCollection.sendSnapshotRequest()
 
     def printCollection():
         print
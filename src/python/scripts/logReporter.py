@@ -2,10 +2,12 @@ import os
 import sys
 import time
 import lcm
+import multiprocessing
 import numpy as np
 import matplotlib.pyplot as plt
 import datetime as dt
 from ddapp import lcmspy as spy
+from ddapp import lcmlogcolumns
 import scipy.signal as sig
 
 def sizeof_fmt(num, suffix='B'):
@@ -18,8 +20,9 @@ def sizeof_fmt(num, suffix='B'):
 
 
 class LCMLogAnalyzer(object):
-    def __init__(self, logFile):
+    def __init__(self, logFile, numberOfWorkers=1):
         self.logFile = logFile
+        self.numberOfWorkers = numberOfWorkers
         self.jointVelocityTimes = list()
         self.jointVelocityNorms = list()
         self.jointVelocities = list()
@@ -31,32 +34,28 @@ class LCMLogAnalyzer(object):
         self.movementThreshold = 0.4
 
     def parseLog(self):
-        log = lcm.EventLog(self.logFile, 'r')
-        print 'Log size: ' + sizeof_fmt(log.size())
-        log.seek(0)
-        
-        while True:
-            event = log.read_next_event()
-            if not event:
-                break
-            timestamp = event.timestamp
-            if event.channel == 'EST_ROBOT_STATE':
-                msg = spy.decodeMessage(event.data)
-                self.jointVelocityTimes.append(timestamp)
-                self.jointVelocityNorms.append(np.linalg.norm(msg.joint_velocity))
-            elif event.channel == 'ATLAS_BATTERY_DATA':
-                msg = spy.decodeMessage(event.data)
-                self.batteryTimes.append(timestamp)
-                self.batteryPercentage.append(msg.remaining_charge_percentage)
-            elif event.channel == 'ATLAS_STATUS':
-                msg = spy.decodeMessage(event.data)
-                self.pressureTimes.append(timestamp)
-                self.pressureReadings.append(msg.pump_supply_pressure)
+        print 'Log size: ' + sizeof_fmt(os.path.getsize(self.logFile))
+
+        tables = lcmlogcolumns.extractColumns(self.logFile, ['EST_ROBOT_STATE.joint_velocity',
+                                                             'ATLAS_BATTERY_DATA.remaining_charge_percentage',
+                                                             'ATLAS_STATUS.pump_supply_pressure'],
+                                              numberOfWorkers=self.numberOfWorkers)
+
+        robotState = tables['EST_ROBOT_STATE']
+        self.jointVelocityTimes = robotState['timestamp']
+        self.jointVelocities = robotState['joint_velocity']
+        self.jointVelocityNorms = np.sqrt(np.sum(np.square(self.jointVelocities), axis=1)) if len(self.jointVelocities) else np.zeros(0)
+
+        self.batteryTimes = tables['ATLAS_BATTERY_DATA']['timestamp']
+        self.batteryPercentage = tables['ATLAS_BATTERY_DATA']['remaining_charge_percentage']
+
+        self.pressureTimes = tables['ATLAS_STATUS']['timestamp']
+        self.pressureReadings = tables['ATLAS_STATUS']['pump_supply_pressure']
 
         print 'parsed ' + str(len(self.jointVelocityNorms)) + ' robot states'
         print 'parsed ' + str(len(self.batteryPercentage)) + ' battery states'
         print 'parsed ' + str(len(self.pressureReadings)) + ' pump readings'
-        
+
     def movingAverage(self, x):
         N = self.slidingWindowWidth
         return np.convolve(x, np.ones((N,))/N)[(N-1):]
@@ -119,14 +118,15 @@ class LCMLogAnalyzer(object):
 def main(argv):
 
     try:
-        logFile = sys.argv[1]
-    except IndexError:
-        print 'Usage: %s <log file>' % sys.argv[0]
+        logFile = argv[1]
+        numberOfWorkers = int(argv[2]) if len(argv) > 2 else multiprocessing.cpu_count()
+    except (IndexError, ValueError):
+        print 'Usage: %s <log file> [number of workers, defaults to the number of cpus]' % argv[0]
         sys.exit(1)
 
     spy.findLCMModulesInSysPath()
     
-    parser = LCMLogAnalyzer(logFile)
+    parser = LCMLogAnalyzer(logFile, numberOfWorkers=numberOfWorkers)
     
     parser.parseLog()
     parser.plotResults()
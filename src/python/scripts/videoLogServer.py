@@ -8,9 +8,11 @@ import glob
 import json
 import re
 import select
+import collections
 import numpy as np
 
 from ddapp import lcmspy as spy
+from ddapp import lcmlogindex
 
 
 VIDEO_LCM_URL = 'udpm://239.255.76.50:7650?ttl=1'
@@ -26,22 +28,77 @@ class FieldData(object):
         return 'FieldData(%s)' % ', '.join(['%s=%r' % (k,v) for k, v in self.__dict__.iteritems()])
 
 
-def getRecentUtimes(utimeMap, seconds):
-
-    utimes = np.array(utimeMap.keys())
-    if not len(utimes):
+class VideoCatalog(object):
+    '''
+    A snapshot of the video frames of the cataloged logs.  The frames of each
+    log are kept as the (utime, offset) records of its index, which are sorted
+    by utime, so lookups are binary searches and no map of all the frames is
+    built.  If timeWindow is given, only the frames within timeWindow seconds
+    of the last frame are included.
+    '''
+
+    def __init__(self, logEvents, timeWindow=None):
+
+        logEvents = [(filename, events) for filename, events in logEvents if len(events)]
+        if timeWindow is not None and logEvents:
+            startTime = max(events['utime'][-1] for _, events in logEvents) - timeWindow*1e6
+            logEvents = [(filename, events[events['utime'].searchsorted(startTime):]) for filename, events in logEvents]
+            logEvents = [(filename, events) for filename, events in logEvents if len(events)]
+
+        self.filenames = [filename for filename, _ in logEvents]
+        self.events = [events for _, events in logEvents]
+
+    def isEmpty(self):
+        return not self.events
+
+    def getRecentUtimes(self, seconds):
+        '''
+        Returns the sorted utimes of the frames within the given number of
+        seconds of the last frame, or None if there are no frames.
+        '''
+        if not self.events:
+            return None
+
+        endTime = max(events['utime'][-1] for events in self.events)
+        startTime = max(0, endTime - seconds*1e6)
+        utimes = np.concatenate([events['utime'][events['utime'].searchsorted(startTime):] for events in self.events])
+
+        # logs are cataloged in filename order, which only needs a sort if
+        # the logs overlap in time
+        if np.any(np.diff(utimes) < 0):
+            utimes = np.sort(utimes, kind='mergesort')
+        return utimes
+
+    def getFrame(self, utime):
+        '''
+        Returns the (filename, offset) of the frame with the given utime, or
+        None.
+        '''
+        for filename, events in zip(self.filenames, self.events):
+            utimes = events['utime']
+            i = utimes.searchsorted(utime)
+            if i < len(utimes) and utimes[i] == utime:
+                return filename, int(events['offset'][i])
         return None
 
-    utimes.sort()
-    endTime = utimes[-1]
-    startTime = max(0, endTime - seconds*1e6)
-    startIndex = utimes.searchsorted(startTime)
-    utimes = utimes[startIndex:]
+    def findUtime(self, utime):
+        '''
+        Returns the utime of the first frame at or after utime, clamped to the
+        last frame, or None if there are no frames.
+        '''
+        if not self.events:
+            return None
 
-    if not len(utimes):
-        return None
+        candidates = []
+        for events in self.events:
+            utimes = events['utime']
+            i = utimes.searchsorted(utime)
+            if i < len(utimes):
+                candidates.append(utimes[i])
 
-    return utimes
+        if candidates:
+            return min(candidates)
+        return max(events['utime'][-1] for events in self.events)
 
 
 class LCMPoller(object):
@@ -56,25 +113,75 @@ class LCMPoller(object):
             self.lc.handle()
 
 
+class FrameCache(object):
+    '''
+    A thread safe LRU cache of decoded video frames keyed by utime.
+    '''
+
+    def __init__(self, maxFrames):
+        self.maxFrames = maxFrames
+        self.frames = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, utime):
+        with self.lock:
+            frame = self.frames.pop(utime, None)
+            if frame is not None:
+                self.frames[utime] = frame
+            return frame
+
+    def contains(self, utime):
+        with self.lock:
+            return utime in self.frames
+
+    def put(self, utime, frame):
+        with self.lock:
+            self.frames.pop(utime, None)
+            self.frames[utime] = frame
+            while len(self.frames) > self.maxFrames:
+                self.frames.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+
+
 class LogLookup(object):
 
-    def __init__(self):
-        self.utimeMap = None
+    def __init__(self, cacheSize=256):
+        self.catalog = None
         self.logs = {}
+        self.lock = threading.Lock()
+        self.cache = FrameCache(cacheSize)
 
-    def setUtimeMap(self, utimeMap):
-        self.utimeMap = utimeMap
+    def setCatalog(self, catalog):
+        self.catalog = catalog
+        self.cache.clear()
 
-    def getImage(self, utime):
-        filename, filepos = self.utimeMap[utime]
+    def hasFrame(self, utime):
+        return self.catalog is not None and self.catalog.getFrame(utime) is not None
 
-        log = self.logs.get(filename)
-        if log is None:
-            log = lcm.EventLog(filename, 'r')
-            self.logs[filename] = log
+    def getImage(self, utime):
+        frame = self.cache.get(utime)
+        if frame is None:
+            frame = self.readImage(utime)
+            self.cache.put(utime, frame)
+        return frame
+
+    def readImage(self, utime):
+        filename, filepos = self.catalog.getFrame(utime)
+
+        # the log files are shared by the playback, request and prefetch
+        # threads, so a seek and read must not be interleaved
+        with self.lock:
+            log = self.logs.get(filename)
+            if log is None:
+                log = lcm.EventLog(filename, 'r')
+                self.logs[filename] = log
+
+            log.seek(filepos)
+            event = log.read_next_event()
 
-        log.seek(filepos)
-        event = log.read_next_event()
         msg = spy.decodeMessage(event.data)
 
         if hasattr(msg, 'images'):
@@ -82,18 +189,70 @@ class LogLookup(object):
         return msg, filename
 
     def closeLogs(self):
-        for log in self.logs.values():
-            log.close()
-        self.logs = {}
+        with self.lock:
+            for log in self.logs.values():
+                log.close()
+            self.logs = {}
+        self.cache.clear()
+
+
+class FramePrefetcher(object):
+    '''
+    Reads frames into the LogLookup cache from a background thread, so that
+    playback and frame requests are served from memory.  Each call to
+    prefetch replaces the pending utimes, which are read in the order given.
+    '''
+
+    def __init__(self, logLookup):
+        self.logLookup = logLookup
+        self.pendingUtimes = collections.deque()
+        self.condition = threading.Condition()
+        self.shouldStop = False
+        self.thread = threading.Thread(target=self.mainLoop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def prefetch(self, utimes):
+        with self.condition:
+            self.pendingUtimes = collections.deque(utimes)
+            self.condition.notify()
+
+    def cancel(self):
+        self.prefetch([])
+
+    def stop(self):
+        with self.condition:
+            self.shouldStop = True
+            self.condition.notify()
+        self.thread.join()
+
+    def mainLoop(self):
+        while True:
+            with self.condition:
+                while not self.pendingUtimes and not self.shouldStop:
+                    self.condition.wait()
+                if self.shouldStop:
+                    return
+                utime = self.pendingUtimes.popleft()
+
+            if not self.logLookup.hasFrame(utime):
+                continue
+            if not self.logLookup.cache.contains(utime):
+                try:
+                    self.logLookup.getImage(utime)
+                except Exception as e:
+                    print 'failed to prefetch frame %d: %s' % (utime, e)
 
 
 class PlayThread(object):
 
-    def __init__(self, utimes, logLookup, speed):
+    def __init__(self, utimes, logLookup, speed, prefetcher=None):
         self.fps = 60
+        self.prefetchFrames = 30
         self.shouldStop = False
         self.utimes = utimes
         self.logLookup = logLookup
+        self.prefetcher = prefetcher
         self.speed = speed
         self.lc = lcm.LCM(VIDEO_LCM_URL)
 
@@ -106,9 +265,22 @@ class PlayThread(object):
     def stop(self):
         self.shouldStop = True
         self.thread.join()
+        if self.prefetcher:
+            self.prefetcher.cancel()
+
+    def prefetchAhead(self, elapsedUtime):
+        '''
+        Prefetches the frames that will be shown in the next display ticks.
+        At speeds above one, frames between the ticks are never read.
+        '''
+        tickUtimes = self.utimes[0] + elapsedUtime + np.arange(1, self.prefetchFrames+1) * (1e6 * self.speed / self.fps)
+        indices = np.unique(self.utimes.searchsorted(tickUtimes))
+        indices = indices[indices < len(self.utimes)]
+        self.prefetcher.prefetch(self.utimes[indices].tolist())
 
     def mainLoop(self):
         startTime = time.time()
+        nextFrameTime = startTime
 
         while not self.shouldStop:
 
@@ -119,6 +291,9 @@ class PlayThread(object):
             if utimeIndex == len(self.utimes):
                 break
 
+            if self.prefetcher:
+                self.prefetchAhead(elapsedUtime)
+
             utimeRequest = self.utimes[utimeIndex]
             image, filename = self.logLookup.getImage(utimeRequest)
 
@@ -126,19 +301,24 @@ class PlayThread(object):
 
             self.lc.publish('VIDEO_PLAYBACK_IMAGE', image.encode())
 
-            time.sleep(1.0 / self.fps)
+            # sleep until the next display tick, so that the time spent
+            # reading and publishing a frame does not accumulate as drift
+            nextFrameTime = max(nextFrameTime + 1.0 / self.fps, time.time())
+            time.sleep(max(0.0, nextFrameTime - time.time()))
 
 
 class ServerThread(object):
 
-    def __init__(self, sharedUtimeMap):
+    def __init__(self, catalogThread):
 
-        self.sharedUtimeMap = sharedUtimeMap
+        self.catalogThread = catalogThread
         self.utimes = None
         self.playbackThread = None
         self.syncThread = None
         self.timeWindow = 60
+        self.prefetchFrames = 15
         self.logLookup = LogLookup()
+        self.prefetcher = FramePrefetcher(self.logLookup)
         self.lc = lcm.LCM(VIDEO_LCM_URL)
         self.lc.subscribe('VIDEO_PLAYBACK_CONTROL', self.onControlMessage)
 
@@ -164,8 +344,8 @@ class ServerThread(object):
 
         if self.utimes is None:
 
-            self.logLookup.setUtimeMap(dict(self.sharedUtimeMap))
-            self.utimes = getRecentUtimes(self.logLookup.utimeMap, seconds=self.timeWindow)
+            self.logLookup.setCatalog(self.catalogThread.getCatalog())
+            self.utimes = self.logLookup.catalog.getRecentUtimes(seconds=self.timeWindow)
 
             if self.utimes is None:
                 print 'no utimes cataloged'
@@ -182,9 +362,24 @@ class ServerThread(object):
 
         self.lc.publish('VIDEO_PLAYBACK_IMAGE', image.encode())
 
+        self.prefetchAround(int(utimeIndex))
+
+
+    def prefetchAround(self, utimeIndex):
+        '''
+        Prefetches the neighbors of a requested frame, nearest first, so that
+        scrubbing the slider is served from the frame cache.
+        '''
+        indices = []
+        for offset in xrange(1, self.prefetchFrames+1):
+            indices.extend([utimeIndex + offset, utimeIndex - offset])
+        indices = [i for i in indices if 0 <= i < len(self.utimes)]
+        self.prefetcher.prefetch(self.utimes[indices].tolist())
+
 
     def onResume(self, data):
         self.stopPlaybackThread()
+        self.prefetcher.cancel()
         self.utimes = None
         self.logLookup.closeLogs()
         return
@@ -200,7 +395,7 @@ class ServerThread(object):
 
         startIndex = self.getUtimeIndex(data)
         playbackUtimes = self.utimes[startIndex:]
-        self.playbackThread = PlayThread(playbackUtimes, self.logLookup, speed=data.speed)
+        self.playbackThread = PlayThread(playbackUtimes, self.logLookup, speed=data.speed, prefetcher=self.prefetcher)
         self.playbackThread.start()
 
 
@@ -215,7 +410,7 @@ class ServerThread(object):
 
 
     def onLogSync(self):
-        self.syncThread = LogSyncThread(self.sharedUtimeMap)
+        self.syncThread = LogSyncThread(self.catalogThread)
         self.syncThread.start()
 
 
@@ -248,10 +443,9 @@ class ServerThread(object):
 
 class LogSyncThread(object):
 
-    def __init__(self, sharedUtimeMap):
+    def __init__(self, catalogThread):
 
-        self.sharedUtimeMap = sharedUtimeMap
-        self.utimes = None
+        self.catalogThread = catalogThread
         self.logLookup = LogLookup()
         self.lastPublishTime = time.time()
         self.publishFrequency = 1/60.0
@@ -282,21 +476,13 @@ class LogSyncThread(object):
 
     def onFrameRequest(self, utimeRequest):
 
-        if self.logLookup.utimeMap is None:
-
-            self.logLookup.setUtimeMap(dict(self.sharedUtimeMap))
-            assert len(self.logLookup.utimeMap)
-
-            self.utimes = np.array(self.logLookup.utimeMap.keys())
-            self.utimes.sort()
+        if self.logLookup.catalog is None:
 
+            self.logLookup.setCatalog(self.catalogThread.getCatalog())
+            assert not self.logLookup.catalog.isEmpty()
 
-        requestIndex = self.utimes.searchsorted(utimeRequest)
 
-        if requestIndex >= len(self.utimes):
-            requestIndex = len(self.utimes)-1
-
-        utimeFrame =  self.utimes[requestIndex]
+        utimeFrame = self.logLookup.catalog.findUtime(utimeRequest)
 
 
         image, filename = self.logLookup.getImage(utimeFrame)
@@ -331,8 +517,10 @@ class CatalogThread(object):
         self.pruneEnabled = True
         self.maxNumberOfFiles = 30
         self.cropTimeWindow = 60*30
-        self.utimeMap = {}
-        self.catalog = {}
+        self.logFiles = []
+        self.indexes = {}
+        self.videoEvents = {}
+        self.lock = threading.Lock()
 
 
     def start(self):
@@ -358,59 +546,48 @@ class CatalogThread(object):
         if self.pruneEnabled:
             logFiles = self.pruneLogFiles(logFiles, self.maxNumberOfFiles)
 
+        for filename in self.indexes.keys():
+            if filename not in logFiles:
+                del self.indexes[filename]
+
+        with self.lock:
+            for filename in self.videoEvents.keys():
+                if filename not in logFiles:
+                    del self.videoEvents[filename]
+            self.logFiles = logFiles
+
         for logFile in logFiles:
             self.updateLogInfo(logFile)
 
+    def getCatalog(self):
+        '''
+        Returns a VideoCatalog of the frames of the last cropTimeWindow
+        seconds of the cataloged logs.
+        '''
+        with self.lock:
+            logEvents = [(filename, self.videoEvents[filename])
+                            for filename in self.logFiles if filename in self.videoEvents]
+        return VideoCatalog(logEvents, self.cropTimeWindow)
+
 
     def updateLogInfo(self, filename):
 
-        fieldData = self.catalog.get(filename)
+        # the log index is persistent, so after a restart only the events
+        # written since the last update are scanned.  The indexes are only
+        # used by this thread, so the scan runs without the lock, and only
+        # the updated video events are published to getCatalog under it.
+        index = self.indexes.get(filename)
 
-        if not fieldData:
+        if not index:
             print 'discovered new file:', filename
-            fieldData = FieldData(filename=filename, fileSize=0, lastFilePos=0, channelTypes={})
-            self.catalog[filename] = fieldData
-            self.cropUtimeMap(self.utimeMap, self.cropTimeWindow)
-
-
-        log = lcm.EventLog(filename, 'r')
-        fileSize = log.size()
-
-        # if the log file is the same size as the last time it was inspected
-        # then there is no more work to do, return.
-        if fileSize == fieldData.fileSize:
-            return
-
-        fieldData.fileSize = fileSize
-
-        # seek to the last processed event, if one exists, then read past it
-        if fieldData.lastFilePos > 0:
-            log.seek(fieldData.lastFilePos)
-            event = log.read_next_event()
-
+            index = lcmlogindex.LCMLogIndex(filename)
+            self.indexes[filename] = index
 
-        while True:
-
-            filepos = log.tell()
-            event = log.read_next_event()
-            if not event:
-                break
-
-            fieldData.lastFilePos = filepos
-            timestamp = event.timestamp
-            channel = event.channel
-
-            if channel == self.videoChannel:
-                self.utimeMap[timestamp] = (filename, filepos)
-
-
-            # maintain a catalog of channelName->messageType
-            #if channel not in fieldData.channelTypes:
-            #    messageClass = spy.getMessageClass(event.data)
-            #    fieldData.channelTypes[channel] = messageClass
+        index.update()
+        videoEvents = index.getEvents(self.videoChannel)
 
-
-        log.close()
+        with self.lock:
+            self.videoEvents[filename] = videoEvents
 
 
     @staticmethod
@@ -440,24 +617,11 @@ class CatalogThread(object):
             filename = logFiles.pop(0)
             print 'deleting:', filename
             os.remove(filename)
+            lcmlogindex.removeIndex(filename)
 
         return logFiles
 
 
-    @staticmethod
-    def cropUtimeMap(utimeMap, timeWindow):
-
-        if not len(utimeMap):
-            return
-
-        utimes = getRecentUtimes(utimeMap, timeWindow)
-        cropTime = utimes[0]
-
-        for utime in utimeMap.keys():
-            if utime < cropTime:
-                del utimeMap[utime]
-
-
 def main():
 
     try:
@@ -472,7 +636,7 @@ def main():
     catalogThread.start()
 
 
-    serverThread = ServerThread(catalogThread.utimeMap)
+    serverThread = ServerThread(catalogThread)
     serverThread.start()
 
     try:
@@ -122,6 +122,12 @@ class VideoPlayer(object):
         self.ui.seekBackwardButton.visible = False
         self.ui.timeLabel.visible = False
 
+        # slider changes are coalesced so that dragging the slider sends at
+        # most one frame request per timer tick
+        self.frameRequestPending = False
+        self.frameRequestTimer = TimerCallback(targetFps=30)
+        self.frameRequestTimer.callback = self.sendPendingFrameRequest
+
         self.ui.slider.connect('valueChanged(int)', self.onSliderChanged)
         self.ui.resumeButton.connect('clicked()', self.onResumeClicked)
         self.ui.logSyncButton.connect('clicked()', self.onLogSyncClicked)
@@ -189,9 +195,17 @@ class VideoPlayer(object):
         return (self.ui.slider.value/float(self.ui.slider.maximum))
 
     def onSliderChanged(self, sliderValue):
-        self.sendCommand('VIDEO_PLAYBACK_CONTROL', command='request_frame', value=self.getSliderValue(), pid=self.pid)
+        self.frameRequestPending = True
+        if not self.frameRequestTimer.isActive():
+            self.frameRequestTimer.start()
         self.cameraView.setImageName('VIDEO_PLAYBACK_IMAGE')
 
+    def sendPendingFrameRequest(self):
+        if not self.frameRequestPending:
+            return False
+        self.frameRequestPending = False
+        self.sendCommand('VIDEO_PLAYBACK_CONTROL', command='request_frame', value=self.getSliderValue(), pid=self.pid)
+
     def onPlayClicked(self):
         self.sendCommand('VIDEO_PLAYBACK_CONTROL', command='play', value=self.getSliderValue(), pid=self.pid, speed=self.ui.playbackSpeedSpin.value)
 
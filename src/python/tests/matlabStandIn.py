@@ -0,0 +1,108 @@
+'''
+A stand-in for a MATLAB process, used to test ddapp.matlab without MATLAB.
+
+Reads commands from stdin and prints the '>> ' prompt after each one.  It
+understands just enough of MATLAB for the bridge tests: assignment of
+matrix literals, disp, and the ddReadArray and ddWriteArray functions of
+the binary array channel.
+'''
+
+import re
+import sys
+import struct
+
+
+header = struct.Struct('<4sIII')
+variables = {}
+
+
+def parseMatrix(text):
+    rows = [row.replace(',', ' ').split() for row in text.strip()[1:-1].split(';')]
+    return [[float(x) for x in row] for row in rows if row]
+
+
+def evaluate(expression):
+    expression = expression.strip()
+    if expression.startswith('['):
+        return parseMatrix(expression)
+    if expression not in variables:
+        raise NameError("Undefined function or variable '%s'." % expression)
+    return variables[expression]
+
+
+def readArray(filename):
+    data = open(filename, 'rb').read()
+    magic, ndim, rows, cols = header.unpack_from(data)
+    values = struct.unpack_from('<%dd' % (rows*cols), data, header.size)
+    return [[values[col*rows + row] for col in range(cols)] for row in range(rows)]
+
+
+def writeArray(filename, matrix):
+    rows, cols = len(matrix), len(matrix[0]) if matrix else 0
+    values = [matrix[row][col] for col in range(cols) for row in range(rows)]
+    f = open(filename, 'wb')
+    f.write(header.pack(b'DDAR', 2, rows, cols))
+    f.write(struct.pack('<%dd' % len(values), *values))
+    f.close()
+
+
+def execute(command):
+    command = command.strip().rstrip(';')
+    if not command:
+        return
+
+    match = re.match(r"^ddWriteArray\('(.*)',(.*)\)$", command)
+    if match:
+        writeArray(match.group(1), evaluate(match.group(2)))
+        return
+
+    match = re.match(r'^disp\((.*)\)$', command)
+    if match:
+        for row in evaluate(match.group(1)):
+            sys.stdout.write('  '.join(repr(x) for x in row) + '\n')
+        sys.stdout.write('\n')
+        return
+
+    match = re.match(r"^(\w+)\s*=\s*ddReadArray\('(.*)'\)$", command)
+    if match:
+        variables[match.group(1)] = readArray(match.group(2))
+        return
+
+    match = re.match(r'^(\w+)\s*=(.*)$', command)
+    if match:
+        variables[match.group(1)] = evaluate(match.group(2))
+        return
+
+    raise NameError("Undefined function or variable '%s'." % command)
+
+
+def main():
+
+    command = ''
+    sys.stdout.write('>> ')
+    sys.stdout.flush()
+
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+
+        # lines ending in ... are continued on the next line
+        line = line.rstrip('\n')
+        if line.endswith('...'):
+            command += line[:-3]
+            continue
+        command += line
+
+        try:
+            execute(command)
+        except Exception as e:
+            sys.stdout.write('??? %s\n' % e)
+
+        command = ''
+        sys.stdout.write('>> ')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
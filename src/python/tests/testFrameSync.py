@@ -7,6 +7,8 @@ import ddapp.visualization as vis
 from ddapp import applogic
 from ddapp import vtkAll as vtk
 
+from ddapp import vtkNumpy as vnp
+import numpy as np
 import weakref
 
 
@@ -149,6 +151,47 @@ def main():
     assert t2.GetPosition() == (20.0, 5.0, 10.0)
 
 
+    # test frame trace is bounded by its capacity
+    t3 = vtk.vtkTransform()
+    f3 = vis.FrameItem('frame 3', t3, view=None)
+    om.addToObjectModel(f3)
+    trace = vis.FrameTraceVisualizer(f3, capacity=5)
+
+    for i in xrange(10):
+        t3.Translate(1,0,0)
+        t3.Modified()
+
+    assert trace.getPoints().shape == (5, 3)
+    assert trace.getPoints()[-1][0] == 10.0
+    assert trace.getTraceData().polyData.GetNumberOfPoints() == 5
+    assert trace.getTraceData().polyData.GetNumberOfLines() == 4
+
+    # positions are appended to the trace until a tenth of the capacity
+    # has been dropped, then the trace is rebuilt
+    trace.stop()
+    om.removeFromObjectModel(trace.getTraceData())
+    trace = vis.FrameTraceVisualizer(f3, capacity=20)
+    polyData = trace.getTraceData().polyData
+    for i in xrange(20):
+        t3.Translate(1,0,0)
+        t3.Modified()
+    assert trace.getTraceData().polyData is polyData
+    assert polyData.GetNumberOfPoints() == 21
+    assert polyData.GetNumberOfLines() == 20
+
+    for i in xrange(2):
+        t3.Translate(1,0,0)
+        t3.Modified()
+    assert polyData.GetNumberOfPoints() == 20
+    assert polyData.GetNumberOfLines() == 19
+    assert np.array_equal(vnp.getNumpyFromVtk(polyData, 'Points'), trace.getPoints())
+
+    trace.stop()
+    t3.Translate(1,0,0)
+    t3.Modified()
+    assert trace.getPoints()[-1][0] == 32.0
+
+
     sys.exit(0)
 
 if __name__ == '__main__':
@@ -0,0 +1,40 @@
+from ddapp import geometryencoder
+from ddapp import vtkNumpy as vnp
+from ddapp.debugVis import DebugData
+import numpy as np
+
+
+def getTestPolyData():
+    d = DebugData()
+    d.addSphere([0, 0, 0], radius=0.5)
+    d.addLine([0, 0, 0], [1, 0, 0])
+    return d.getPolyData()
+
+
+def testBinaryRoundTrip(compress):
+
+    polyData = getTestPolyData()
+    data = geometryencoder.encodePolyDataBinary(polyData, compress=compress)
+    decoded = geometryencoder.decodePolyDataBinary(data)
+
+    assert decoded.GetNumberOfPoints() == polyData.GetNumberOfPoints()
+    assert decoded.GetNumberOfPolys() == polyData.GetNumberOfPolys()
+    assert decoded.GetNumberOfLines() == polyData.GetNumberOfLines()
+    assert np.allclose(vnp.getNumpyFromVtk(decoded), vnp.getNumpyFromVtk(polyData), atol=1e-6)
+
+    polys = vnp.numpy_support.vtk_to_numpy(decoded.GetPolys().GetData())
+    expectedPolys = vnp.numpy_support.vtk_to_numpy(polyData.GetPolys().GetData())
+    assert np.array_equal(polys, expectedPolys)
+
+    # encoding is deterministic so it can be used as a content hash
+    assert geometryencoder.encodePolyDataBinary(decoded, compress=compress) == data
+
+
+def testEmptyPolyData():
+    data = geometryencoder.encodePolyDataBinary(DebugData().getPolyData())
+    assert geometryencoder.decodePolyDataBinary(data).GetNumberOfPoints() == 0
+
+
+testBinaryRoundTrip(compress=True)
+testBinaryRoundTrip(compress=False)
+testEmptyPolyData()
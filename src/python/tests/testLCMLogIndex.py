@@ -0,0 +1,103 @@
+import os
+import json
+import shutil
+import tempfile
+import lcm
+import numpy as np
+import bot_core
+from ddapp import lcmspy as spy
+from ddapp import lcmlogindex
+from ddapp import lcmlogcolumns
+
+
+def writeEvents(filename, events, mode):
+    log = lcm.EventLog(filename, mode)
+    for utime, channel, data in events:
+        log.write_event(utime, channel, data)
+    log.close()
+
+
+def main():
+
+    testDir = tempfile.mkdtemp()
+    filename = os.path.join(testDir, 'lcmlog-test.00')
+
+    try:
+        writeEvents(filename, [(1000 + i, 'CHANNEL_A' if i % 3 else 'CHANNEL_B', 'data %d' % i) for i in xrange(30)], 'w')
+
+        # the records are flushed to the index in batches
+        index = lcmlogindex.LCMLogIndex(filename)
+        index.flushSize = 7
+        assert index.update() == 30
+        assert index.getChannels() == ['CHANNEL_A', 'CHANNEL_B']
+        assert index.getMessageCount('CHANNEL_A') == 20
+        assert index.getMessageCount('CHANNEL_B') == 10
+        assert index.getTimeRange() == (1000, 1029)
+
+        eventId = index.findEvent('CHANNEL_B', 1004)
+        event = index.readEvent(index.getOffsets('CHANNEL_B')[eventId])
+        assert event.channel == 'CHANNEL_B'
+        assert event.timestamp == 1006
+        assert event.data == 'data 6'
+
+        events = list(index.iterEvents(['CHANNEL_B'], startUtime=1010, endUtime=1020))
+        assert [e.timestamp for e in events] == [1012, 1015, 1018]
+        index.close()
+
+        # the index is reloaded from disk and only the appended events are scanned
+        writeEvents(filename, [(2000 + i, 'CHANNEL_C', 'new data %d' % i) for i in xrange(5)], 'a')
+
+        index = lcmlogindex.LCMLogIndex(filename)
+        assert index.getMessageCount('CHANNEL_A') == 20
+        assert index.update() == 5
+        assert index.getMessageCount('CHANNEL_C') == 5
+        assert np.all(np.diff(index.getUtimes('CHANNEL_C')) > 0)
+        assert index.update() == 0
+        index.close()
+
+        # a log replaced by one of the same size is reindexed, into new
+        # record files, so records mapped from the old index stay valid
+        oldEvents = index.getEvents('CHANNEL_B')
+        writeEvents(filename, [(5000 + i, 'CHANNEL_D' if i % 3 else 'CHANNEL_B', 'data %d' % i) for i in xrange(30)], 'w')
+        writeEvents(filename, [(6000 + i, 'CHANNEL_C', 'new data %d' % i) for i in xrange(5)], 'a')
+
+        index = lcmlogindex.LCMLogIndex(filename)
+        assert index.update() == 35
+        assert index.getChannels() == ['CHANNEL_B', 'CHANNEL_C', 'CHANNEL_D']
+        assert index.getTimeRange() == (5000, 6004)
+        assert np.array_equal(oldEvents['utime'], 1000 + 3*np.arange(10))
+        index.close()
+
+        # test column extraction, in parallel and from the cache
+        spy.loadMessageTypes(spy.messageTypes, bot_core)
+        messages = []
+        for i in xrange(20):
+            msg = bot_core.utime_t()
+            msg.utime = 10*i
+            messages.append((3000 + i, 'UTIME', msg.encode()))
+        writeEvents(filename, messages, 'a')
+
+        for numberOfWorkers, useCache in [(1, False), (3, True), (3, True)]:
+            tables = lcmlogcolumns.extractColumns(filename, ['UTIME.utime'], numberOfWorkers=numberOfWorkers, useCache=useCache)
+            assert np.array_equal(tables['UTIME']['utime'], 10*np.arange(20))
+            assert np.array_equal(tables['UTIME']['timestamp'], 3000 + np.arange(20))
+
+        # a cache written for a different log is not used
+        index = lcmlogindex.getLogIndex(filename)
+        cacheMetaFilename = os.path.join(lcmlogcolumns._getCacheDirectory(index, ['UTIME.utime']), 'columns.json')
+        cacheMeta = json.load(open(cacheMetaFilename))
+        assert cacheMeta['header'] == index.getLogHeader()
+        cacheMeta['header'] = 'another log'
+        json.dump(cacheMeta, open(cacheMetaFilename, 'w'))
+        assert lcmlogcolumns._loadCache(os.path.dirname(cacheMetaFilename), index) is None
+        index.close()
+
+        lcmlogindex.removeIndex(filename)
+        assert not os.path.exists(lcmlogindex.getIndexDirectory(filename))
+
+    finally:
+        shutil.rmtree(testDir)
+
+
+if __name__ == '__main__':
+    main()
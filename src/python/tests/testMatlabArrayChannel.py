@@ -0,0 +1,91 @@
+import os
+import struct
+import numpy as np
+from ddapp import matlab
+
+
+def testCommunicator():
+    '''
+    Drives the bridge end to end against a stand-in for the MATLAB process,
+    through both the text console and the binary array channel.
+    '''
+    standIn = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'matlabStandIn.py')
+    comm = matlab.MatlabCommunicator(matlab.MatlabPipeClient(command=['python', standIn]))
+    comm.echoToStdOut = False
+    assert comm.waitForResult() == []
+
+    vector = [1.5, -2.0, 1e-9]
+    matrix = [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]
+    longVector = np.linspace(-1.0, 1.0, 1000).tolist()
+
+    for useArrayChannel in [False, True]:
+
+        if useArrayChannel:
+            comm.enableArrayChannel()
+
+        comm.assignFloatArray(vector, 'v')
+        assert comm.getFloatArray('v') == vector
+
+        comm.assignFloatArray(matrix, 'm')
+        assert comm.getFloatArray('m') == matrix
+
+        comm.assignFloatArray(longVector, 'q')
+        assert comm.getFloatArray('q') == longVector
+
+        try:
+            comm.getFloatArray('undefinedVariable')
+        except Exception:
+            pass
+        else:
+            assert False
+
+    filename = comm.arrayChannel.filename
+    comm.disableArrayChannel()
+    assert not os.path.exists(filename)
+
+    comm.client.proc.stdin.close()
+    comm.client.proc.wait()
+    assert not comm.isAlive()
+    assert comm.waitForResult() is None
+
+
+def main():
+
+    testCommunicator()
+
+    channel = matlab.MatlabArrayChannel()
+
+    try:
+        # arrays are stored column major, as ddReadArray expects
+        a = np.arange(6, dtype=float).reshape(2, 3)
+        channel.writeArray(a)
+        data = open(channel.filename, 'rb').read()
+        assert struct.unpack('<4sIII', data[:16]) == ('DDAR', 2, 2, 3)
+        assert np.array_equal(np.frombuffer(data[16:], dtype='<f8'), a.T.flatten())
+        assert np.array_equal(channel.readArray(), a)
+
+        # vectors are written as column vectors
+        channel.writeArray([1.0, 2.5, -3.0])
+        assert channel.readArray().shape == (3, 1)
+        assert channel.readArray()[:,0].tolist() == [1.0, 2.5, -3.0]
+
+        channel.writeArray(np.zeros((0, 0)))
+        assert channel.readArray().shape == (0, 0)
+
+        # a truncated file is an error
+        open(channel.filename, 'wb').write(data[:20])
+        try:
+            channel.readArray()
+        except IOError:
+            pass
+        else:
+            assert False
+
+    finally:
+        channel.clear()
+
+    assert not os.path.exists(channel.filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -51,6 +51,42 @@ def main():
     assert p2.children()[0] == c2
     assert c2.children() == []
 
+    c2.rename('renamed child item 2')
+    assert tree.findObjectByName('test child item 2') is None
+    assert tree.findObjectByName('renamed child item 2') == c2
+    assert p2.findChild('renamed child item 2') == c2
+    assert c2.findChild('renamed child item 2') is None
+
+    tree.removeFromObjectModel(c2)
+    assert tree.findObjectByName('renamed child item 2') is None
+    assert p2.children() == []
+
+    with tree.batchUpdates():
+        children = [om.ObjectModelItem('batch child %d' % i) for i in xrange(10)]
+        for child in children:
+            tree.addToObjectModel(child, p2)
+        children[0].rename('renamed batch child')
+        assert tree.isBatchUpdating()
+        assert tree.findObjectByName('renamed batch child') == children[0]
+        tree.removeFromObjectModel(children[-1])
+
+    assert not tree.isBatchUpdating()
+    assert len(p2.children()) == 9
+    assert p2.children() == children[:9]
+    assert children[0].parent() is p2
+    assert p2.parent() is None
+    assert tree.getTopLevelObjects() == [p2]
+
+    # removing a parent removes its descendants from the tree maps as well
+    grandchild = om.ObjectModelItem('grandchild')
+    tree.addToObjectModel(grandchild, children[1])
+    assert children[1].children() == [grandchild]
+    tree.removeFromObjectModel(children[1])
+    assert not tree.hasObject(grandchild)
+    assert grandchild.parent() is None
+    assert p2.children() == [children[0]] + children[2:9]
+    assert tree._getItemForObject(children[0]).text(0) == 'renamed batch child'
+
     objectTree2.show()
     propertiesPanel2.show()
 
@@ -0,0 +1,79 @@
+from ddapp import segmentationroutines
+from ddapp import vtkNumpy
+import numpy as np
+
+'''
+This tests the multi-model RANSAC in ddapp.segmentationroutines on a
+synthetic cloud of two planes with noise and outliers.
+'''
+
+
+def makePlanePoints(rng, numberOfPoints, origin, u, v, noise=0.003):
+    coords = rng.uniform(-1.0, 1.0, size=(numberOfPoints, 2))
+    points = np.asarray(origin) + coords[:,0:1]*np.asarray(u) + coords[:,1:2]*np.asarray(v)
+    return points + rng.normal(0.0, noise, size=points.shape)
+
+
+def makeTestCloud():
+    rng = np.random.RandomState(1)
+    floor = makePlanePoints(rng, 4000, [0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0])
+    wall = makePlanePoints(rng, 2500, [1.5, 0.0, 1.0], [0.0, 0.0, 0.5], [0.0, 1.0, 0.0])
+    outliers = rng.uniform(-1.0, 2.0, size=(500, 3))
+    return vtkNumpy.getVtkPolyDataFromNumpyPoints(np.vstack((floor, wall, outliers)))
+
+
+def testPlanesAreRecovered():
+
+    polyData = makeTestCloud()
+    planes = segmentationroutines.fitPlanes(polyData, maxModels=3, distanceThreshold=0.02, minInliers=200, seed=7)
+
+    assert len(planes) == 2
+    floor, wall = planes
+
+    assert abs(np.dot(floor.normal, [0.0, 0.0, 1.0])) > 0.999
+    assert abs(np.dot(floor.origin, floor.normal)) < 0.01
+    assert floor.inliers[:4000].sum() > 3900
+
+    assert abs(np.dot(wall.normal, [1.0, 0.0, 0.0])) > 0.999
+    assert abs(abs(np.dot(wall.origin, wall.normal)) - 1.5) < 0.01
+    assert wall.inliers[4000:6500].sum() > 2400
+
+
+def testSeedIsReproducible():
+
+    polyData = makeTestCloud()
+    first = segmentationroutines.fitPlanes(polyData, maxModels=3, minInliers=200, seed=3)
+    second = segmentationroutines.fitPlanes(polyData, maxModels=3, minInliers=200, seed=3)
+
+    assert len(first) == len(second)
+    for a, b in zip(first, second):
+        assert np.array_equal(a.origin, b.origin)
+        assert np.array_equal(a.normal, b.normal)
+        assert np.array_equal(a.inliers, b.inliers)
+
+
+def testPerpendicularAxis():
+
+    polyData = makeTestCloud()
+    planes = segmentationroutines.fitPlanes(polyData, maxModels=1, minInliers=200, perpendicularAxis=[1.0, 0.0, 0.0], seed=0)
+
+    assert len(planes) == 1
+    assert abs(np.dot(planes[0].normal, [1.0, 0.0, 0.0])) > 0.999
+
+
+def testRequiredHypotheses():
+
+    assert segmentationroutines.getRequiredHypotheses(1.0, 3, 0.99) == 1
+    assert segmentationroutines.getRequiredHypotheses(0.5, 3, 0.99) == 35
+    assert segmentationroutines.getRequiredHypotheses(0.1, 3, 0.99) > 256
+
+
+def main():
+    testPlanesAreRecovered()
+    testSeedIsReproducible()
+    testPerpendicularAxis()
+    testRequiredHypotheses()
+
+
+if __name__ == '__main__':
+    main()